@@ -1,21 +1,120 @@
+from collections import OrderedDict
 from datetime import datetime, timedelta
-from typing import Optional
+from threading import Lock
+from typing import Callable, List, Optional
 from jose import JWTError, jwt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Query, status
 from fastapi.security import OAuth2PasswordBearer
 from pydantic import BaseModel
+import hashlib
 import os
+import time
 
 JWT_SECRET_KEY = os.getenv("JWT_SECRET_KEY", "demo-secret-key-for-interview")
 JWT_ALGORITHM = "HS256"
 JWT_EXPIRATION_HOURS = 24
 
+# Verified tokens are cached so repeat requests skip the signature check;
+# JWT_CACHE_SIZE=0 disables the cache
+JWT_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "10000"))
+JWT_CACHE_TTL_SECONDS = int(os.getenv("JWT_CACHE_TTL_SECONDS", "300"))
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
+oauth2_scheme_optional = OAuth2PasswordBearer(tokenUrl="login", auto_error=False)
 
 
 class TokenData(BaseModel):
     email: str
     family_office_id: int
+    
+    class Config:
+        # Cached instances are shared between requests
+        frozen = True
+
+
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+class TokenCache:
+    """Bounded LRU cache of verified tokens, keyed by the token's SHA-256 digest.
+
+    An entry lives for at most ``ttl`` seconds and never past the token's own
+    ``exp``, so an expired token is always re-verified (and rejected).
+    """
+    
+    def __init__(self, maxsize: int = JWT_CACHE_SIZE, ttl: int = JWT_CACHE_TTL_SECONDS, clock=time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+    
+    def get(self, digest: str) -> Optional[TokenData]:
+        with self._lock:
+            entry = self._entries.get(digest)
+            if entry is None or entry[0] <= self.clock():
+                if entry is not None:
+                    del self._entries[digest]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return entry[1]
+    
+    def put(self, digest: str, token_data: TokenData, exp: Optional[float]):
+        if self.maxsize <= 0:
+            return
+        expires_at = self.clock() + self.ttl
+        if exp is not None:
+            expires_at = min(expires_at, exp)
+        with self._lock:
+            self._entries[digest] = (expires_at, token_data)
+            self._entries.move_to_end(digest)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+    
+    def invalidate(self, digest: str):
+        with self._lock:
+            self._entries.pop(digest, None)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+token_cache = TokenCache()
+
+# Revocation hooks: each is called as hook(digest, token_data) on every
+# request, cached or not, and returns True if the token must be rejected
+revocation_checks: List[Callable[[str, TokenData], bool]] = []
+
+# In-process denylist used by revoke_token: digest -> token expiry
+_revoked_tokens = {}
+
+
+def revoke_token(token: str, exp: Optional[float] = None):
+    """Reject ``token`` from now on in this process and drop it from the cache"""
+    digest = token_digest(token)
+    if exp is None:
+        exp = jwt.get_unverified_claims(token).get("exp")
+    _revoked_tokens[digest] = exp
+    token_cache.invalidate(digest)
+
+
+def _is_denylisted(digest: str, token_data: TokenData) -> bool:
+    if digest not in _revoked_tokens:
+        return False
+    exp = _revoked_tokens[digest]
+    if exp is not None and exp <= time.time():
+        # The token has expired anyway; forget it
+        del _revoked_tokens[digest]
+    return True
+
+
+revocation_checks.append(_is_denylisted)
 
 
 # Hardcoded demo users for interview
@@ -42,23 +141,44 @@ def create_access_token(data: dict) -> str:
 
 
 def verify_token(token: str = Depends(oauth2_scheme)) -> TokenData:
+    return decode_token(token)
+
+
+def verify_token_or_query(
+    token: Optional[str] = Depends(oauth2_scheme_optional),
+    access_token: Optional[str] = Query(None)
+) -> TokenData:
+    """Like verify_token, but also accepts ?access_token= for clients such as
+    EventSource that cannot send an Authorization header"""
+    return decode_token(token or access_token or "")
+
+
+def decode_token(token: str) -> TokenData:
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
     
-    try:
-        payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+    digest = token_digest(token)
+    token_data = token_cache.get(digest)
+    if token_data is None:
+        try:
+            payload = jwt.decode(token, JWT_SECRET_KEY, algorithms=[JWT_ALGORITHM])
+        except JWTError:
+            raise credentials_exception
         email: str = payload.get("email")
         family_office_id: int = payload.get("family_office_id")
         
         if email is None or family_office_id is None:
             raise credentials_exception
-            
-        return TokenData(email=email, family_office_id=family_office_id)
-    except JWTError:
+        
+        token_data = TokenData(email=email, family_office_id=family_office_id)
+        token_cache.put(digest, token_data, payload.get("exp"))
+    
+    if any(check(digest, token_data) for check in revocation_checks):
         raise credentials_exception
+    return token_data
 
 
 def authenticate_user(email: str, password: str) -> Optional[dict]:
@@ -0,0 +1,244 @@
+"""Scheduled payroll: one batch of runs for every office due in a pay period.
+
+Celery beat calls ``tasks.schedule_payroll_batch`` every
+PAYROLL_BATCH_CHECK_SECONDS. It creates the batch and a run for each office
+whose ``payroll_day`` has come, in one transaction, using a single scan of
+employees grouped by office for the headcounts. The offices are packed into
+groups of about PAYROLL_BATCH_GROUP_EMPLOYEES employees, and each group is one
+``tasks.process_payroll_group`` task, which reads all of its offices'
+employees with one scan ordered by office, a checkpoint batch at a time, and
+processes their runs in turn.
+
+Usage: python -m batches schedule
+       python -m batches report BATCH_ID
+"""
+import argparse
+import calendar
+import json
+import os
+from datetime import date, datetime
+from itertools import groupby, islice
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import case, exists, func, select, tuple_, update
+from sqlalchemy.exc import IntegrityError
+
+from models import Employee, FamilyOffice, PayrollBatch, PayrollRun, PayrollStatus
+from scheduling import route_run
+
+# How often beat looks for offices that are due
+BATCH_CHECK_SECONDS = float(os.getenv("PAYROLL_BATCH_CHECK_SECONDS", "3600"))
+
+# A group task takes offices until it has about this many employees, or this
+# many offices; a larger office is a group of its own
+BATCH_GROUP_EMPLOYEES = int(os.getenv("PAYROLL_BATCH_GROUP_EMPLOYEES", "5000"))
+BATCH_GROUP_OFFICES = int(os.getenv("PAYROLL_BATCH_GROUP_OFFICES", "50"))
+
+
+class DueOffice(NamedTuple):
+    office_id: int
+    employees: int
+
+
+class RunGroup(NamedTuple):
+    payroll_run_ids: List[int]
+    employees: int
+
+
+def pay_period(day: date) -> str:
+    return day.strftime("%Y-%m")
+
+
+def due_offices(db, today: date) -> List[DueOffice]:
+    """Offices whose pay day in ``today``'s month has come and that have no run for the period yet"""
+    period = pay_period(today)
+    last_day = calendar.monthrange(today.year, today.month)[1]
+    pay_day = case((FamilyOffice.payroll_day > last_day, last_day), else_=FamilyOffice.payroll_day)
+    headcounts = select(
+        Employee.family_office_id, func.count(Employee.id).label("employees")
+    ).group_by(Employee.family_office_id).subquery()
+    rows = db.execute(
+        select(FamilyOffice.id, func.coalesce(headcounts.c.employees, 0))
+        .outerjoin(headcounts, headcounts.c.family_office_id == FamilyOffice.id)
+        .where(
+            FamilyOffice.payroll_day.is_not(None),
+            pay_day <= today.day,
+            ~exists().where(PayrollRun.family_office_id == FamilyOffice.id, PayrollRun.pay_period == period)
+        )
+        .order_by(FamilyOffice.id)
+    ).all()
+    return [DueOffice(office_id, employees) for office_id, employees in rows]
+
+
+def create_batch(db, offices: List[DueOffice], today: date) -> Optional[Tuple[PayrollBatch, List[PayrollRun]]]:
+    """Create a batch with one pending run per due office, in one transaction.
+
+    Returns None when no office is due, or when a concurrent scheduler
+    created the period's runs first.
+    """
+    if not offices:
+        return None
+    period = pay_period(today)
+    batch = PayrollBatch(
+        pay_period=period, office_count=len(offices), employee_count=sum(office.employees for office in offices)
+    )
+    db.add(batch)
+    db.flush()
+    runs = [
+        PayrollRun(
+            family_office_id=office.office_id, status=PayrollStatus.PENDING, batch_id=batch.id,
+            pay_period=period, queue=route_run(office.employees).queue
+        )
+        for office in offices
+    ]
+    db.add_all(runs)
+    try:
+        db.commit()
+    except IntegrityError:
+        db.rollback()
+        return None
+    return batch, runs
+
+
+def group_runs(runs: List[PayrollRun], employees: Dict[int, int],
+               max_employees: int = BATCH_GROUP_EMPLOYEES, max_offices: int = BATCH_GROUP_OFFICES) -> List[RunGroup]:
+    """Pack runs, in office order, into groups of about ``max_employees`` employees.
+
+    ``employees`` maps office IDs to headcounts.
+    """
+    groups = []
+    current, count = [], 0
+    for run in sorted(runs, key=lambda run: run.family_office_id):
+        headcount = employees.get(run.family_office_id, 0)
+        if current and (count + headcount > max_employees or len(current) >= max_offices):
+            groups.append(RunGroup(current, count))
+            current, count = [], 0
+        current.append(run.id)
+        count += headcount
+    if current:
+        groups.append(RunGroup(current, count))
+    return groups
+
+
+def _office_employee_rows(bind, office_ids: List[int], page_size: int) -> Iterator:
+    """Employee rows of ``office_ids`` ordered by office and ID, read ``page_size`` at a time.
+
+    Each page is a keyset query on a connection of its own, so no cursor or
+    transaction stays open while the runs commit in between.
+    """
+    after = None
+    while True:
+        query = select(Employee.family_office_id, Employee.id, Employee.name, Employee.salary).where(
+            Employee.family_office_id.in_(office_ids)
+        )
+        if after is not None:
+            query = query.where(tuple_(Employee.family_office_id, Employee.id) > tuple_(*after))
+        with bind.connect() as conn:
+            page = conn.execute(query.order_by(Employee.family_office_id, Employee.id).limit(page_size)).all()
+        if not page:
+            return
+        yield from page
+        after = (page[-1].family_office_id, page[-1].id)
+
+
+def _batched(rows: Iterator, batch_size: int) -> Iterator[list]:
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def office_employees(bind, office_ids: List[int], batch_size: int) -> Iterator[Tuple[int, Iterator[list]]]:
+    """(office ID, its employee rows in batches of ``batch_size``) for each of ``office_ids`` in order.
+
+    All offices are read by one scan, a page of ``batch_size`` rows at a
+    time, so memory does not grow with the group. Rows carry id, name and
+    salary, which is all a run needs. An office's batches must be consumed
+    before the next office is taken; whatever is left of them is skipped.
+    """
+    office_ids = sorted(office_ids)
+    offices = groupby(_office_employee_rows(bind, office_ids, batch_size), key=lambda row: row.family_office_id)
+    current = next(offices, None)
+    for office_id in office_ids:
+        if current is not None and current[0] == office_id:
+            yield office_id, _batched(current[1], batch_size)
+            current = next(offices, None)
+        else:
+            yield office_id, iter(())
+
+
+def finish_batch(db, batch_id: int) -> bool:
+    """Mark the batch completed if none of its runs is pending or processing.
+
+    Returns True only for the caller that completed it.
+    """
+    unfinished = db.query(PayrollRun.id).filter(
+        PayrollRun.batch_id == batch_id,
+        PayrollRun.status.in_((PayrollStatus.PENDING, PayrollStatus.PROCESSING))
+    ).first()
+    if unfinished is not None:
+        return False
+    result = db.execute(
+        update(PayrollBatch).where(PayrollBatch.id == batch_id, PayrollBatch.completed_at.is_(None))
+        .values(completed_at=datetime.utcnow())
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def batch_report(db, batch_id: int) -> dict:
+    """Wall-clock time of a batch and each office's run timing"""
+    batch = db.get(PayrollBatch, batch_id)
+    if batch is None:
+        raise ValueError(f"Payroll batch {batch_id} not found")
+    runs = db.query(PayrollRun).filter(PayrollRun.batch_id == batch_id).order_by(PayrollRun.family_office_id)
+    offices = []
+    for run in runs:
+        seconds = None
+        if run.started_at and run.completed_at:
+            seconds = round((run.completed_at - run.started_at).total_seconds(), 3)
+        offices.append({
+            "family_office_id": run.family_office_id,
+            "payroll_run_id": run.id,
+            "status": run.status.value,
+            "employees": (run.reused_count or 0) + (run.rebuilt_count or 0) if run.completed_at else None,
+            "queue_wait_seconds": round((run.started_at - run.created_at).total_seconds(), 3)
+            if run.started_at else None,
+            "seconds": seconds,
+        })
+    return {
+        "batch_id": batch.id,
+        "pay_period": batch.pay_period,
+        "office_count": batch.office_count,
+        "employee_count": batch.employee_count,
+        "created_at": batch.created_at.isoformat(),
+        "completed_at": batch.completed_at.isoformat() if batch.completed_at else None,
+        "wall_seconds": round((batch.completed_at - batch.created_at).total_seconds(), 3)
+        if batch.completed_at else None,
+        "offices": offices,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scheduled payroll batches")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("schedule", help="create and queue a batch for the offices due today")
+    report = subcommands.add_parser("report", help="print a batch's timings")
+    report.add_argument("batch_id", type=int)
+    args = parser.parse_args()
+
+    if args.command == "schedule":
+        from tasks import schedule_payroll_batch
+        print(json.dumps(schedule_payroll_batch(), indent=2))
+    else:
+        from database import SessionLocal
+        db = SessionLocal()
+        try:
+            print(json.dumps(batch_report(db, args.batch_id), indent=2))
+        finally:
+            db.close()
+
+
+if __name__ == "__main__":
+    main()
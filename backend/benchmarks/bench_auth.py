@@ -0,0 +1,43 @@
+"""Per-request JWT verification cost with the token cache on and off.
+
+Simulates a stream of authenticated requests from a pool of active users
+(each reusing their token), as the verify_token dependency sees them.
+
+Usage: python -m benchmarks.bench_auth [--requests 200000] [--users 1000]
+"""
+import argparse
+import random
+import time
+
+import auth
+from auth import TokenCache, create_access_token, decode_token
+
+
+def run(tokens, requests, cache_size):
+    auth.token_cache = TokenCache(maxsize=cache_size)
+    sequence = random.Random(7).choices(tokens, k=requests)
+    start = time.perf_counter()
+    for token in sequence:
+        decode_token(token)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=200000)
+    parser.add_argument("--users", type=int, default=1000)
+    args = parser.parse_args()
+
+    tokens = [
+        create_access_token({"email": f"user{i}@demo.com", "family_office_id": i % 50 + 1})
+        for i in range(args.users)
+    ]
+    print(f"{'cache':>6} {'seconds':>9} {'us/request':>11} {'requests/s':>12}")
+    for label, cache_size in (("off", 0), ("on", auth.JWT_CACHE_SIZE)):
+        elapsed = run(tokens, args.requests, cache_size)
+        print(f"{label:>6} {elapsed:>9.3f} {elapsed / args.requests * 1e6:>11.2f} "
+              f"{args.requests / elapsed:>12.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Batch net-pay calculation vs. the scalar calculate_net_pay.
+
+Usage: python -m benchmarks.bench_calculations [--sizes 10000,100000,1000000]
+"""
+import argparse
+import time
+from decimal import Decimal
+
+import numpy as np
+
+from calculations import calculate_pay_batch, DEFAULT_TAX_TABLE
+from tasks import calculate_net_pay
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,100000,1000000")
+    args = parser.parse_args()
+
+    print(f"{'employees':>10} {'scalar s':>10} {'batch cents s':>14} {'batch Decimal s':>16} {'speedup':>8}")
+    for size in [int(n) for n in args.sizes.split(",")]:
+        cents = np.random.default_rng(42).integers(3_000_000, 20_000_000, size, dtype=np.int64)
+        decimals = [Decimal(int(c)).scaleb(-2) for c in cents]
+
+        scalar = timed(lambda: [calculate_net_pay(s) for s in decimals])
+        batch_cents = timed(lambda: calculate_pay_batch(cents, DEFAULT_TAX_TABLE))
+        batch_decimal = timed(lambda: calculate_pay_batch(decimals, DEFAULT_TAX_TABLE))
+        print(f"{size:>10} {scalar:>10.4f} {batch_cents:>14.4f} {batch_decimal:>16.4f} "
+              f"{scalar / batch_cents:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+"""Bulk employee import throughput and peak memory.
+
+Generates a CSV of --rows employees and imports it twice (inserts, then
+updates) into --database-url (a scratch SQLite file by default; point it at
+PostgreSQL to measure the COPY path).
+
+Usage: python -m benchmarks.bench_import [--rows 1000000] [--database-url URL]
+"""
+import argparse
+import csv
+import os
+import resource
+import tempfile
+import time
+
+from sqlalchemy import create_engine
+
+from bulk_io import import_employees, iter_csv_rows
+from models import Base, FamilyOffice
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=1_000_000)
+    parser.add_argument("--database-url")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        csv_path = os.path.join(workdir, "employees.csv")
+        with open(csv_path, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow(("external_id", "name", "salary"))
+            for i in range(args.rows):
+                writer.writerow((f"E{i:07d}", f"Employee {i}", f"{40000 + (i * 137) % 90000}.{i % 100:02d}"))
+
+        engine = create_engine(args.database_url or f"sqlite:///{os.path.join(workdir, 'bench.db')}")
+        Base.metadata.create_all(engine)
+        with engine.begin() as conn:
+            office_id = conn.execute(
+                FamilyOffice.__table__.insert().values(name=f"Import benchmark {time.time()}", scheduling_weight=1)
+            ).inserted_primary_key[0]
+
+        print(f"{'pass':>8} {'rows':>9} {'seconds':>8} {'rows/s':>9} {'peak RSS MB':>12}")
+        for label in ("insert", "update"):
+            start = time.perf_counter()
+            with open(csv_path, "rb") as f:
+                report = import_employees(engine, office_id, iter_csv_rows(f))
+            elapsed = time.perf_counter() - start
+            peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+            print(f"{label:>8} {report.rows:>9} {elapsed:>8.1f} {report.rows / elapsed:>9.0f} {peak_mb:>12.0f}")
+        engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Individual pay stub rendering throughput vs. the number of render workers.
+
+Runs fan their stub chunks out as ``tasks.render_stub_chunk`` subtasks. Each
+measurement runs that task's body, including the JSON messages, in N local
+processes standing in for N render worker processes, so it shows how stubs
+per second scale with the render workers, without the broker's latency.
+
+Usage: python -m benchmarks.bench_render [--employees 400] [--workers 1,2,4,8]
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from calculations import calculate_pay_batch, DEFAULT_TAX_TABLE
+from pay_stubs import DEFAULT_STUB_TEMPLATE, stub_period
+from tasks import StubEmployee, render_stub_chunk, stub_job_message
+
+
+def make_jobs(count):
+    """(StubEmployee, PayLine) pairs, as a run renders them"""
+    salaries = [Decimal(40000 + (i * 137) % 90000) for i in range(count)]
+    batch = calculate_pay_batch(salaries, DEFAULT_TAX_TABLE)
+    return [
+        (StubEmployee(i + 1, f"Employee {i + 1}", salary), pay)
+        for i, (salary, pay) in enumerate(zip(salaries, batch.lines()))
+    ]
+
+
+def chunk_messages(jobs, chunk_size):
+    """The arguments of the render subtasks a run sends for ``jobs``"""
+    template = DEFAULT_STUB_TEMPLATE.model_dump()
+    period = stub_period(DEFAULT_STUB_TEMPLATE)
+    return [
+        # Round-tripped like a broker message
+        json.loads(json.dumps(([stub_job_message(*job) for job in jobs[i:i + chunk_size]], template, period)))
+        for i in range(0, len(jobs), chunk_size)
+    ]
+
+
+def start_worker():
+    """Nothing to do: unpickling this function imported the worker stack"""
+
+
+def render_chunk(message):
+    return render_stub_chunk.run(*message)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--employees", type=int, default=400)
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--workers", default=",".join(
+        str(n) for n in sorted({1, 2, 4, os.cpu_count() or 1})
+    ))
+    args = parser.parse_args()
+
+    messages = chunk_messages(make_jobs(args.employees), args.chunk_size)
+    print(f"{'workers':>8} {'seconds':>10} {'stubs/s':>10} {'speedup':>8}")
+    baseline = None
+    for workers in [int(w) for w in args.workers.split(",")]:
+        with tempfile.TemporaryDirectory() as storage_root:
+            os.environ["PAYROLL_STORAGE_BACKEND"] = "local"
+            os.environ["PAYROLL_STORAGE_ROOT"] = storage_root
+            # Started before timing, like idle render workers
+            with multiprocessing.get_context("spawn").Pool(workers, initializer=start_worker) as pool:
+                pool.map(abs, range(workers), chunksize=1)
+                start = time.perf_counter()
+                pool.map(render_chunk, messages, chunksize=1)
+                elapsed = time.perf_counter() - start
+        rate = args.employees / elapsed
+        baseline = baseline or rate
+        print(f"{workers:>8} {elapsed:>10.3f} {rate:>10.1f} {rate / baseline:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
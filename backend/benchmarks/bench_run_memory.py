@@ -0,0 +1,106 @@
+"""Peak memory of one payroll run over a large office.
+
+A scratch SQLite database is seeded with one office of --employees employees
+in a separate process. Then a fresh interpreter imports the worker, records
+its resident set size, runs process_payroll eagerly over the whole office and
+reports the peak RSS and how much the run added to it, also per 100k
+employees.
+
+Usage: python -m benchmarks.bench_run_memory [--employees 100000]
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SEED = """
+import sys
+from datetime import datetime
+from sqlalchemy import insert
+from database import engine
+from models import Base, Employee, FamilyOffice, PayrollRun, PayrollStatus
+
+employees = int(sys.argv[1])
+Base.metadata.create_all(engine)
+with engine.begin() as conn:
+    office_id = conn.execute(insert(FamilyOffice).values(name="Memory benchmark")).inserted_primary_key[0]
+    for start in range(0, employees, 10000):
+        conn.execute(insert(Employee), [
+            {"family_office_id": office_id, "name": f"Employee {i}", "salary": 40000 + (i * 137) % 90000,
+             "created_at": datetime.utcnow()}
+            for i in range(start, min(start + 10000, employees))
+        ])
+    conn.execute(insert(PayrollRun).values(
+        family_office_id=office_id, status=PayrollStatus.PENDING, created_at=datetime.utcnow()
+    ))
+"""
+
+RUN = """
+import json, resource, time
+import tasks
+from events import ProgressPublisher
+
+
+class NullRedis:
+    def publish(self, channel, message):
+        pass
+
+
+def rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+tasks.ProgressPublisher = lambda run_id: ProgressPublisher(run_id, client=NullRedis())
+before = rss_mb()
+start = time.perf_counter()
+result = tasks.process_payroll.apply(args=(1,))
+if result.failed():
+    raise result.result
+print(json.dumps({
+    "seconds": time.perf_counter() - start,
+    "employees": result.result["employees_processed"],
+    "rss_before_mb": before,
+    "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def python(code, *args, env):
+    result = subprocess.run(
+        [sys.executable, "-c", code, *map(str, args)], cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return result.stdout
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--employees", type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(
+            os.environ,
+            DATABASE_URL=f"sqlite:///{os.path.join(workdir, 'memory.db')}",
+            CELERY_BROKER_URL="memory://",
+            CELERY_RESULT_BACKEND="cache+memory://",
+            PAYROLL_STORAGE_ROOT=os.path.join(workdir, "storage"),
+        )
+        env.pop("ASYNC_DATABASE_URL", None)
+        python(SEED, args.employees, env=env)
+        result = json.loads(python(RUN, env=env).strip().splitlines()[-1])
+
+    growth = result["peak_rss_mb"] - result["rss_before_mb"]
+    print(f"{result['employees']} employees in {result['seconds']:.1f} s")
+    print(f"RSS before run {result['rss_before_mb']:.1f} MB, peak {result['peak_rss_mb']:.1f} MB")
+    print(f"run added {growth:.1f} MB ({growth * 100000 / max(result['employees'], 1):.1f} MB per 100k employees)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""JSON encoding time of employee lists and payroll runs, per 10k rows.
+
+Compares, for the same rows:
+
+- pydantic: every object validated through its response model from its
+  attributes, then encoded by FastAPI's default JSONResponse (how an endpoint
+  returning ORM objects with a response_model is serialized)
+- standard: plain dicts (salaries converted to float) and JSONResponse, the
+  current default of GET /employees
+- fast: the PAYROLL_FAST_JSON path, rows encoded with orjson directly
+
+Usage: python -m benchmarks.bench_serialization [--rows 10000] [--repeats 5]
+"""
+import argparse
+import time
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import List
+
+from fastapi.responses import JSONResponse
+from pydantic import TypeAdapter
+
+from main import EmployeeResponse, PayrollRunResponse, employee_row, payroll_run_content
+from models import Employee, PayrollRun, PayrollStatus
+from responses import FastJSONResponse
+
+FIELDS = ["id", "name", "salary"]
+
+
+def best_of(repeats, encode):
+    """Fastest of ``repeats`` encodings, in seconds, and the body size"""
+    times = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        body = encode()
+        times.append(time.perf_counter() - start)
+    return min(times), len(body)
+
+
+def pydantic_body(adapter, objects):
+    return JSONResponse(adapter.dump_python(adapter.validate_python(objects, from_attributes=True), mode="json")).body
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    rows = [(i, f"Employee {i}", Decimal(40000 + (i * 137) % 90000) + Decimal("0.25")) for i in range(args.rows)]
+    employees = [Employee(id=i, name=name, salary=salary) for i, name, salary in rows]
+    created = datetime(2024, 3, 1, 9, 0, 0, 123456)
+    runs = [
+        PayrollRun(
+            id=i, status=PayrollStatus.COMPLETED, created_at=created, completed_at=created + timedelta(minutes=i % 60),
+            incremental=bool(i % 2), reused_count=i % 100, rebuilt_count=100 - i % 100
+        )
+        for i in range(args.rows)
+    ]
+    employee_adapter = TypeAdapter(List[EmployeeResponse])
+    run_adapter = TypeAdapter(List[PayrollRunResponse])
+
+    cases = [
+        ("employees", "pydantic", lambda: pydantic_body(employee_adapter, employees)),
+        ("employees", "standard", lambda: JSONResponse([employee_row(FIELDS, row) for row in rows]).body),
+        ("employees", "fast", lambda: FastJSONResponse([dict(zip(FIELDS, row)) for row in rows]).body),
+        ("payroll runs", "pydantic", lambda: pydantic_body(run_adapter, runs)),
+        ("payroll runs", "fast", lambda: FastJSONResponse([payroll_run_content(run) for run in runs]).body),
+    ]
+    per_10k = 10000 / args.rows
+    print(f"{'rows':>12} {'path':>9} {'ms/10k rows':>12} {'MB/s':>8}")
+    for name, path, encode in cases:
+        seconds, size = best_of(args.repeats, encode)
+        print(f"{name:>12} {path:>9} {seconds * per_10k * 1000:>12.2f} {size / seconds / 2 ** 20:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""API cold start and first-request latency, lazy versus eager startup.
+
+Each sample starts a fresh interpreter that imports the app, runs its
+startup handlers and then sends a first GET /employees and POST /payroll/run
+in-process. "eager" reproduces the old startup (tables created and demo data
+seeded on boot, worker modules imported with the API); "lazy" is the default,
+against a database migrated beforehand with init_db.py. The broker is
+in-memory, so only the client side of publishing is measured.
+
+Usage: python -m benchmarks.bench_startup [--repeats 5]
+"""
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SAMPLE = """
+import asyncio, json, sys, time
+start = time.perf_counter()
+if sys.argv[1] == "eager":
+    import tasks
+import main
+imported = time.perf_counter()
+
+async def run():
+    import httpx
+    from auth import create_access_token
+    await main.app.router.startup()
+    started = time.perf_counter()
+    headers = {"Authorization": "Bearer " + create_access_token({"email": "smith@demo.com", "family_office_id": 1})}
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench") as client:
+        response = await client.get("/employees", headers=headers)
+        assert response.status_code == 200, response.text
+        listed = time.perf_counter()
+        response = await client.post("/payroll/run", json={"employee_ids": [1]}, headers=headers)
+        assert response.status_code == 200, response.text
+        submitted = time.perf_counter()
+    return started, listed, submitted
+
+started, listed, submitted = asyncio.run(run())
+print(json.dumps({
+    "import_ms": (imported - start) * 1000,
+    "startup_ms": (started - imported) * 1000,
+    "first_list_ms": (listed - started) * 1000,
+    "first_submit_ms": (submitted - listed) * 1000,
+    "ready_ms": (started - start) * 1000,
+}))
+"""
+
+
+def sample(mode, database_path, workdir):
+    env = dict(
+        os.environ,
+        DATABASE_URL=f"sqlite:///{database_path}",
+        CELERY_BROKER_URL="memory://",
+        PAYROLL_STORAGE_ROOT=workdir,
+        PAYROLL_BOOTSTRAP_DB="true" if mode == "eager" else "false",
+    )
+    env.pop("ASYNC_DATABASE_URL", None)
+    result = subprocess.run(
+        [sys.executable, "-c", SAMPLE, mode], cwd=BACKEND_DIR, env=env, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise RuntimeError(result.stderr)
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    columns = ("import_ms", "startup_ms", "ready_ms", "first_list_ms", "first_submit_ms")
+    print(f"{'mode':>6} " + " ".join(f"{column:>15}" for column in columns))
+    with tempfile.TemporaryDirectory() as workdir:
+        migrated = os.path.join(workdir, "migrated.db")
+        subprocess.run(
+            [sys.executable, "init_db.py"], cwd=BACKEND_DIR, check=True, capture_output=True,
+            env=dict(os.environ, DATABASE_URL=f"sqlite:///{migrated}")
+        )
+        for mode in ("eager", "lazy"):
+            samples = []
+            for repeat in range(args.repeats):
+                # The old startup created and seeded the schema on every boot;
+                # lazy samples get their own copy so no submission is coalesced
+                database_path = os.path.join(workdir, f"{mode}-{repeat}.db")
+                if mode == "lazy":
+                    shutil.copy(migrated, database_path)
+                samples.append(sample(mode, database_path, workdir))
+            medians = [statistics.median(s[column] for s in samples) for column in columns]
+            print(f"{mode:>6} " + " ".join(f"{value:>15.1f}" for value in medians))
+
+
+if __name__ == "__main__":
+    main()
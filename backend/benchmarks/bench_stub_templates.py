@@ -0,0 +1,54 @@
+"""Per-stub CPU time and output size of the pay stub renderers.
+
+Compares the combined document with the template's static layer cached as
+a form XObject against redrawing the full stub on every page (the previous
+behaviour), plus the per-employee reportlab files.
+
+Usage: python -m benchmarks.bench_stub_templates [--employees 5000]
+"""
+import argparse
+import os
+import tempfile
+import time
+from decimal import Decimal
+
+from calculations import calculate_pay_batch, DEFAULT_TAX_TABLE
+from pay_stubs import PayStubDocument, generate_pay_stub_pdf
+from tasks import StubEmployee
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--employees", type=int, default=5000)
+    parser.add_argument("--individual", type=int, default=500, help="stubs for the per-file renderer")
+    args = parser.parse_args()
+
+    salaries = [Decimal(40000 + (i * 137) % 90000) for i in range(args.employees)]
+    batch = calculate_pay_batch(salaries, DEFAULT_TAX_TABLE)
+    jobs = [
+        (StubEmployee(i + 1, f"Employee {i + 1}", salary), pay)
+        for i, (salary, pay) in enumerate(zip(salaries, batch.lines()))
+    ]
+
+    print(f"{'renderer':>28} {'us CPU/stub':>12} {'bytes/stub':>11}")
+    with tempfile.TemporaryDirectory() as pdf_dir:
+        for label, cached in (("combined, full page redraw", False), ("combined, cached template", True)):
+            path = os.path.join(pdf_dir, f"combined_{cached}.pdf")
+            start = time.process_time()
+            with PayStubDocument(path, cache_static_layer=cached) as document:
+                for employee, pay in jobs:
+                    document.add_stub(employee, pay)
+            elapsed = time.process_time() - start
+            print(f"{label:>28} {elapsed / len(jobs) * 1e6:>12.1f} {os.path.getsize(path) / len(jobs):>11.0f}")
+
+        subset = jobs[:args.individual]
+        start = time.process_time()
+        for employee, pay in subset:
+            generate_pay_stub_pdf(employee, pay, os.path.join(pdf_dir, f"{employee.id}.pdf"))
+        elapsed = time.process_time() - start
+        size = sum(os.path.getsize(os.path.join(pdf_dir, f"{e.id}.pdf")) for e, _ in subset)
+        print(f"{'individual reportlab files':>28} {elapsed / len(subset) * 1e6:>12.1f} {size / len(subset):>11.0f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,281 @@
+"""Load test of the API and end-to-end timing of payroll runs.
+
+Seeds --offices synthetic family offices of --employees each into a scratch
+database, then drives /login, /employees and /payroll/run concurrently
+(--concurrency requests in flight) through the ASGI app in-process. Runs are
+published to an in-memory Celery broker; afterwards one full run per office
+is executed eagerly with process_payroll, without Redis or RabbitMQ.
+
+Throughput, p50/p99 latency and peak RSS are written to --output as JSON,
+together with the commit and settings, so results of two commits can be
+compared: pass the older file as --baseline to print the change per metric.
+
+Usage: python -m benchmarks.load_test [--offices 4] [--employees 1000]
+           [--requests 200] [--concurrency 16] [--output load_test.json]
+           [--baseline previous.json] [--database-url URL]
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+# Metrics compared against a baseline; latencies and RSS regress upwards
+_HIGHER_IS_BETTER = {"throughput_rps", "employees_per_second"}
+
+
+class _NullRedis:
+    def publish(self, channel, message):
+        pass
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of a non-empty list"""
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def summarize(latencies, elapsed, errors):
+    """Throughput and latency percentiles (milliseconds) of one endpoint"""
+    if not latencies:
+        return {"requests": 0, "errors": errors}
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 2),
+    }
+
+
+def peak_rss_mb():
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def configure_environment(workdir, database_url):
+    """Point the app at scratch storage, the database and an in-memory broker.
+
+    Must run before the application modules are imported, since they read
+    their settings at import time.
+    """
+    os.environ["DATABASE_URL"] = database_url or f"sqlite:///{os.path.join(workdir, 'load_test.db')}"
+    os.environ.pop("ASYNC_DATABASE_URL", None)
+    os.environ["CELERY_BROKER_URL"] = "memory://"
+    os.environ["CELERY_RESULT_BACKEND"] = "cache+memory://"
+    os.environ["PAYROLL_STORAGE_ROOT"] = os.path.join(workdir, "storage")
+    os.makedirs(os.environ["PAYROLL_STORAGE_ROOT"])
+
+
+def seed(engine, offices, employees):
+    """Create the offices and their employees; returns {office_id: [employee_id, ...]}"""
+    from sqlalchemy import insert, select
+
+    from models import Base, Employee, FamilyOffice
+
+    Base.metadata.create_all(engine)
+    seeded = {}
+    stamp = int(time.time())
+    with engine.begin() as conn:
+        for number in range(offices):
+            office_id = conn.execute(
+                insert(FamilyOffice).values(name=f"Load test {stamp}-{number}", scheduling_weight=1)
+            ).inserted_primary_key[0]
+            conn.execute(insert(Employee), [
+                {"family_office_id": office_id, "name": f"Employee {number}-{i}",
+                 "salary": 40000 + (i * 137) % 90000, "created_at": datetime.utcnow()}
+                for i in range(employees)
+            ])
+            seeded[office_id] = conn.execute(
+                select(Employee.id).where(Employee.family_office_id == office_id).order_by(Employee.id)
+            ).scalars().all()
+    return seeded
+
+
+async def drive(client, name, requests, concurrency, make_request):
+    """Send ``requests`` requests, ``concurrency`` at a time; returns the summary"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def one(index):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await make_request(client, index)
+            latency = time.perf_counter() - start
+            if response.status_code >= 400:
+                errors += 1
+            else:
+                latencies.append(latency)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(index) for index in range(requests)))
+    result = summarize(latencies, time.perf_counter() - start, errors)
+    print(f"{name:>16} {result['requests']:>8} {errors:>7} {result.get('throughput_rps', 0):>10.1f} "
+          f"{result.get('p50_ms', 0):>9.2f} {result.get('p99_ms', 0):>9.2f}")
+    return result
+
+
+async def load_api(seeded, requests, concurrency):
+    import httpx
+
+    import main
+    from auth import DEMO_USERS, create_access_token
+
+    tokens = {
+        office_id: {"Authorization": "Bearer " + create_access_token(
+            {"email": f"load-test-{office_id}@demo.com", "family_office_id": office_id}
+        )}
+        for office_id in seeded
+    }
+    office_ids = list(seeded)
+    demo_users = list(DEMO_USERS.items())
+    rng = random.Random(7)
+    # Each submission is a different half of the office, so identical
+    # requests are not coalesced into one run
+    selections = []
+    for index in range(requests):
+        office_id = office_ids[index % len(office_ids)]
+        employee_ids = seeded[office_id]
+        selections.append((office_id, rng.sample(employee_ids, max(1, len(employee_ids) // 2))))
+
+    async def login(client, index):
+        email, user = demo_users[index % len(demo_users)]
+        return await client.post("/login", data={"username": email, "password": user["password"]})
+
+    async def employees(client, index):
+        return await client.get("/employees", headers=tokens[office_ids[index % len(office_ids)]])
+
+    async def payroll_run(client, index):
+        office_id, employee_ids = selections[index]
+        return await client.post("/payroll/run", json={"employee_ids": employee_ids}, headers=tokens[office_id])
+
+    print(f"{'endpoint':>16} {'requests':>8} {'errors':>7} {'req/s':>10} {'p50 ms':>9} {'p99 ms':>9}")
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://load-test") as client:
+        return {
+            "login": await drive(client, "/login", requests, concurrency, login),
+            "employees": await drive(client, "/employees", requests, concurrency, employees),
+            "payroll_run": await drive(client, "/payroll/run", requests, concurrency, payroll_run),
+        }
+
+
+def time_payroll_runs(engine, seeded):
+    """Process one run of every employee per office eagerly; returns the summary"""
+    from sqlalchemy import insert
+
+    import tasks
+    from events import ProgressPublisher
+    from models import PayrollRun, PayrollStatus
+    from scheduling import route_run
+
+    tasks.ProgressPublisher = lambda run_id: ProgressPublisher(run_id, client=_NullRedis())
+    durations = []
+    employees = 0
+    for office_id, employee_ids in seeded.items():
+        with engine.begin() as conn:
+            run_id = conn.execute(insert(PayrollRun).values(
+                family_office_id=office_id, status=PayrollStatus.PENDING, created_at=datetime.utcnow(),
+                queue=route_run(len(employee_ids)).queue
+            )).inserted_primary_key[0]
+        start = time.perf_counter()
+        result = tasks.process_payroll.apply(args=(run_id,))
+        durations.append(time.perf_counter() - start)
+        if result.failed():
+            raise RuntimeError(f"Payroll run {run_id} failed: {result.result!r}")
+        employees += result.result["employees_processed"]
+    total = sum(durations)
+    summary = {
+        "runs": len(durations),
+        "employees": employees,
+        "seconds": round(total, 3),
+        "employees_per_second": round(employees / total, 1),
+        "p50_ms": round(percentile(durations, 0.50) * 1000, 2),
+        "p99_ms": round(percentile(durations, 0.99) * 1000, 2),
+    }
+    print(f"process_payroll: {summary['runs']} runs, {employees} employees in {total:.2f} s "
+          f"({summary['employees_per_second']:.0f} employees/s)")
+    return summary
+
+
+def compare(results, baseline):
+    """Print each metric's change against a baseline result file"""
+    pairs = [("peak_rss_mb", results["peak_rss_mb"], baseline.get("peak_rss_mb"))]
+    for section, metrics in results["results"].items():
+        for metric, value in metrics.items():
+            if metric in _HIGHER_IS_BETTER or metric.endswith("_ms"):
+                before = baseline.get("results", {}).get(section, {}).get(metric)
+                pairs.append((f"{section}.{metric}", value, before))
+    print(f"\nchange against {baseline.get('commit') or 'baseline'}:")
+    for name, value, before in pairs:
+        if not before:
+            continue
+        change = (value - before) / before * 100
+        worse = change < 0 if name.rsplit(".", 1)[-1] in _HIGHER_IS_BETTER else change > 0
+        print(f"  {name}: {before} -> {value} ({change:+.1f}%{' worse' if worse else ''})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--offices", type=int, default=4)
+    parser.add_argument("--employees", type=int, default=1000, help="employees per office")
+    parser.add_argument("--requests", type=int, default=200, help="requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--output", default="load_test.json")
+    parser.add_argument("--baseline", help="earlier --output file to compare against")
+    parser.add_argument("--database-url", help="default: a scratch SQLite file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as workdir:
+        configure_environment(workdir, args.database_url)
+        from database import engine
+
+        seeded = seed(engine, args.offices, args.employees)
+        api_results = asyncio.run(load_api(seeded, args.requests, args.concurrency))
+        run_results = time_payroll_runs(engine, seeded)
+        engine.dispose()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+        "settings": {
+            "offices": args.offices,
+            "employees": args.employees,
+            "requests": args.requests,
+            "concurrency": args.concurrency,
+            "database": "sqlite" if not args.database_url else args.database_url.split(":", 1)[0],
+        },
+        "results": {**api_results, "process_payroll": run_results},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"peak RSS {results['peak_rss_mb']} MB, results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""Streaming bulk import and export of employees (CSV and Parquet).
+
+Rows are read, validated and loaded in batches of IMPORT_BATCH_SIZE, so
+memory stays bounded by the batch rather than the file. Each batch is
+upserted on the natural key (family_office_id, external_id): PostgreSQL
+COPYs the batch into a temporary table and merges it with one INSERT ... ON
+CONFLICT, other databases use an executemany upsert. Invalid rows are
+skipped and reported with their row number. A file that cannot be read
+past some row (broken CSV quoting or encoding, a corrupt Parquet page)
+stops the import with MalformedFileError naming that row; the batches
+before it stay imported.
+
+Parquet support needs pyarrow, which is only imported when used.
+
+Usage: python -m bulk_io import --office-id 1 employees.csv
+       python -m bulk_io export --office-id 1 employees.parquet
+"""
+import argparse
+import csv
+import io
+import itertools
+import json
+import os
+from dataclasses import dataclass, field
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import select, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from models import Employee
+
+IMPORT_BATCH_SIZE = int(os.getenv("PAYROLL_IMPORT_BATCH_SIZE", "5000"))
+EXPORT_BATCH_SIZE = int(os.getenv("PAYROLL_EXPORT_BATCH_SIZE", "5000"))
+# Per-row errors returned in an import report; the rest are only counted
+MAX_REPORTED_ERRORS = 1000
+
+IMPORT_FIELDS = ("external_id", "name", "salary")
+EXPORT_FIELDS = IMPORT_FIELDS + ("id",)
+EXTERNAL_ID_MAX_LENGTH = 64
+NAME_MAX_LENGTH = 100
+# Numeric(10, 2)
+MAX_SALARY = Decimal("99999999.99")
+CENTS = Decimal("0.01")
+
+
+class MalformedFileError(ValueError):
+    """The import file cannot be read any further; ``row`` is the row that failed"""
+
+    def __init__(self, message: str, row: Optional[int] = None):
+        super().__init__(f"Row {row}: {message}" if row else message)
+        self.message = message
+        self.row = row
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    inserted: int = 0
+    updated: int = 0
+    error_count: int = 0
+    errors: List[Dict] = field(default_factory=list)
+
+    def add_error(self, row: int, message: str):
+        self.error_count += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({"row": row, "error": message})
+
+    def as_dict(self):
+        return {
+            "rows": self.rows,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "error_count": self.error_count,
+            "errors": self.errors,
+        }
+
+
+def file_format(filename: str) -> str:
+    return "parquet" if filename.lower().endswith((".parquet", ".pq")) else "csv"
+
+
+def iter_csv_rows(binary_file) -> Iterator[dict]:
+    """Rows of a CSV file with an external_id,name,salary header"""
+    reader = csv.DictReader(io.TextIOWrapper(binary_file, encoding="utf-8-sig", newline=""))
+    try:
+        fieldnames = reader.fieldnames or ()
+    except (csv.Error, UnicodeDecodeError) as e:
+        raise MalformedFileError(f"Cannot read the CSV header: {e}") from e
+    missing = [name for name in IMPORT_FIELDS if name not in fieldnames]
+    if missing:
+        raise ValueError(f"CSV header is missing {', '.join(missing)}")
+    return reader
+
+
+def iter_parquet_rows(source, batch_size: int = IMPORT_BATCH_SIZE) -> Iterator[dict]:
+    """Rows of a Parquet file, read one record batch at a time"""
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    try:
+        parquet_file = pq.ParquetFile(source)
+    except pa.ArrowException as e:
+        raise MalformedFileError(str(e)) from e
+    missing = [name for name in IMPORT_FIELDS if name not in parquet_file.schema_arrow.names]
+    if missing:
+        raise ValueError(f"Parquet schema is missing {', '.join(missing)}")
+    batches = parquet_file.iter_batches(batch_size=batch_size, columns=list(IMPORT_FIELDS))
+    while True:
+        try:
+            batch = next(batches, None)
+        except pa.ArrowException as e:
+            raise MalformedFileError(str(e)) from e
+        if batch is None:
+            return
+        yield from batch.to_pylist()
+
+
+def iter_rows(binary_file, format: str) -> Iterator[dict]:
+    return iter_parquet_rows(binary_file) if format == "parquet" else iter_csv_rows(binary_file)
+
+
+def validate_row(row: dict) -> Tuple[str, str, Decimal]:
+    """(external_id, name, salary) of a row, or ValueError describing the problem"""
+    external_id = str(row.get("external_id") or "").strip()
+    name = str(row.get("name") or "").strip()
+    if not external_id:
+        raise ValueError("external_id is required")
+    if len(external_id) > EXTERNAL_ID_MAX_LENGTH:
+        raise ValueError(f"external_id is longer than {EXTERNAL_ID_MAX_LENGTH} characters")
+    if not name:
+        raise ValueError("name is required")
+    if len(name) > NAME_MAX_LENGTH:
+        raise ValueError(f"name is longer than {NAME_MAX_LENGTH} characters")
+    try:
+        salary = Decimal(str(row.get("salary")).strip())
+    except InvalidOperation:
+        raise ValueError(f"salary {row.get('salary')!r} is not a number")
+    if not salary.is_finite() or salary < 0 or salary > MAX_SALARY:
+        raise ValueError(f"salary must be between 0 and {MAX_SALARY}")
+    if salary != salary.quantize(CENTS):
+        raise ValueError("salary has more than two decimal places")
+    return external_id, name, salary.quantize(CENTS)
+
+
+def _numbered_rows(rows: Iterable[dict]) -> Iterator[Tuple[int, dict]]:
+    """(row number, row) pairs; reading errors become MalformedFileError for that row"""
+    rows = iter(rows)
+    for number in itertools.count(1):
+        try:
+            row = next(rows)
+        except StopIteration:
+            return
+        except csv.Error as e:
+            raise MalformedFileError(str(e), number) from e
+        except UnicodeDecodeError as e:
+            # Decoded a buffer at a time, so the failing row is not known
+            raise MalformedFileError(f"File is not UTF-8: {e}") from e
+        except MalformedFileError as e:
+            raise MalformedFileError(e.message, number) from e
+        yield number, row
+
+
+def _batches(rows: Iterable[dict], report: ImportReport, batch_size: int) -> Iterator[List[tuple]]:
+    # Later rows for the same external_id win, also within a batch
+    batch: Dict[str, tuple] = {}
+    for number, row in _numbered_rows(rows):
+        report.rows += 1
+        try:
+            external_id, name, salary = validate_row(row)
+        except ValueError as e:
+            report.add_error(number, str(e))
+            continue
+        batch.pop(external_id, None)
+        batch[external_id] = (external_id, name, salary)
+        if len(batch) >= batch_size:
+            yield list(batch.values())
+            batch = {}
+    if batch:
+        yield list(batch.values())
+
+
+def _copy_upsert(conn, office_id: int, batch: List[tuple]) -> int:
+    """PostgreSQL: COPY the batch into a temporary table, then merge it; returns rows inserted"""
+    cursor = conn.connection.dbapi_connection.cursor()
+    cursor.execute(
+        "CREATE TEMP TABLE IF NOT EXISTS employee_import "
+        "(external_id varchar(64), name varchar(100), salary numeric(10, 2)) ON COMMIT DELETE ROWS"
+    )
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows(batch)
+    buffer.seek(0)
+    cursor.copy_expert("COPY employee_import (external_id, name, salary) FROM STDIN WITH (FORMAT csv)", buffer)
+    return conn.execute(text(
+        "WITH upserted AS ("
+        " INSERT INTO employees (family_office_id, external_id, name, salary, created_at)"
+        " SELECT :office_id, external_id, name, salary, now() AT TIME ZONE 'utc' FROM employee_import"
+        " ON CONFLICT (family_office_id, external_id)"
+        " DO UPDATE SET name = EXCLUDED.name, salary = EXCLUDED.salary"
+        " RETURNING (xmax = 0) AS inserted"
+        ") SELECT count(*) FROM upserted WHERE inserted"
+    ), {"office_id": office_id}).scalar()
+
+
+def _executemany_upsert(conn, office_id: int, batch: List[tuple]) -> int:
+    """Any dialect with INSERT ... ON CONFLICT: one executemany per batch; returns rows inserted"""
+    existing = conn.execute(
+        select(Employee.external_id).where(
+            Employee.family_office_id == office_id,
+            Employee.external_id.in_([external_id for external_id, _, _ in batch])
+        )
+    ).scalars().all()
+    insert = (postgresql if conn.dialect.name == "postgresql" else sqlite).insert(Employee)
+    statement = insert.on_conflict_do_update(
+        index_elements=["family_office_id", "external_id"],
+        set_={"name": insert.excluded.name, "salary": insert.excluded.salary},
+    )
+    now = datetime.utcnow()
+    conn.execute(statement, [
+        {"family_office_id": office_id, "external_id": external_id, "name": name, "salary": salary,
+         "created_at": now}
+        for external_id, name, salary in batch
+    ])
+    return len(batch) - len(existing)
+
+
+def import_employees(engine, office_id: int, rows: Iterable[dict],
+                     batch_size: int = IMPORT_BATCH_SIZE) -> ImportReport:
+    """Validate and upsert employee rows, committing one batch at a time.
+
+    Re-running an import is safe: rows are matched on external_id.
+    """
+    report = ImportReport()
+    use_copy = engine.dialect.name == "postgresql" and engine.dialect.driver == "psycopg2"
+    for batch in _batches(rows, report, batch_size):
+        with engine.begin() as conn:
+            inserted = (_copy_upsert if use_copy else _executemany_upsert)(conn, office_id, batch)
+        report.inserted += inserted
+        report.updated += len(batch) - inserted
+    return report
+
+
+def employee_export_query(office_id: int):
+    """An office's employees in EXPORT_FIELDS order, fetched in batches"""
+    return select(Employee.external_id, Employee.name, Employee.salary, Employee.id).where(
+        Employee.family_office_id == office_id
+    ).order_by(Employee.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+class CsvChunks:
+    """CSV bytes for partitions of (external_id, name, salary, id) rows"""
+
+    media_type = "text/csv"
+
+    def __init__(self):
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._writer.writerow(EXPORT_FIELDS)
+
+    def _drain(self) -> bytes:
+        data = self._buffer.getvalue().encode()
+        self._buffer.seek(0)
+        self._buffer.truncate()
+        return data
+
+    def write(self, rows: list) -> bytes:
+        self._writer.writerows(rows)
+        return self._drain()
+
+    def close(self) -> bytes:
+        return self._drain()
+
+
+class ParquetChunks:
+    """Parquet bytes for partitions of rows, one row group per partition.
+
+    Output goes to an in-memory sink that is drained after every row group,
+    so only one partition is held at a time.
+    """
+
+    media_type = "application/vnd.apache.parquet"
+
+    def __init__(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        self._pa = pa
+        self.schema = pa.schema([
+            ("external_id", pa.string()),
+            ("name", pa.string()),
+            ("salary", pa.decimal128(10, 2)),
+            ("id", pa.int64()),
+        ])
+        self._sink = io.BytesIO()
+        self._writer = pq.ParquetWriter(self._sink, self.schema)
+
+    def _drain(self) -> bytes:
+        data = self._sink.getvalue()
+        self._sink.seek(0)
+        self._sink.truncate()
+        return data
+
+    def write(self, rows: list) -> bytes:
+        columns = list(zip(*rows)) if rows else [[] for _ in self.schema]
+        self._writer.write_table(self._pa.Table.from_arrays(
+            [self._pa.array(column, type=f.type) for column, f in zip(columns, self.schema)], schema=self.schema
+        ))
+        return self._drain()
+
+    def close(self) -> bytes:
+        self._writer.close()
+        return self._drain()
+
+
+def export_writer(format: str):
+    return ParquetChunks() if format == "parquet" else CsvChunks()
+
+
+def export_employees(engine, office_id: int, out, format: str):
+    """Write an office's employees to a binary file in CSV or Parquet"""
+    writer = export_writer(format)
+    with engine.connect() as conn:
+        for rows in conn.execute(employee_export_query(office_id)).partitions():
+            out.write(writer.write(rows))
+    out.write(writer.close())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk employee import and export")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("--office-id", type=int, required=True)
+    parser.add_argument("--format", choices=["csv", "parquet"], help="default: from the file extension")
+    parser.add_argument("path")
+    args = parser.parse_args()
+
+    from database import engine
+
+    format = args.format or file_format(args.path)
+    if args.command == "import":
+        with open(args.path, "rb") as f:
+            report = import_employees(engine, args.office_id, iter_rows(f, format))
+        print(json.dumps(report.as_dict(), indent=2))
+    else:
+        with open(args.path, "wb") as f:
+            export_employees(engine, args.office_id, f, format)
+
+
+if __name__ == "__main__":
+    main()
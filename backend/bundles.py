@@ -0,0 +1,293 @@
+"""Run bundles: a run's combined PDF and stubs in one ZIP, streamed or archived.
+
+``GET /payroll/{run_id}/bundle`` streams the ZIP while it reads the objects
+from storage, one chunk at a time, so nothing is staged on disk and memory
+does not grow with the run.
+
+Every employee of the run gets a stub in the bundle. Runs store individual
+stubs only with PAYROLL_INDIVIDUAL_STUBS=true (off by default); the stubs a
+run did not store are rendered from its line items while the ZIP is
+written, with the office's template and the period of the month the run
+started, like the pages of its combined PDF.
+
+Beat runs ``tasks.archive_old_payroll_runs`` every
+PAYROLL_ARCHIVE_INTERVAL_SECONDS. It packs completed runs older than
+PAYROLL_ARCHIVE_AFTER_DAYS into a compressed bundle, stored under its content
+hash like the PDFs. Then it deletes the run's PDFs that no unarchived run
+still references; a stub shared with a newer run stays until that run is
+archived too (every archived run has its own copy in its bundle). An office's
+latest completed run is never archived, because incremental runs reuse its
+stubs.
+
+Usage: python -m bundles archive [--older-than-days 90] [--limit 50]
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import zipfile
+from contextlib import closing
+from dataclasses import asdict, dataclass
+from datetime import datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from typing import Any, BinaryIO, Callable, Iterable, Iterator, List, NamedTuple, Optional, Set
+
+from sqlalchemy import exists, select, update
+from sqlalchemy.orm import aliased
+
+from models import PayrollLineItem, PayrollRun, PayrollStatus
+from storage import scratch_dir, store_file
+
+logger = logging.getLogger(__name__)
+
+ARCHIVE_AFTER_DAYS = float(os.getenv("PAYROLL_ARCHIVE_AFTER_DAYS", "90"))
+ARCHIVE_INTERVAL_SECONDS = float(os.getenv("PAYROLL_ARCHIVE_INTERVAL_SECONDS", "86400"))
+# Runs archived per job, oldest first
+ARCHIVE_BATCH_RUNS = int(os.getenv("PAYROLL_ARCHIVE_BATCH_RUNS", "50"))
+# Deflate level of streamed and archived bundles; PDF stubs shrink by about half
+BUNDLE_COMPRESSION_LEVEL = int(os.getenv("PAYROLL_BUNDLE_COMPRESSION_LEVEL", "6"))
+BUNDLE_CHUNK_SIZE = 64 * 1024
+
+COMBINED_PDF_NAME = "all_pay_stubs.pdf"
+
+# Line items read per batch, and storage keys checked per reference query
+_ROW_BATCH_SIZE = 1000
+_KEY_BATCH_SIZE = 500
+
+
+class _Sink:
+    """Write-only target without tell/seek, so zipfile streams entries with data descriptors"""
+
+    def __init__(self):
+        self._parts = []
+
+    def write(self, data) -> int:
+        self._parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self._parts)
+        self._parts.clear()
+        return data
+
+
+class ZipStream:
+    """A ZIP built incrementally; its bytes are handed back as they are produced"""
+
+    def __init__(self, compresslevel: int = BUNDLE_COMPRESSION_LEVEL):
+        self._sink = _Sink()
+        self._zip = zipfile.ZipFile(self._sink, "w", zipfile.ZIP_DEFLATED, compresslevel=compresslevel)
+
+    def add(self, name: str, source: BinaryIO) -> Iterator[bytes]:
+        """Compress ``source`` into the entry ``name``, yielding output chunk by chunk"""
+        # Sizes are unknown up front, so every entry may grow past 4 GiB
+        with self._zip.open(name, "w", force_zip64=True) as entry:
+            for chunk in iter(lambda: source.read(BUNDLE_CHUNK_SIZE), b""):
+                entry.write(chunk)
+                data = self._sink.take()
+                if data:
+                    yield data
+        data = self._sink.take()
+        if data:
+            yield data
+
+    def close(self) -> bytes:
+        """Finish the archive; returns the central directory"""
+        self._zip.close()
+        return self._sink.take()
+
+
+def stub_entry_name(employee_id: int, employee_name: str) -> str:
+    """File name of an employee's individual stub, when a run renders it and in bundles"""
+    return f"{employee_id}_{employee_name.replace(' ', '_').replace('/', '_')}_paystub.pdf"
+
+
+def stub_entries_query(payroll_run_id: int):
+    """A run's line items with their stub keys and amounts, in employee order"""
+    return select(
+        PayrollLineItem.employee_id, PayrollLineItem.employee_name, PayrollLineItem.stub_key,
+        PayrollLineItem.gross_pay, PayrollLineItem.tax, PayrollLineItem.deduction_lines, PayrollLineItem.net_pay
+    ).where(PayrollLineItem.payroll_run_id == payroll_run_id).order_by(PayrollLineItem.employee_id)
+
+
+class BundleEntry(NamedTuple):
+    name: str
+    # Stored object of the entry; None for a stub rendered from ``item``
+    key: Optional[str]
+    item: Any = None
+
+
+def bundle_entries(pdf_key: Optional[str], stub_rows: Iterable) -> Iterator[BundleEntry]:
+    """The combined PDF, then the stub of each stub_entries_query row"""
+    if pdf_key:
+        yield BundleEntry(COMBINED_PDF_NAME, pdf_key)
+    for row in stub_rows:
+        yield BundleEntry(stub_entry_name(row.employee_id, row.employee_name), row.stub_key, row)
+
+
+class StubRenderer:
+    """Renders the stub of a line item whose run did not store one, from its stored amounts"""
+
+    def __init__(self, payroll_run: PayrollRun):
+        # Imported here, so the API only loads ReportLab and NumPy for such stubs
+        from calculations import get_tax_table
+        from pay_stubs import get_stub_template, stub_period
+
+        self.template = get_stub_template(payroll_run.family_office_id)
+        self.period = stub_period(self.template, payroll_run.started_at or payroll_run.created_at)
+        self.tax_label = get_tax_table().tax_label
+
+    def __call__(self, item) -> BinaryIO:
+        from calculations import PayLine
+        from pay_stubs import generate_pay_stub_pdf
+
+        pay = PayLine(
+            item.gross_pay, self.tax_label, item.tax,
+            tuple((name, Decimal(amount)) for name, amount in item.deduction_lines or ()), item.net_pay
+        )
+        employee = SimpleNamespace(id=item.employee_id, name=item.employee_name)
+        pdf = io.BytesIO()
+        generate_pay_stub_pdf(employee, pay, pdf, self.template, self.period)
+        pdf.seek(0)
+        return pdf
+
+
+def write_entries(stream: ZipStream, storage, entries: Iterable[BundleEntry],
+                  render_stub: Optional[Callable[[Any], BinaryIO]] = None) -> Iterator[bytes]:
+    """Add entries to ``stream``, reading stored objects one chunk at a time.
+
+    ``render_stub(item)`` renders the entries without a stored object.
+    """
+    for entry in entries:
+        source = closing(storage.open(entry.key)) if entry.key is not None else render_stub(entry.item)
+        with source as data:
+            yield from stream.add(entry.name, data)
+
+
+@dataclass
+class ArchiveReport:
+    runs: int = 0
+    objects_deleted: int = 0
+    bytes_deleted: int = 0
+    bundle_bytes: int = 0
+
+    @property
+    def reclaimed_bytes(self) -> int:
+        return self.bytes_deleted - self.bundle_bytes
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "reclaimed_bytes": self.reclaimed_bytes}
+
+
+def archivable_runs(db, cutoff: datetime, limit: int) -> List[PayrollRun]:
+    """Unarchived runs completed before ``cutoff`` that are not their office's latest completed run"""
+    newer = aliased(PayrollRun)
+    return db.query(PayrollRun).filter(
+        PayrollRun.status == PayrollStatus.COMPLETED,
+        PayrollRun.archived_at.is_(None),
+        PayrollRun.completed_at < cutoff,
+        exists().where(
+            newer.family_office_id == PayrollRun.family_office_id,
+            newer.status == PayrollStatus.COMPLETED,
+            newer.id > PayrollRun.id
+        )
+    ).order_by(PayrollRun.completed_at, PayrollRun.id).limit(limit).all()
+
+
+def referenced_keys(db, keys: Set[str]) -> Set[str]:
+    """Those of ``keys`` that an unarchived run still uses, as its combined PDF or a stub"""
+    referenced = set()
+    keys = sorted(keys)
+    for start in range(0, len(keys), _KEY_BATCH_SIZE):
+        batch = keys[start:start + _KEY_BATCH_SIZE]
+        referenced.update(db.scalars(
+            select(PayrollRun.pdf_key).where(PayrollRun.pdf_key.in_(batch), PayrollRun.archived_at.is_(None))
+        ))
+        referenced.update(db.scalars(
+            select(PayrollLineItem.stub_key).distinct()
+            .join(PayrollRun, PayrollRun.id == PayrollLineItem.payroll_run_id)
+            .where(PayrollLineItem.stub_key.in_(batch), PayrollRun.archived_at.is_(None))
+        ))
+    return referenced
+
+
+def archive_run(db, storage, payroll_run: PayrollRun, report: ArchiveReport,
+                compresslevel: int = BUNDLE_COMPRESSION_LEVEL):
+    """Store a run's bundle, mark it archived and delete the objects only archived runs reference"""
+    keys = set()
+
+    def remember(entries):
+        for entry in entries:
+            if entry.key is not None:
+                keys.add(entry.key)
+            yield entry
+
+    with scratch_dir() as workdir:
+        path = os.path.join(workdir, "bundle.zip")
+        stream = ZipStream(compresslevel)
+        stub_rows = db.execute(stub_entries_query(payroll_run.id).execution_options(yield_per=_ROW_BATCH_SIZE))
+        with open(path, "wb") as bundle:
+            entries = remember(bundle_entries(payroll_run.pdf_key, stub_rows))
+            for data in write_entries(stream, storage, entries, StubRenderer(payroll_run)):
+                bundle.write(data)
+            bundle.write(stream.close())
+        bundle_bytes = os.path.getsize(path)
+        bundle_key = store_file(storage, path, suffix=".zip")
+
+    # The run is recorded as archived before anything is deleted, so a crash
+    # can leave unreferenced objects behind but never a run without its PDFs
+    db.execute(
+        update(PayrollRun).where(PayrollRun.id == payroll_run.id)
+        .values(bundle_key=bundle_key, archived_at=datetime.utcnow())
+    )
+    db.commit()
+    for key in sorted(keys - referenced_keys(db, keys)):
+        if storage.exists(key):
+            report.bytes_deleted += storage.size(key)
+            storage.delete(key)
+            report.objects_deleted += 1
+    report.runs += 1
+    report.bundle_bytes += bundle_bytes
+
+
+def archive_old_runs(db, storage, older_than_days: float = ARCHIVE_AFTER_DAYS,
+                     limit: int = ARCHIVE_BATCH_RUNS, now: Optional[datetime] = None) -> ArchiveReport:
+    """Archive up to ``limit`` runs completed more than ``older_than_days`` ago, oldest first"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=older_than_days)
+    report = ArchiveReport()
+    for payroll_run in archivable_runs(db, cutoff, limit):
+        try:
+            archive_run(db, storage, payroll_run, report)
+        except Exception:
+            # e.g. an object missing from storage; the run stays unarchived
+            db.rollback()
+            logger.exception("Could not archive payroll run %s", payroll_run.id)
+    logger.info("Archived %s payroll runs: %s", report.runs, report.as_dict())
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Payroll run bundles")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    archive = subcommands.add_parser("archive", help="archive old completed runs now")
+    archive.add_argument("--older-than-days", type=float, default=ARCHIVE_AFTER_DAYS)
+    archive.add_argument("--limit", type=int, default=ARCHIVE_BATCH_RUNS)
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    from storage import get_storage
+    db = SessionLocal()
+    try:
+        report = archive_old_runs(db, get_storage(), args.older_than_days, args.limit)
+        print(json.dumps(report.as_dict(), indent=2))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+from decimal import Decimal, ROUND_HALF_UP
+from functools import lru_cache
+from typing import List, NamedTuple, Optional, Tuple
+from pydantic import BaseModel
+import numpy as np
+import os
+
+# Rates are applied as integer parts-per-million of a cent so every bracket
+# and deduction is computed exactly in int64 and rounded to the cent once.
+RATE_SCALE = 1_000_000
+
+
+class TaxBracket(BaseModel):
+    # Income from this threshold up to the next bracket is taxed at ``rate``
+    threshold: Decimal
+    rate: Decimal
+
+
+class Deduction(BaseModel):
+    name: str
+    rate: Decimal
+
+
+class TaxTable(BaseModel):
+    version: str
+    tax_label: str
+    brackets: List[TaxBracket]
+    deductions: List[Deduction] = []
+
+
+DEFAULT_TAX_TABLE = TaxTable(
+    version="flat-20-v1",
+    tax_label="Federal Tax (20%)",
+    brackets=[TaxBracket(threshold=Decimal("0"), rate=Decimal("0.20"))],
+)
+
+
+@lru_cache(maxsize=1)
+def get_tax_table() -> TaxTable:
+    """Tax table in use, loaded from the JSON file in PAYROLL_TAX_TABLE if set"""
+    path = os.getenv("PAYROLL_TAX_TABLE")
+    if not path:
+        return DEFAULT_TAX_TABLE
+    with open(path) as f:
+        return TaxTable.model_validate_json(f.read())
+
+
+class PayLine(NamedTuple):
+    """One employee's calculated pay, in exact Decimal amounts"""
+    gross_pay: Decimal
+    tax_label: str
+    tax: Decimal
+    deductions: Tuple[Tuple[str, Decimal], ...]
+    net_pay: Decimal
+
+
+def _cents(amount) -> Decimal:
+    return Decimal(int(amount)).scaleb(-2)
+
+
+def _round_micro_cents(values: np.ndarray) -> np.ndarray:
+    # Round half up from millionths of a cent to whole cents (values are >= 0)
+    return (values + RATE_SCALE // 2) // RATE_SCALE
+
+
+def _rate(rate: Decimal) -> int:
+    return int((rate * RATE_SCALE).to_integral_value(ROUND_HALF_UP))
+
+
+def to_cents(salaries) -> np.ndarray:
+    """Convert a salary column to an int64 array of cents.
+
+    Accepts an integer array (already cents), a float array of dollars, or
+    any iterable of Decimal/number values such as a Numeric(10, 2) column.
+    Cent-precision amounts below 2**53 cents survive the float64 round trip
+    exactly, so rounding to the nearest cent recovers the stored value.
+    """
+    if isinstance(salaries, np.ndarray) and np.issubdtype(salaries.dtype, np.integer):
+        return salaries.astype(np.int64, copy=False)
+    if not isinstance(salaries, np.ndarray):
+        salaries = np.fromiter(map(float, salaries), dtype=np.float64)
+    return np.rint(salaries * 100).astype(np.int64)
+
+
+class PayBatch(NamedTuple):
+    """Vectorized pay results for a whole run, all amounts in int64 cents"""
+    table: TaxTable
+    gross_cents: np.ndarray
+    tax_cents: np.ndarray
+    # One row per deduction in ``table.deductions``
+    deduction_cents: np.ndarray
+    net_cents: np.ndarray
+
+    def __len__(self):
+        return len(self.gross_cents)
+
+    def line(self, index: int) -> PayLine:
+        return PayLine(
+            gross_pay=_cents(self.gross_cents[index]),
+            tax_label=self.table.tax_label,
+            tax=_cents(self.tax_cents[index]),
+            deductions=tuple(
+                (deduction.name, _cents(self.deduction_cents[d, index]))
+                for d, deduction in enumerate(self.table.deductions)
+            ),
+            net_pay=_cents(self.net_cents[index]),
+        )
+
+    def lines(self):
+        for index in range(len(self)):
+            yield self.line(index)
+
+
+def calculate_pay_batch(salaries, table: Optional[TaxTable] = None) -> PayBatch:
+    """Apply a tax table to a whole run's salaries in one vectorized pass"""
+    table = table or get_tax_table()
+    gross = to_cents(salaries)
+
+    brackets = sorted(table.brackets, key=lambda b: b.threshold)
+    tax_micro = np.zeros_like(gross)
+    for i, bracket in enumerate(brackets):
+        lower = int(bracket.threshold * 100)
+        taxable = gross - lower
+        if i + 1 < len(brackets):
+            taxable = np.minimum(taxable, int(brackets[i + 1].threshold * 100) - lower)
+        tax_micro += np.maximum(taxable, 0) * _rate(bracket.rate)
+    tax = _round_micro_cents(tax_micro)
+
+    deductions = np.empty((len(table.deductions), len(gross)), dtype=np.int64)
+    for d, deduction in enumerate(table.deductions):
+        deductions[d] = _round_micro_cents(gross * _rate(deduction.rate))
+
+    net = gross - tax - deductions.sum(axis=0)
+    return PayBatch(table, gross, tax, deductions, net)
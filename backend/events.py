@@ -0,0 +1,121 @@
+"""Payroll run progress events over Redis pub/sub.
+
+Workers publish throttled progress for a run to ``payroll_run:<id>:events``;
+the API relays that channel to clients as Server-Sent Events, so watching a
+run costs no database queries.
+"""
+import json
+import logging
+import os
+import time
+from typing import Optional
+
+import redis
+import redis.asyncio
+
+logger = logging.getLogger(__name__)
+
+REDIS_URL = os.getenv("REDIS_URL", os.getenv("CELERY_RESULT_BACKEND", "redis://localhost:6379/0"))
+
+# A progress event is published at most every PROGRESS_MIN_INTERVAL seconds
+# and only when progress moved by at least PROGRESS_MIN_STEP percent
+PROGRESS_MIN_INTERVAL = float(os.getenv("PAYROLL_PROGRESS_INTERVAL", "1.0"))
+PROGRESS_MIN_STEP = int(os.getenv("PAYROLL_PROGRESS_STEP", "5"))
+
+# SSE comment sent while a run is quiet, so proxies keep the connection open
+KEEPALIVE_SECONDS = 15
+
+TERMINAL_STATUSES = ("completed", "failed")
+
+
+def run_channel(run_id: int) -> str:
+    return f"payroll_run:{run_id}:events"
+
+
+_redis = None
+_async_redis = None
+
+
+def get_redis():
+    """Shared Redis client for the worker process"""
+    global _redis
+    if _redis is None:
+        _redis = redis.Redis.from_url(REDIS_URL)
+    return _redis
+
+
+def get_async_redis():
+    """Shared asyncio Redis client for the API process"""
+    global _async_redis
+    if _async_redis is None:
+        _async_redis = redis.asyncio.Redis.from_url(REDIS_URL)
+    return _async_redis
+
+
+class ProgressPublisher:
+    """Publishes one run's status and throttled progress to its channel.
+
+    Publishing is best effort: a Redis outage is logged and never fails the
+    payroll run itself.
+    """
+
+    def __init__(self, run_id: int, client=None, min_interval: float = PROGRESS_MIN_INTERVAL,
+                 min_step: int = PROGRESS_MIN_STEP, clock=time.monotonic):
+        self.channel = run_channel(run_id)
+        self.client = client if client is not None else get_redis()
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.clock = clock
+        self.last_progress: Optional[int] = None
+        self._last_sent = None
+
+    def _publish(self, event: dict):
+        try:
+            self.client.publish(self.channel, json.dumps(event))
+        except redis.RedisError as e:
+            logger.warning("Could not publish payroll event to %s: %s", self.channel, e)
+
+    def status(self, status: str, **extra):
+        """Publish a status change; always sent"""
+        self._publish({"status": status, **extra})
+
+    def progress(self, current: int, total: int) -> bool:
+        """Publish progress unless throttled; returns whether it was sent"""
+        progress = int(current / total * 100) if total else 100
+        now = self.clock()
+        if self.last_progress is not None and progress < 100 and (
+            progress - self.last_progress < self.min_step or now - self._last_sent < self.min_interval
+        ):
+            return False
+        self.last_progress = progress
+        self._last_sent = now
+        self._publish({"status": "processing", "current": current, "total": total, "progress": progress})
+        return True
+
+
+def sse_message(event: dict) -> str:
+    return f"data: {json.dumps(event)}\n\n"
+
+
+async def relay_run_events(pubsub, initial: dict):
+    """Yield SSE messages: the run's current state, then its channel's events.
+
+    ``pubsub`` must already be subscribed (before ``initial`` was read) so no
+    event published in between is lost. The stream ends on a terminal status.
+    """
+    try:
+        yield sse_message(initial)
+        if initial["status"] in TERMINAL_STATUSES:
+            return
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=KEEPALIVE_SECONDS)
+            if message is None:
+                yield ": keepalive\n\n"
+                continue
+            event = json.loads(message["data"])
+            yield sse_message(event)
+            if event.get("status") in TERMINAL_STATUSES:
+                return
+    finally:
+        await pubsub.unsubscribe()
+        await pubsub.aclose()
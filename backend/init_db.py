@@ -1,6 +1,15 @@
-from database import SessionLocal, engine, init_db
-from models import Base, FamilyOffice, Employee
+"""One-off database setup: Alembic migrations and demo data.
+
+The API no longer touches the schema or seeds at startup; run this once per
+deploy (docker-compose runs it as the ``migrate`` service).
+
+Usage: python init_db.py [all|migrate|seed]
+"""
+from database import SessionLocal
+from models import FamilyOffice, Employee
+import argparse
 import logging
+import os
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
@@ -53,8 +62,28 @@ def seed_demo_data():
         db.close()
 
 
+def migrate():
+    """Upgrade the schema to the latest Alembic revision"""
+    from alembic import command
+    from alembic.config import Config
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    config = Config(os.path.join(here, "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(here, "migrations"))
+    command.upgrade(config, "head")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrate the database and seed demo data")
+    parser.add_argument("command", nargs="?", choices=["all", "migrate", "seed"], default="all")
+    args = parser.parse_args()
+    if args.command in ("all", "migrate"):
+        logger.info("Upgrading database schema...")
+        migrate()
+    if args.command in ("all", "seed"):
+        logger.info("Seeding demo data...")
+        seed_demo_data()
+
+
 if __name__ == "__main__":
-    logger.info("Creating database tables...")
-    Base.metadata.create_all(bind=engine)
-    logger.info("Seeding demo data...")
-    seed_demo_data()
\ No newline at end of file
+    main()
\ No newline at end of file
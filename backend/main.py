@@ -1,17 +1,31 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, File, Header, HTTPException, Query, Request, Response, UploadFile, status
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-from typing import List
+from starlette.concurrency import iterate_in_threadpool, run_in_threadpool
+from sqlalchemy import select, func, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Literal, Optional
 from pydantic import BaseModel
-from datetime import datetime
+from datetime import date, datetime
+import hashlib
+import json
 import os
 
-from database import get_db, init_db
-from models import Employee, PayrollRun, PayrollStatus
-from auth import create_access_token, verify_token, authenticate_user, TokenData
-from tasks import process_payroll, celery_app
+from database import get_async_db, id_in, init_db, engine, async_engine, pool_status
+from bulk_io import employee_export_query, export_writer, file_format, import_employees, iter_rows
+from models import Employee, FamilyOffice, PayrollRun, PayrollStatus
+from auth import create_access_token, verify_token, verify_token_or_query, authenticate_user, TokenData
+from events import get_async_redis, relay_run_events, run_channel
+from metrics import MetricsMiddleware, init_tracing, latest_metrics, update_queue_depth
+from responses import FAST_JSON, FastJSONResponse, dumps
+from reports import period_summary_query, run_summary_query
+from bundles import StubRenderer, ZipStream, bundle_entries, stub_entries_query, write_entries
+from storage import get_storage, etag, parse_byte_range, RangeNotSatisfiable
+from scheduling import (
+    route_run, route_for_queue, summarize_waits, queue_wait_seconds, tenant_run_limit, QUEUE_STATS_WINDOW, PAYROLL_QUEUES
+)
 
 app = FastAPI(title="Family Office Payroll POC")
 
@@ -22,8 +36,38 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Idempotent-Replayed"],
 )
 
+# Request latency per route, and the request span when tracing is enabled
+app.add_middleware(MetricsMiddleware)
+init_tracing("payroll-api")
+
+# Keyset pagination for /employees
+EMPLOYEE_PAGE_SIZE = 500
+EMPLOYEE_MAX_PAGE_SIZE = 5000
+EMPLOYEE_STREAM_BATCH_SIZE = 1000
+EMPLOYEE_FIELDS = {
+    "id": Employee.id,
+    "name": Employee.name,
+    "salary": Employee.salary,
+}
+
+# Schema changes run through Alembic and demo data is seeded with
+# ``python init_db.py``; PAYROLL_BOOTSTRAP_DB=true instead creates the tables
+# and seeds at startup, for throwaway databases only
+BOOTSTRAP_DB = os.getenv("PAYROLL_BOOTSTRAP_DB", "false").lower() in ("1", "true", "yes")
+
+# Run summaries returned by /payroll/reports?runs=true
+REPORT_RUN_LIMIT = 100
+REPORT_MAX_RUN_LIMIT = 1000
+
+# Longest accepted Idempotency-Key header
+IDEMPOTENCY_KEY_MAX_LENGTH = 100
+
+# Read size when serving a byte range of a local PDF
+PDF_CHUNK_SIZE = 64 * 1024
+
 
 # Pydantic models for API
 class Token(BaseModel):
@@ -41,26 +85,95 @@ class EmployeeResponse(BaseModel):
         from_attributes = True
 
 
+class EmployeeFieldsResponse(BaseModel):
+    """An employee listed by /employees: only the fields requested with ``fields=``"""
+    id: Optional[int] = None
+    name: Optional[str] = None
+    salary: Optional[float] = None
+
+
 class PayrollRunResponse(BaseModel):
     id: int
     status: PayrollStatus
     created_at: datetime
     completed_at: datetime | None
+    incremental: bool = False
+    reused_count: int | None = None
+    rebuilt_count: int | None = None
     
     class Config:
         from_attributes = True
 
 
+class PayrollTotals(BaseModel):
+    pay_period: str
+    headcount: int
+    gross_pay: float
+    tax: float
+    deductions: float
+    net_pay: float
+    
+    class Config:
+        from_attributes = True
+
+
+class PeriodSummaryResponse(PayrollTotals):
+    run_count: int
+
+
+class RunSummaryResponse(PayrollTotals):
+    payroll_run_id: int
+    completed_at: datetime
+
+
+class PayrollReportResponse(BaseModel):
+    periods: List[PeriodSummaryResponse]
+    runs: List[RunSummaryResponse]
+
+
+def model_content(model, obj):
+    """``model``'s fields of ``obj``, read without validation for the fast JSON path"""
+    return {field: getattr(obj, field) for field in model.model_fields}
+
+
+def payroll_run_content(payroll_run):
+    return model_content(PayrollRunResponse, payroll_run)
+
+
+def run_response(payroll_run, response=None):
+    """A run as PayrollRunResponse; on the fast JSON path it is encoded directly.
+
+    Headers already set on the endpoint's ``response`` are kept.
+    """
+    if not FAST_JSON:
+        return payroll_run
+    headers = {key: value for key, value in response.headers.items() if key != "content-length"} if response else None
+    return FastJSONResponse(payroll_run_content(payroll_run), headers=headers)
+
+
 class PayrollRunRequest(BaseModel):
     employee_ids: List[int]
+    # Reuse the previous completed run's results for unchanged employees
+    incremental: bool = False
+    # High priority runs skip ahead on their own queue
+    priority: Literal["normal", "high"] = "normal"
 
 
 @app.on_event("startup")
 async def startup_event():
-    init_db()
-    # Initialize demo data
-    from init_db import seed_demo_data
-    seed_demo_data()
+    if BOOTSTRAP_DB:
+        from init_db import seed_demo_data
+        await run_in_threadpool(init_db)
+        await run_in_threadpool(seed_demo_data)
+    # Starts the worker thread pool (and imports its backend) now rather
+    # than in the first request that needs it
+    await run_in_threadpool(lambda: None)
+
+
+def enqueue_payroll_run(payroll_run_id, route):
+    """Publish a run to its Celery queue (see broker.enqueue_payroll_run)"""
+    from broker import enqueue_payroll_run as publish
+    return publish(payroll_run_id, route)
 
 
 @app.post("/login", response_model=Token)
@@ -84,89 +197,577 @@ async def login(form_data: OAuth2PasswordRequestForm = Depends()):
     }
 
 
-@app.get("/employees", response_model=List[EmployeeResponse])
+def employee_row(fields, row):
+    data = dict(zip(fields, row))
+    if "salary" in data:
+        data["salary"] = float(data["salary"])
+    return data
+
+
+@app.get("/employees", response_model=List[EmployeeFieldsResponse])
 async def get_employees(
+    after_id: Optional[int] = Query(None, description="Keyset cursor: return employees with a larger id"),
+    limit: Optional[int] = Query(None, ge=1, le=EMPLOYEE_MAX_PAGE_SIZE),
+    fields: Optional[str] = Query(None, description="Comma-separated subset of id,name,salary"),
+    format: Literal["json", "ndjson"] = "json",
+    stream: bool = False,
     token_data: TokenData = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    employees = db.query(Employee).filter(
+    """List employees ordered by id, one keyset page at a time.
+
+    The next page's cursor is returned in the X-Next-Cursor header. With
+    ``stream=true`` (or ``format=ndjson``) every remaining row is streamed
+    from a server-side cursor instead, so memory stays flat for any office size.
+    """
+    selected = fields.split(",") if fields else list(EMPLOYEE_FIELDS)
+    if not selected or any(field not in EMPLOYEE_FIELDS for field in selected):
+        raise HTTPException(status_code=400, detail=f"fields must be a subset of {','.join(EMPLOYEE_FIELDS)}")
+    
+    # id is always selected because it is the pagination key
+    query = select(Employee.id, *(EMPLOYEE_FIELDS[field] for field in selected)).where(
         Employee.family_office_id == token_data.family_office_id
-    ).all()
-    return employees
+    ).order_by(Employee.id)
+    if after_id is not None:
+        query = query.where(Employee.id > after_id)
+    
+    if stream or format == "ndjson":
+        return StreamingResponse(
+            stream_employees(db.bind, query.limit(limit), selected, format),
+            media_type="application/x-ndjson" if format == "ndjson" else "application/json"
+        )
+    
+    page_size = limit or EMPLOYEE_PAGE_SIZE
+    rows = (await db.execute(query.limit(page_size + 1))).all()
+    headers = {}
+    if len(rows) > page_size:
+        rows = rows[:page_size]
+        headers["X-Next-Cursor"] = str(rows[-1][0])
+    if FAST_JSON:
+        # orjson encodes the Numeric salaries itself
+        return FastJSONResponse([dict(zip(selected, row[1:])) for row in rows], headers=headers)
+    return JSONResponse([employee_row(selected, row[1:]) for row in rows], headers=headers)
+
+
+async def stream_employees(bind, query, fields, format):
+    """Yield employee rows as NDJSON lines or one JSON array.
+
+    The request's session is closed before the body is sent, so the stream
+    opens its own session on the same engine.
+    """
+    if FAST_JSON:
+        def encode(row):
+            return dumps(dict(zip(fields, row[1:])))
+    else:
+        def encode(row):
+            return json.dumps(employee_row(fields, row[1:])).encode()
+    
+    async with AsyncSession(bind) as db:
+        result = await db.stream(query.execution_options(yield_per=EMPLOYEE_STREAM_BATCH_SIZE))
+        if format == "ndjson":
+            async for partition in result.partitions():
+                yield b"".join(encode(row) + b"\n" for row in partition)
+        else:
+            separator = b"["
+            async for partition in result.partitions():
+                yield separator + b",".join(encode(row) for row in partition)
+                separator = b","
+            yield b"[]" if separator == b"[" else b"]"
+
+
+def payroll_request_fingerprint(request: PayrollRunRequest) -> str:
+    """Hash of a payroll request; the order of employee IDs does not matter"""
+    body = json.dumps({"employee_ids": sorted(request.employee_ids), "incremental": request.incremental})
+    return hashlib.sha256(body.encode()).hexdigest()
+
+
+@app.post("/employees/import")
+async def import_employees_file(
+    file: UploadFile = File(...),
+    format: Optional[Literal["csv", "parquet"]] = Query(None, description="Default: from the file extension"),
+    token_data: TokenData = Depends(verify_token)
+):
+    """Upsert employees from a CSV or Parquet file on their external_id.
+
+    The upload is spooled to disk and loaded in batches on the sync engine
+    (PostgreSQL COPY), so memory stays flat for any file size. Invalid rows
+    are skipped and reported with their row number; a file that cannot be
+    read past some row is a 400 naming that row.
+    """
+    try:
+        rows = iter_rows(file.file, format or file_format(file.filename or ""))
+        report = await run_in_threadpool(import_employees, engine, token_data.family_office_id, rows)
+    except (ValueError, ImportError) as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return report.as_dict()
+
+
+@app.get("/employees/export")
+async def export_employees_file(
+    format: Literal["csv", "parquet"] = "csv",
+    token_data: TokenData = Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Stream the office's employees as CSV or Parquet, importable again as is"""
+    try:
+        writer = export_writer(format)
+    except ImportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return StreamingResponse(
+        stream_employee_export(db.bind, token_data.family_office_id, writer),
+        media_type=writer.media_type,
+        headers={"Content-Disposition": f'attachment; filename="employees.{format}"'}
+    )
+
+
+async def stream_employee_export(bind, office_id, writer):
+    async with AsyncSession(bind) as db:
+        result = await db.stream(employee_export_query(office_id))
+        async for partition in result.partitions():
+            yield writer.write(partition)
+    yield writer.close()
 
 
 @app.post("/payroll/run", response_model=PayrollRunResponse)
 async def run_payroll(
     request: PayrollRunRequest,
+    response: Response,
+    idempotency_key: Optional[str] = Header(None, max_length=IDEMPOTENCY_KEY_MAX_LENGTH),
     token_data: TokenData = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
+    """Create a payroll run and queue it.
+
+    Retries with the same Idempotency-Key return the run created first, and
+    an identical request while a matching run is still pending or processing
+    returns that run instead of queueing another. Both are enforced by unique
+    constraints, so they hold across API replicas.
+    """
+    fingerprint = payroll_request_fingerprint(request)
+    office_id = token_data.family_office_id
+    
+    existing = await find_existing_run(db, office_id, idempotency_key, fingerprint)
+    if existing is not None:
+        return run_response(replay_run(existing, response, fingerprint), response)
+    
     # Verify all employees belong to the user's family office
-    employees = db.query(Employee).filter(
-        Employee.id.in_(request.employee_ids),
-        Employee.family_office_id == token_data.family_office_id
-    ).all()
+    employee_count = await db.scalar(
+        select(func.count()).select_from(Employee).where(
+            id_in(Employee.id, request.employee_ids, db.bind.dialect.name),
+            Employee.family_office_id == office_id
+        )
+    )
     
-    if len(employees) != len(request.employee_ids):
+    if employee_count != len(request.employee_ids):
         raise HTTPException(status_code=400, detail="Invalid employee IDs")
     
     # Create payroll run
+    route = route_run(len(request.employee_ids), request.priority)
     payroll_run = PayrollRun(
-        family_office_id=token_data.family_office_id,
-        status=PayrollStatus.PENDING
+        family_office_id=office_id,
+        status=PayrollStatus.PENDING,
+        employee_ids=request.employee_ids,
+        incremental=request.incremental,
+        idempotency_key=idempotency_key,
+        request_fingerprint=fingerprint,
+        active_fingerprint=fingerprint,
+        queue=route.queue
     )
     db.add(payroll_run)
-    db.commit()
-    db.refresh(payroll_run)
+    try:
+        await db.commit()
+    except IntegrityError:
+        # A concurrent request created the same run first
+        await db.rollback()
+        existing = await find_existing_run(db, office_id, idempotency_key, fingerprint)
+        if existing is None:
+            raise
+        return run_response(replay_run(existing, response, fingerprint), response)
+    await db.refresh(payroll_run)
     
-    # Queue async task
-    process_payroll.delay(payroll_run.id)
+    # Queue async task (publishing to the broker is blocking I/O)
+    await run_in_threadpool(enqueue_payroll_run, payroll_run.id, route)
     
+    return run_response(payroll_run)
+
+
+async def find_existing_run(db, office_id, idempotency_key, fingerprint):
+    """The run an Idempotency-Key or an identical active request maps to"""
+    if idempotency_key is not None:
+        payroll_run = await db.scalar(
+            select(PayrollRun).where(
+                PayrollRun.family_office_id == office_id,
+                PayrollRun.idempotency_key == idempotency_key
+            )
+        )
+        if payroll_run is not None:
+            return payroll_run
+    return await db.scalar(
+        select(PayrollRun).where(
+            PayrollRun.family_office_id == office_id,
+            PayrollRun.active_fingerprint == fingerprint
+        )
+    )
+
+
+def replay_run(payroll_run, response, fingerprint):
+    if payroll_run.request_fingerprint != fingerprint:
+        raise HTTPException(status_code=422, detail="Idempotency-Key was already used for a different request")
+    response.headers["Idempotent-Replayed"] = "true"
     return payroll_run
 
 
+@app.get("/payroll/queue-stats")
+async def payroll_queue_stats(
+    token_data: TokenData = Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """The office's queued and processing runs and its recent queue wait times"""
+    office_id = token_data.family_office_id
+    office = await db.get(FamilyOffice, office_id)
+    counts = dict((await db.execute(
+        select(PayrollRun.status, func.count()).where(
+            PayrollRun.family_office_id == office_id,
+            PayrollRun.status.in_([PayrollStatus.PENDING, PayrollStatus.PROCESSING])
+        ).group_by(PayrollRun.status)
+    )).all())
+    started = (await db.execute(
+        select(PayrollRun.queue, PayrollRun.created_at, PayrollRun.started_at).where(
+            PayrollRun.family_office_id == office_id,
+            PayrollRun.started_at >= datetime.utcnow() - QUEUE_STATS_WINDOW
+        )
+    )).all()
+    waits = {}
+    for payroll_run in started:
+        waits.setdefault(route_for_queue(payroll_run.queue).queue, []).append(queue_wait_seconds(payroll_run))
+    return {
+        "pending": counts.get(PayrollStatus.PENDING, 0),
+        "processing": counts.get(PayrollStatus.PROCESSING, 0),
+        "concurrency_limit": tenant_run_limit(office) if office else None,
+        "window_seconds": int(QUEUE_STATS_WINDOW.total_seconds()),
+        "queue_wait_seconds": {queue: summarize_waits(values) for queue, values in sorted(waits.items())},
+    }
+
+
+@app.get("/payroll/reports", response_model=PayrollReportResponse)
+async def payroll_reports(
+    start: Optional[date] = Query(None, description="First day included; periods from its month"),
+    end: Optional[date] = Query(None, description="Last day included; periods up to its month"),
+    runs: bool = Query(False, description="Also return the most recent run summaries in the range"),
+    limit: int = Query(REPORT_RUN_LIMIT, ge=1, le=REPORT_MAX_RUN_LIMIT),
+    token_data: TokenData = Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Headcount, gross, tax, deductions and net per pay period (and per run).
+
+    Served from the summaries written as runs complete, never from line
+    items, so the cost depends on the range rather than on the history.
+    """
+    if start is not None and end is not None and start > end:
+        raise HTTPException(status_code=400, detail="start must not be after end")
+    office_id = token_data.family_office_id
+    periods = (await db.scalars(period_summary_query(office_id, start, end))).all()
+    run_summaries = (await db.scalars(run_summary_query(office_id, start, end, limit))).all() if runs else []
+    if FAST_JSON:
+        return FastJSONResponse({
+            "periods": [model_content(PeriodSummaryResponse, period) for period in periods],
+            "runs": [model_content(RunSummaryResponse, summary) for summary in run_summaries],
+        })
+    return {"periods": periods, "runs": run_summaries}
+
+
 @app.get("/payroll/{run_id}", response_model=PayrollRunResponse)
 async def get_payroll_status(
     run_id: int,
     token_data: TokenData = Depends(verify_token),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    payroll_run = db.query(PayrollRun).filter(
-        PayrollRun.id == run_id,
-        PayrollRun.family_office_id == token_data.family_office_id
-    ).first()
+    payroll_run = await db.scalar(
+        select(PayrollRun).where(
+            PayrollRun.id == run_id,
+            PayrollRun.family_office_id == token_data.family_office_id
+        )
+    )
     
     if not payroll_run:
         raise HTTPException(status_code=404, detail="Payroll run not found")
     
-    return payroll_run
+    return run_response(payroll_run)
+
+
+@app.post("/payroll/{run_id}/retry", response_model=PayrollRunResponse)
+async def retry_payroll_run(
+    run_id: int,
+    response: Response,
+    token_data: TokenData = Depends(verify_token),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Queue a failed run again; it resumes after its last checkpoint.
+
+    Only the request that moves the run out of FAILED queues it. When an
+    identical run was submitted since and is still active, that run is
+    returned instead.
+    """
+    office_id = token_data.family_office_id
+    payroll_run = await db.scalar(
+        select(PayrollRun).where(
+            PayrollRun.id == run_id,
+            PayrollRun.family_office_id == office_id
+        )
+    )
+    
+    if not payroll_run:
+        raise HTTPException(status_code=404, detail="Payroll run not found")
+    fingerprint = payroll_run.request_fingerprint
+    
+    try:
+        result = await db.execute(
+            update(PayrollRun).where(
+                PayrollRun.id == payroll_run.id,
+                PayrollRun.status == PayrollStatus.FAILED
+            ).values(
+                status=PayrollStatus.PENDING, active_fingerprint=PayrollRun.request_fingerprint
+            ).execution_options(synchronize_session=False)
+        )
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        existing = await find_existing_run(db, office_id, None, fingerprint)
+        if existing is None:
+            raise
+        return run_response(replay_run(existing, response, fingerprint), response)
+    if result.rowcount != 1:
+        raise HTTPException(status_code=409, detail="Only failed payroll runs can be retried")
+    
+    await db.refresh(payroll_run)
+    await run_in_threadpool(enqueue_payroll_run, payroll_run.id, route_for_queue(payroll_run.queue))
+    
+    return run_response(payroll_run)
+
+
+@app.get("/payroll/{run_id}/events")
+async def payroll_events(
+    run_id: int,
+    token_data: TokenData = Depends(verify_token_or_query),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Server-Sent Events stream of a run's status and progress.
+
+    The run is read from the database once; after that every update comes
+    from the run's Redis channel, so watching a run does not poll Postgres.
+    """
+    # Subscribe before reading the current state so no update is missed
+    pubsub = get_async_redis().pubsub()
+    await pubsub.subscribe(run_channel(run_id))
+    try:
+        payroll_run = await db.scalar(
+            select(PayrollRun).where(
+                PayrollRun.id == run_id,
+                PayrollRun.family_office_id == token_data.family_office_id
+            )
+        )
+        if not payroll_run:
+            raise HTTPException(status_code=404, detail="Payroll run not found")
+    except Exception:
+        await pubsub.aclose()
+        raise
+    
+    initial = {"status": payroll_run.status.value}
+    if payroll_run.completed_at:
+        initial["completed_at"] = payroll_run.completed_at.isoformat()
+    return StreamingResponse(
+        relay_run_events(pubsub, initial),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
 
 
 @app.get("/payroll/{run_id}/pdf")
 async def download_payroll_pdf(
     run_id: int,
-    token_data: TokenData = Depends(verify_token),
-    db: Session = Depends(get_db)
+    request: Request,
+    token_data: TokenData = Depends(verify_token_or_query),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    payroll_run = db.query(PayrollRun).filter(
-        PayrollRun.id == run_id,
-        PayrollRun.family_office_id == token_data.family_office_id,
-        PayrollRun.status == PayrollStatus.COMPLETED
-    ).first()
+    """Download a run's combined PDF.
+
+    Stored objects never change, so the content hash is a strong ETag for
+    If-None-Match. Backends that can pre-sign URLs redirect the client to the
+    object itself; local files are served here with single Range support.
+    """
+    payroll_run = await db.scalar(
+        select(PayrollRun).where(
+            PayrollRun.id == run_id,
+            PayrollRun.family_office_id == token_data.family_office_id,
+            PayrollRun.status == PayrollStatus.COMPLETED
+        )
+    )
     
     if not payroll_run:
         raise HTTPException(status_code=404, detail="Payroll run not found or not completed")
+    if payroll_run.archived_at is not None:
+        raise HTTPException(status_code=410, detail=f"Payroll run was archived; download /payroll/{run_id}/bundle")
     
-    if not payroll_run.pdf_path or not os.path.exists(payroll_run.pdf_path):
+    filename = f"payroll_run_{run_id}.pdf"
+    tag = None
+    pdf_path = payroll_run.pdf_path
+    if payroll_run.pdf_key:
+        tag = etag(payroll_run.pdf_key)
+        if etag_matches(request.headers.get("if-none-match"), tag):
+            return Response(status_code=304, headers={"ETag": tag})
+        storage = get_storage()
+        if storage.presigns:
+            url = await run_in_threadpool(storage.presigned_url, payroll_run.pdf_key, filename)
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+        pdf_path = storage.local_path(payroll_run.pdf_key)
+    
+    if not pdf_path or not os.path.exists(pdf_path):
         raise HTTPException(status_code=404, detail="PDF file not found")
     
-    return FileResponse(
-        payroll_run.pdf_path,
-        media_type="application/pdf",
-        filename=f"payroll_run_{run_id}.pdf"
+    return pdf_file_response(pdf_path, request, filename, tag)
+
+
+@app.get("/payroll/{run_id}/bundle")
+async def download_payroll_bundle(
+    run_id: int,
+    request: Request,
+    token_data: TokenData = Depends(verify_token_or_query),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Download a ZIP of a run's combined PDF and individual stubs.
+
+    The ZIP is streamed while its objects are read from storage, never
+    staged on disk; stubs the run did not store are rendered as they are
+    added. An archived run's stored bundle is served like a PDF.
+    """
+    payroll_run = await db.scalar(
+        select(PayrollRun).where(
+            PayrollRun.id == run_id,
+            PayrollRun.family_office_id == token_data.family_office_id,
+            PayrollRun.status == PayrollStatus.COMPLETED
+        )
+    )
+    
+    if not payroll_run:
+        raise HTTPException(status_code=404, detail="Payroll run not found or not completed")
+    
+    filename = f"payroll_run_{run_id}.zip"
+    storage = get_storage()
+    if payroll_run.bundle_key:
+        tag = etag(payroll_run.bundle_key)
+        if etag_matches(request.headers.get("if-none-match"), tag):
+            return Response(status_code=304, headers={"ETag": tag})
+        if storage.presigns:
+            url = await run_in_threadpool(storage.presigned_url, payroll_run.bundle_key, filename)
+            return RedirectResponse(url, status_code=307, headers={"Cache-Control": "no-store"})
+        return pdf_file_response(
+            storage.local_path(payroll_run.bundle_key), request, filename, tag, media_type="application/zip"
+        )
+    
+    return StreamingResponse(
+        stream_bundle(db.bind, payroll_run, storage),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
     )
 
 
+async def stream_bundle(bind, payroll_run, storage):
+    """Yield the ZIP of a run's stubs; storage reads, rendering and compression run in the thread pool.
+
+    Like stream_employees, the stream reads the stubs with its own session.
+    """
+    stream = ZipStream()
+    async for data in iterate_in_threadpool(write_entries(stream, storage, bundle_entries(payroll_run.pdf_key, []))):
+        yield data
+    render_stub = await run_in_threadpool(StubRenderer, payroll_run)
+    async with AsyncSession(bind) as db:
+        result = await db.stream(
+            stub_entries_query(payroll_run.id).execution_options(yield_per=EMPLOYEE_STREAM_BATCH_SIZE)
+        )
+        async for partition in result.partitions():
+            entries = list(bundle_entries(None, partition))
+            async for data in iterate_in_threadpool(write_entries(stream, storage, entries, render_stub)):
+                yield data
+    yield await run_in_threadpool(stream.close)
+
+
+def etag_matches(if_none_match, tag):
+    if not if_none_match:
+        return False
+    candidates = [candidate.strip() for candidate in if_none_match.split(",")]
+    return "*" in candidates or any(candidate.removeprefix("W/") == tag for candidate in candidates)
+
+
+def pdf_file_response(path, request, filename, tag=None, media_type="application/pdf"):
+    """Serve a local PDF (or bundle), honouring a single byte Range (and If-Range)"""
+    size = os.path.getsize(path)
+    headers = {"Accept-Ranges": "bytes", "Content-Disposition": f'attachment; filename="{filename}"'}
+    if tag:
+        headers["ETag"] = tag
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if if_range and (tag is None or if_range != tag):
+        # The client's copy may be stale, so send the whole file
+        range_header = None
+    try:
+        byte_range = parse_byte_range(range_header, size)
+    except RangeNotSatisfiable:
+        return Response(status_code=416, headers={"Content-Range": f"bytes */{size}"})
+    
+    if byte_range is None:
+        return FileResponse(path, media_type=media_type, headers=headers)
+    
+    start, end = byte_range
+    headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    return StreamingResponse(
+        iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers
+    )
+
+
+def iter_file_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            chunk = f.read(min(PDF_CHUNK_SIZE, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
\ No newline at end of file
+    return {"status": "healthy"}
+
+
+def read_queue_depth():
+    from broker import celery_app
+    try:
+        with celery_app.connection_for_read(connect_timeout=2) as connection:
+            connection.ensure_connection(max_retries=1)
+            update_queue_depth(connection, PAYROLL_QUEUES)
+    except Exception:
+        # The broker being down must not break scraping the other metrics
+        pass
+
+
+@app.get("/metrics")
+async def metrics():
+    """Prometheus metrics of this API process, with the payroll queue depths"""
+    await run_in_threadpool(read_queue_depth)
+    data, content_type = latest_metrics()
+    return Response(data, media_type=content_type)
+
+
+@app.get("/health/db")
+async def db_pool_health():
+    """Connection pool occupancy, checkout latency and wait counts of the API process.
+
+    ``async`` is the pool of the async endpoints, ``sync`` the one of
+    employee imports, which run in threads. Workers publish their pool as
+    the db_pool_* metrics.
+    """
+    return {"async": pool_status(async_engine), "sync": pool_status(engine)}
\ No newline at end of file
@@ -0,0 +1,241 @@
+"""Prometheus metrics and optional OpenTelemetry tracing for the API and worker.
+
+The API serves ``/metrics``; a Celery worker serves its metrics on
+PAYROLL_WORKER_METRICS_PORT when that is set. Prefork worker children only share metrics when
+PROMETHEUS_MULTIPROC_DIR is set (before this module is imported).
+
+Tracing is off unless PAYROLL_OTEL_ENABLED is set and the OpenTelemetry SDK
+is installed. The API's request span is propagated in the Celery message
+headers, so a payroll run's spans are children of the request that queued it.
+"""
+import logging
+import os
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess,
+    start_http_server,
+)
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# Port of the worker's exporter; unset disables it
+WORKER_METRICS_PORT = os.getenv("PAYROLL_WORKER_METRICS_PORT")
+TRACING_ENABLED = os.getenv("PAYROLL_OTEL_ENABLED", "false").lower() in ("1", "true", "yes")
+
+# Payroll stages and queries take from milliseconds to many minutes
+_SLOW_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800, 3600)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "API request latency", ["method", "route", "status"]
+)
+DB_QUERY_SECONDS = Histogram(
+    "db_query_duration_seconds", "Database statement execution time", ["operation"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+PAYROLL_STAGE_SECONDS = Histogram(
+    "payroll_stage_duration_seconds", "Time a payroll run spent in each stage", ["stage"], buckets=_SLOW_BUCKETS
+)
+PAYROLL_QUEUE_WAIT_SECONDS = Histogram(
+    "payroll_queue_wait_seconds", "Time from submission until a worker started the run", ["queue"],
+    buckets=_SLOW_BUCKETS
+)
+TASK_SECONDS = Histogram(
+    "celery_task_duration_seconds", "Celery task runtime", ["task", "state"], buckets=_SLOW_BUCKETS
+)
+# Checkouts of the sync (workers, sync endpoints) and async (API) connection pools
+DB_POOL_CHECKOUT_SECONDS = Histogram(
+    "db_pool_checkout_duration_seconds", "Time to check a connection out of the pool", ["pool"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+DB_POOL_CHECKOUT_WAITS = Counter(
+    "db_pool_checkout_waits", "Checkouts that waited for an exhausted pool", ["pool"]
+)
+DB_POOL_CHECKED_OUT = Gauge(
+    "db_pool_checked_out_connections", "Connections checked out of the pool", ["pool"], multiprocess_mode="livesum"
+)
+QUEUE_DEPTH = Gauge(
+    "payroll_queue_depth", "Messages waiting in each payroll queue", ["queue"], multiprocess_mode="max"
+)
+
+_QUERY_OPERATIONS = {"SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "COPY"}
+
+
+def registry():
+    """Registry to expose: all processes' metrics in multiprocess mode, else this process's"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        collector_registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collector_registry)
+        return collector_registry
+    return REGISTRY
+
+
+def latest_metrics():
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
+
+
+def start_worker_exporter():
+    if WORKER_METRICS_PORT:
+        start_http_server(int(WORKER_METRICS_PORT), registry=registry())
+
+
+def mark_process_dead(pid):
+    """Drop a finished worker child's live gauges in multiprocess mode"""
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        multiprocess.mark_process_dead(pid)
+
+
+# Database statements of every engine (sync and async) are timed
+@event.listens_for(Engine, "before_cursor_execute")
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._metrics_start = time.perf_counter()
+
+
+@event.listens_for(Engine, "after_cursor_execute")
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    start = getattr(context, "_metrics_start", None)
+    if start is None:
+        return
+    operation = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    DB_QUERY_SECONDS.labels(operation if operation in _QUERY_OPERATIONS else "OTHER").observe(
+        time.perf_counter() - start
+    )
+
+
+def observe_pool_checkout(pool, seconds, waited, checked_out):
+    DB_POOL_CHECKOUT_SECONDS.labels(pool).observe(seconds)
+    if waited:
+        DB_POOL_CHECKOUT_WAITS.labels(pool).inc()
+    DB_POOL_CHECKED_OUT.labels(pool).set(checked_out)
+
+
+def observe_pool_checkin(pool, checked_out):
+    DB_POOL_CHECKED_OUT.labels(pool).set(checked_out)
+
+
+class MetricsMiddleware:
+    """ASGI middleware recording request latency per route template.
+
+    Unmatched paths share one label so scans cannot explode the series count.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        start = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        with request_span(scope):
+            try:
+                await self.app(scope, receive, send_with_status)
+            finally:
+                route = scope.get("route")
+                HTTP_REQUEST_SECONDS.labels(
+                    scope["method"], getattr(route, "path", "unmatched"), str(status)
+                ).observe(time.perf_counter() - start)
+
+
+class StageTimer:
+    """Accumulates the time one payroll run spends in each stage.
+
+    Stages may be entered many times (once per checkpoint); ``observe``
+    records each stage's total for the run once.
+    """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        with span(f"payroll.{name}"):
+            try:
+                yield
+            finally:
+                self.totals[name] += time.perf_counter() - start
+
+    def observe(self):
+        for name, seconds in self.totals.items():
+            PAYROLL_STAGE_SECONDS.labels(name).observe(seconds)
+
+
+def update_queue_depth(connection, queues):
+    """Set payroll_queue_depth from the broker; queues that do not exist are skipped"""
+    channel = connection.default_channel
+    for queue in queues:
+        try:
+            _, depth, _ = channel.queue_declare(queue, passive=True)
+        except Exception as e:
+            logger.debug("Could not read depth of queue %s: %s", queue, e)
+            channel = connection.default_channel
+            continue
+        QUEUE_DEPTH.labels(queue).set(depth)
+
+
+# Optional OpenTelemetry tracing
+
+_tracer = None
+
+
+def init_tracing(service_name):
+    """Configure an OTLP exporting tracer provider when tracing is enabled"""
+    global _tracer
+    if not TRACING_ENABLED or _tracer is not None:
+        return
+    from opentelemetry import trace
+    from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+    from opentelemetry.sdk.resources import Resource
+    from opentelemetry.sdk.trace import TracerProvider
+    from opentelemetry.sdk.trace.export import BatchSpanProcessor
+
+    provider = TracerProvider(resource=Resource.create({"service.name": service_name}))
+    provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+    trace.set_tracer_provider(provider)
+    _tracer = trace.get_tracer("payroll")
+
+
+def span(name, context=None, **attributes):
+    """A span when tracing is enabled, else a no-op context manager"""
+    if _tracer is None:
+        return nullcontext()
+    return _tracer.start_as_current_span(name, context=context, attributes=attributes)
+
+
+def request_span(scope):
+    if _tracer is None:
+        return nullcontext()
+    from opentelemetry import propagate
+    headers = {key.decode("latin-1"): value.decode("latin-1") for key, value in scope.get("headers", ())}
+    return span(f"{scope['method']} {scope['path']}", context=propagate.extract(headers))
+
+
+def inject_trace_headers(headers):
+    """Add the current trace context to outgoing (Celery message) headers"""
+    if _tracer is not None:
+        from opentelemetry import propagate
+        propagate.inject(headers)
+    return headers
+
+
+def task_span(name, request, **attributes):
+    """Span for a Celery task, a child of the span that published it"""
+    if _tracer is None:
+        return nullcontext()
+    from opentelemetry import propagate
+    carrier = {key: getattr(request, key, None) for key in ("traceparent", "tracestate")}
+    carrier = {key: value for key, value in carrier.items() if value}
+    return span(name, context=propagate.extract(carrier), **attributes)
@@ -0,0 +1,51 @@
+"""Initial schema, as previously created by Base.metadata.create_all
+
+Databases created before migrations existed can be marked as being at this
+revision with ``alembic stamp 0001`` and then upgraded normally.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+payroll_status = sa.Enum("PENDING", "PROCESSING", "COMPLETED", "FAILED", name="payrollstatus")
+
+
+def upgrade():
+    op.create_table(
+        "family_offices",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("name", sa.String(100), nullable=False, unique=True),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_table(
+        "employees",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("family_office_id", sa.Integer(), sa.ForeignKey("family_offices.id"), nullable=False),
+        sa.Column("name", sa.String(100), nullable=False),
+        sa.Column("salary", sa.Numeric(10, 2), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+    )
+    op.create_table(
+        "payroll_runs",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("family_office_id", sa.Integer(), sa.ForeignKey("family_offices.id"), nullable=False),
+        sa.Column("status", payroll_status),
+        sa.Column("pdf_path", sa.String(255)),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("completed_at", sa.DateTime()),
+    )
+
+
+def downgrade():
+    op.drop_table("payroll_runs")
+    op.drop_table("employees")
+    op.drop_table("family_offices")
+    payroll_status.drop(op.get_bind(), checkfirst=True)
@@ -0,0 +1,37 @@
+"""Requested employee IDs on payroll runs and per-employee line items
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("employee_ids", sa.JSON()))
+    op.create_table(
+        "payroll_line_items",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("payroll_run_id", sa.Integer(), sa.ForeignKey("payroll_runs.id"), nullable=False),
+        sa.Column("employee_id", sa.Integer(), sa.ForeignKey("employees.id"), nullable=False),
+        sa.Column("employee_name", sa.String(100), nullable=False),
+        sa.Column("gross_pay", sa.Numeric(10, 2), nullable=False),
+        sa.Column("tax", sa.Numeric(10, 2), nullable=False),
+        sa.Column("deductions", sa.Numeric(10, 2), nullable=False),
+        sa.Column("net_pay", sa.Numeric(10, 2), nullable=False),
+    )
+    op.create_index("ix_payroll_line_items_payroll_run_id", "payroll_line_items", ["payroll_run_id"])
+
+
+def downgrade():
+    op.drop_index("ix_payroll_line_items_payroll_run_id", table_name="payroll_line_items")
+    op.drop_table("payroll_line_items")
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_column("employee_ids")
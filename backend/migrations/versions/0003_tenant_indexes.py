@@ -0,0 +1,37 @@
+"""Composite indexes for the tenant-scoped hot queries
+
+Every employee and payroll run lookup filters by family_office_id first;
+payroll runs are also filtered by status. On PostgreSQL the indexes are
+built CONCURRENTLY so existing tables stay writable during the migration.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        op.create_index(
+            "ix_employees_family_office_id_id", "employees", ["family_office_id", "id"],
+            postgresql_concurrently=True
+        )
+        op.create_index(
+            "ix_payroll_runs_family_office_id_status_id", "payroll_runs", ["family_office_id", "status", "id"],
+            postgresql_concurrently=True
+        )
+
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        op.drop_index(
+            "ix_payroll_runs_family_office_id_status_id", table_name="payroll_runs",
+            postgresql_concurrently=True
+        )
+        op.drop_index("ix_employees_family_office_id_id", table_name="employees", postgresql_concurrently=True)
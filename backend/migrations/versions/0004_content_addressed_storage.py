@@ -0,0 +1,27 @@
+"""Content-addressed storage keys for combined and individual pay stubs
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("pdf_key", sa.String(100)))
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.add_column(sa.Column("stub_key", sa.String(100)))
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.drop_column("stub_key")
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_column("pdf_key")
@@ -0,0 +1,33 @@
+"""Incremental payroll runs: input fingerprints and reuse counts
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("incremental", sa.Boolean(), nullable=False, server_default=sa.false()))
+        batch_op.add_column(sa.Column("reused_count", sa.Integer()))
+        batch_op.add_column(sa.Column("rebuilt_count", sa.Integer()))
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.add_column(sa.Column("deduction_lines", sa.JSON()))
+        batch_op.add_column(sa.Column("fingerprint", sa.String(64)))
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.drop_column("fingerprint")
+        batch_op.drop_column("deduction_lines")
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_column("rebuilt_count")
+        batch_op.drop_column("reused_count")
+        batch_op.drop_column("incremental")
@@ -0,0 +1,35 @@
+"""Idempotency keys and active-run coalescing for payroll submissions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("idempotency_key", sa.String(100)))
+        batch_op.add_column(sa.Column("request_fingerprint", sa.String(64)))
+        batch_op.add_column(sa.Column("active_fingerprint", sa.String(64)))
+        batch_op.create_unique_constraint(
+            "uq_payroll_runs_idempotency_key", ["family_office_id", "idempotency_key"]
+        )
+        batch_op.create_unique_constraint(
+            "uq_payroll_runs_active_fingerprint", ["family_office_id", "active_fingerprint"]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_constraint("uq_payroll_runs_active_fingerprint", type_="unique")
+        batch_op.drop_constraint("uq_payroll_runs_idempotency_key", type_="unique")
+        batch_op.drop_column("active_fingerprint")
+        batch_op.drop_column("request_fingerprint")
+        batch_op.drop_column("idempotency_key")
@@ -0,0 +1,29 @@
+"""Queue routing, run start times and per-office scheduling weights
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("family_offices") as batch_op:
+        batch_op.add_column(sa.Column("scheduling_weight", sa.Integer(), nullable=False, server_default="1"))
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("queue", sa.String(30)))
+        batch_op.add_column(sa.Column("started_at", sa.DateTime()))
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_column("started_at")
+        batch_op.drop_column("queue")
+    with op.batch_alter_table("family_offices") as batch_op:
+        batch_op.drop_column("scheduling_weight")
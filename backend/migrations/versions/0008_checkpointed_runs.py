@@ -0,0 +1,33 @@
+"""Run attempts, heartbeats and one line item per employee and run
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("attempt", sa.Integer(), nullable=False, server_default="0"))
+        batch_op.add_column(sa.Column("heartbeat_at", sa.DateTime()))
+        batch_op.create_index("ix_payroll_runs_status_heartbeat_at", ["status", "heartbeat_at"])
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.create_unique_constraint(
+            "uq_payroll_line_items_run_employee", ["payroll_run_id", "employee_id"]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_line_items") as batch_op:
+        batch_op.drop_constraint("uq_payroll_line_items_run_employee", type_="unique")
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_index("ix_payroll_runs_status_heartbeat_at")
+        batch_op.drop_column("heartbeat_at")
+        batch_op.drop_column("attempt")
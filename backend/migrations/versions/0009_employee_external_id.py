@@ -0,0 +1,27 @@
+"""Employee external IDs, the natural key of bulk imports
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        batch_op.add_column(sa.Column("external_id", sa.String(64)))
+        batch_op.create_unique_constraint(
+            "uq_employees_family_office_id_external_id", ["family_office_id", "external_id"]
+        )
+
+
+def downgrade():
+    with op.batch_alter_table("employees") as batch_op:
+        batch_op.drop_constraint("uq_employees_family_office_id_external_id", type_="unique")
+        batch_op.drop_column("external_id")
@@ -0,0 +1,45 @@
+"""Scheduled payroll batches, office pay days and run pay periods
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        "payroll_batches",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("pay_period", sa.String(7), nullable=False),
+        sa.Column("office_count", sa.Integer(), nullable=False),
+        sa.Column("employee_count", sa.Integer(), nullable=False),
+        sa.Column("created_at", sa.DateTime()),
+        sa.Column("completed_at", sa.DateTime()),
+    )
+    with op.batch_alter_table("family_offices") as batch_op:
+        batch_op.add_column(sa.Column("payroll_day", sa.Integer()))
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("batch_id", sa.Integer()))
+        batch_op.add_column(sa.Column("pay_period", sa.String(7)))
+        batch_op.create_foreign_key("fk_payroll_runs_batch_id", "payroll_batches", ["batch_id"], ["id"])
+        batch_op.create_index("ix_payroll_runs_batch_id", ["batch_id"])
+        batch_op.create_unique_constraint("uq_payroll_runs_pay_period", ["family_office_id", "pay_period"])
+
+
+def downgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_constraint("uq_payroll_runs_pay_period", type_="unique")
+        batch_op.drop_index("ix_payroll_runs_batch_id")
+        batch_op.drop_constraint("fk_payroll_runs_batch_id", type_="foreignkey")
+        batch_op.drop_column("pay_period")
+        batch_op.drop_column("batch_id")
+    with op.batch_alter_table("family_offices") as batch_op:
+        batch_op.drop_column("payroll_day")
+    op.drop_table("payroll_batches")
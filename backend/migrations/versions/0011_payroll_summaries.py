@@ -0,0 +1,54 @@
+"""Per-run and per-period payroll summaries
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0011"
+down_revision = "0010"
+branch_labels = None
+depends_on = None
+
+
+def _totals():
+    return [
+        sa.Column("headcount", sa.Integer(), nullable=False),
+        sa.Column("gross_pay", sa.Numeric(16, 2), nullable=False),
+        sa.Column("tax", sa.Numeric(16, 2), nullable=False),
+        sa.Column("deductions", sa.Numeric(16, 2), nullable=False),
+        sa.Column("net_pay", sa.Numeric(16, 2), nullable=False),
+    ]
+
+
+def upgrade():
+    op.create_table(
+        "payroll_run_summaries",
+        sa.Column("payroll_run_id", sa.Integer(), sa.ForeignKey("payroll_runs.id"), primary_key=True),
+        sa.Column("family_office_id", sa.Integer(), sa.ForeignKey("family_offices.id"), nullable=False),
+        sa.Column("pay_period", sa.String(7), nullable=False),
+        sa.Column("completed_at", sa.DateTime(), nullable=False),
+        *_totals(),
+    )
+    op.create_index(
+        "ix_payroll_run_summaries_family_office_id_completed_at", "payroll_run_summaries",
+        ["family_office_id", "completed_at"]
+    )
+    op.create_table(
+        "payroll_period_summaries",
+        sa.Column("id", sa.Integer(), primary_key=True),
+        sa.Column("family_office_id", sa.Integer(), sa.ForeignKey("family_offices.id"), nullable=False),
+        sa.Column("pay_period", sa.String(7), nullable=False),
+        sa.Column("run_count", sa.Integer(), nullable=False),
+        *_totals(),
+        sa.Column("updated_at", sa.DateTime(), nullable=False),
+        sa.UniqueConstraint("family_office_id", "pay_period", name="uq_payroll_period_summaries_office_period"),
+    )
+
+
+def downgrade():
+    op.drop_table("payroll_period_summaries")
+    op.drop_index("ix_payroll_run_summaries_family_office_id_completed_at", table_name="payroll_run_summaries")
+    op.drop_table("payroll_run_summaries")
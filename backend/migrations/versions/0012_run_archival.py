@@ -0,0 +1,27 @@
+"""Archived run bundles
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-18
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0012"
+down_revision = "0011"
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.add_column(sa.Column("bundle_key", sa.String(100)))
+        batch_op.add_column(sa.Column("archived_at", sa.DateTime()))
+    op.create_index("ix_payroll_line_items_stub_key", "payroll_line_items", ["stub_key"])
+
+
+def downgrade():
+    op.drop_index("ix_payroll_line_items_stub_key", table_name="payroll_line_items")
+    with op.batch_alter_table("payroll_runs") as batch_op:
+        batch_op.drop_column("archived_at")
+        batch_op.drop_column("bundle_key")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Enum
+from sqlalchemy import Column, Integer, String, ForeignKey, DateTime, Numeric, Enum, JSON, Index, Boolean, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -19,6 +19,11 @@ class FamilyOffice(Base):
     
     id = Column(Integer, primary_key=True)
     name = Column(String(100), nullable=False, unique=True)
+    # Multiplies the per-office limit on concurrently processing runs
+    scheduling_weight = Column(Integer, nullable=False, default=1)
+    # Day of the month scheduled batches run this office's payroll (days past
+    # the end of a month fall on its last day); NULL opts out
+    payroll_day = Column(Integer, nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     
     employees = relationship("Employee", back_populates="family_office")
@@ -27,9 +32,16 @@ class FamilyOffice(Base):
 
 class Employee(Base):
     __tablename__ = "employees"
+    __table_args__ = (
+        Index("ix_employees_family_office_id_id", "family_office_id", "id"),
+        # Natural key that bulk imports upsert on
+        UniqueConstraint("family_office_id", "external_id", name="uq_employees_family_office_id_external_id"),
+    )
     
     id = Column(Integer, primary_key=True)
     family_office_id = Column(Integer, ForeignKey("family_offices.id"), nullable=False)
+    # The office's own identifier for the employee, e.g. from its HR system
+    external_id = Column(String(64), nullable=True)
     name = Column(String(100), nullable=False)
     salary = Column(Numeric(10, 2), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
@@ -39,12 +51,139 @@ class Employee(Base):
 
 class PayrollRun(Base):
     __tablename__ = "payroll_runs"
+    __table_args__ = (
+        Index("ix_payroll_runs_family_office_id_status_id", "family_office_id", "status", "id"),
+        # Backs Idempotency-Key replays and coalescing of identical active runs
+        UniqueConstraint("family_office_id", "idempotency_key", name="uq_payroll_runs_idempotency_key"),
+        UniqueConstraint("family_office_id", "active_fingerprint", name="uq_payroll_runs_active_fingerprint"),
+        # Used by the reaper to find stalled processing runs
+        Index("ix_payroll_runs_status_heartbeat_at", "status", "heartbeat_at"),
+        # A scheduled batch runs each office's payroll once per pay period
+        UniqueConstraint("family_office_id", "pay_period", name="uq_payroll_runs_pay_period"),
+    )
     
     id = Column(Integer, primary_key=True)
     family_office_id = Column(Integer, ForeignKey("family_offices.id"), nullable=False)
     status = Column(Enum(PayrollStatus), default=PayrollStatus.PENDING)
+    # Legacy location of the combined PDF; new runs record pdf_key instead
     pdf_path = Column(String(255), nullable=True)
+    # Content-addressed storage key of the combined PDF
+    pdf_key = Column(String(100), nullable=True)
+    # Employees requested for this run; NULL means every employee in the office
+    employee_ids = Column(JSON, nullable=True)
+    # Incremental runs reuse the previous completed run's results for
+    # employees whose pay inputs are unchanged
+    incremental = Column(Boolean, nullable=False, default=False)
+    reused_count = Column(Integer, nullable=True)
+    rebuilt_count = Column(Integer, nullable=True)
+    # Client-supplied Idempotency-Key and a hash of the request body
+    idempotency_key = Column(String(100), nullable=True)
+    request_fingerprint = Column(String(64), nullable=True)
+    # Same as request_fingerprint while the run is pending or processing,
+    # cleared once it finishes so an identical run can be submitted again
+    active_fingerprint = Column(String(64), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     completed_at = Column(DateTime, nullable=True)
+    # Celery queue the run was routed to and when a worker started it;
+    # started_at - created_at is the run's queue wait
+    queue = Column(String(30), nullable=True)
+    started_at = Column(DateTime, nullable=True)
+    # Incremented each time a worker takes the run; checkpoints are fenced on it
+    attempt = Column(Integer, nullable=False, default=0)
+    # Last checkpoint of the worker processing the run
+    heartbeat_at = Column(DateTime, nullable=True)
+    # Scheduled batch that created the run and its pay period (YYYY-MM);
+    # both NULL for runs submitted through the API
+    batch_id = Column(Integer, ForeignKey("payroll_batches.id", name="fk_payroll_runs_batch_id"), nullable=True,
+                      index=True)
+    pay_period = Column(String(7), nullable=True)
+    # Set when the run was packed into a compressed ZIP (content-addressed
+    # storage key) and its PDFs no other run references were deleted
+    bundle_key = Column(String(100), nullable=True)
+    archived_at = Column(DateTime, nullable=True)
     
-    family_office = relationship("FamilyOffice", back_populates="payroll_runs")
\ No newline at end of file
+    family_office = relationship("FamilyOffice", back_populates="payroll_runs")
+    line_items = relationship("PayrollLineItem", back_populates="payroll_run")
+    batch = relationship("PayrollBatch", back_populates="runs")
+
+
+class PayrollBatch(Base):
+    """Runs created together by the scheduler for every office due in a pay period"""
+    __tablename__ = "payroll_batches"
+    
+    id = Column(Integer, primary_key=True)
+    pay_period = Column(String(7), nullable=False)
+    office_count = Column(Integer, nullable=False)
+    employee_count = Column(Integer, nullable=False)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    # Set when the batch's last run finished; completed_at - created_at is
+    # the batch's wall-clock time
+    completed_at = Column(DateTime, nullable=True)
+    
+    runs = relationship("PayrollRun", back_populates="batch")
+
+
+class PayrollLineItem(Base):
+    __tablename__ = "payroll_line_items"
+    __table_args__ = (
+        # A line item is a run's checkpoint for that employee
+        UniqueConstraint("payroll_run_id", "employee_id", name="uq_payroll_line_items_run_employee"),
+        # Archival checks whether other runs still reference a stub
+        Index("ix_payroll_line_items_stub_key", "stub_key"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    payroll_run_id = Column(Integer, ForeignKey("payroll_runs.id"), nullable=False, index=True)
+    employee_id = Column(Integer, ForeignKey("employees.id"), nullable=False)
+    employee_name = Column(String(100), nullable=False)
+    gross_pay = Column(Numeric(10, 2), nullable=False)
+    tax = Column(Numeric(10, 2), nullable=False)
+    deductions = Column(Numeric(10, 2), nullable=False, default=0)
+    net_pay = Column(Numeric(10, 2), nullable=False)
+    # Per-deduction amounts as [name, amount] pairs
+    deduction_lines = Column(JSON, nullable=True)
+    # Hash of every input of this line item and its stub (see tasks.pay_fingerprint)
+    fingerprint = Column(String(64), nullable=True)
+    # Storage key of the individual stub, when individual stubs are written
+    stub_key = Column(String(100), nullable=True)
+    
+    payroll_run = relationship("PayrollRun", back_populates="line_items")
+
+
+class PayrollRunSummary(Base):
+    """Totals of one completed run, written in the transaction that completes it"""
+    __tablename__ = "payroll_run_summaries"
+    __table_args__ = (
+        Index("ix_payroll_run_summaries_family_office_id_completed_at", "family_office_id", "completed_at"),
+    )
+    
+    payroll_run_id = Column(Integer, ForeignKey("payroll_runs.id"), primary_key=True)
+    family_office_id = Column(Integer, ForeignKey("family_offices.id"), nullable=False)
+    # The run's scheduled pay period, else the month it completed (YYYY-MM)
+    pay_period = Column(String(7), nullable=False)
+    completed_at = Column(DateTime, nullable=False)
+    headcount = Column(Integer, nullable=False)
+    gross_pay = Column(Numeric(16, 2), nullable=False)
+    tax = Column(Numeric(16, 2), nullable=False)
+    deductions = Column(Numeric(16, 2), nullable=False)
+    net_pay = Column(Numeric(16, 2), nullable=False)
+
+
+class PayrollPeriodSummary(Base):
+    """Running totals of an office's completed runs in one pay period"""
+    __tablename__ = "payroll_period_summaries"
+    __table_args__ = (
+        UniqueConstraint("family_office_id", "pay_period", name="uq_payroll_period_summaries_office_period"),
+    )
+    
+    id = Column(Integer, primary_key=True)
+    family_office_id = Column(Integer, ForeignKey("family_offices.id"), nullable=False)
+    pay_period = Column(String(7), nullable=False)
+    run_count = Column(Integer, nullable=False)
+    # Employees paid, counted once per run
+    headcount = Column(Integer, nullable=False)
+    gross_pay = Column(Numeric(16, 2), nullable=False)
+    tax = Column(Numeric(16, 2), nullable=False)
+    deductions = Column(Numeric(16, 2), nullable=False)
+    net_pay = Column(Numeric(16, 2), nullable=False)
+    updated_at = Column(DateTime, nullable=False)
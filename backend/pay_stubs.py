@@ -0,0 +1,263 @@
+import json
+import os
+import zlib
+from array import array
+from datetime import datetime
+from functools import lru_cache
+from typing import Dict, Optional
+from pydantic import BaseModel
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+from reportlab.lib.units import inch
+
+# Name of the form XObject holding a template's static layer
+STATIC_LAYER = "StubStatic"
+
+
+class StubTemplate(BaseModel):
+    """Configurable text of a pay stub; the layout itself is fixed"""
+    version: str = "default-v1"
+    title: str = "Pay Stub"
+    # Optional line next to the date, e.g. the family office's legal name
+    subtitle: Optional[str] = None
+    date_format: str = "%B %Y"
+    footer: str = "This is a computer-generated document."
+
+
+DEFAULT_STUB_TEMPLATE = StubTemplate()
+
+
+@lru_cache(maxsize=1)
+def _configured_templates() -> Dict[str, StubTemplate]:
+    # PAYROLL_STUB_TEMPLATES points at a JSON object mapping family office IDs
+    # (or "default") to StubTemplate fields
+    path = os.getenv("PAYROLL_STUB_TEMPLATES")
+    if not path:
+        return {}
+    with open(path) as f:
+        return {key: StubTemplate(**fields) for key, fields in json.load(f).items()}
+
+
+def get_stub_template(family_office_id: int) -> StubTemplate:
+    """Stub template for a family office, falling back to the default"""
+    templates = _configured_templates()
+    return templates.get(str(family_office_id)) or templates.get("default") or DEFAULT_STUB_TEMPLATE
+
+
+def stub_period(template: StubTemplate, when: Optional[datetime] = None) -> str:
+    """The pay period text printed on every stub of a run"""
+    return (when or datetime.now()).strftime(template.date_format)
+
+
+def draw_static_layer(c, template, period):
+    """Draw the parts of a stub that are identical for every employee in a run"""
+    width, height = letter
+
+    # Header
+    c.setFont("Helvetica-Bold", 20)
+    c.drawString(1 * inch, height - 1 * inch, template.title)
+
+    # Date
+    c.setFont("Helvetica", 12)
+    c.drawString(1 * inch, height - 1.5 * inch, f"Date: {period}")
+    if template.subtitle:
+        c.drawString(4 * inch, height - 1.5 * inch, template.subtitle)
+
+    # Separator line
+    c.line(1 * inch, height - 2.5 * inch, width - 1 * inch, height - 2.5 * inch)
+
+    # Section labels
+    c.drawString(1 * inch, height - 3 * inch, "Earnings:")
+    c.drawString(1 * inch, height - 4 * inch, "Deductions:")
+
+    # Footer
+    c.setFont("Helvetica", 10)
+    c.drawString(1 * inch, 1 * inch, template.footer)
+
+
+def draw_employee_fields(c, employee, pay):
+    """Draw the per-employee fields of a stub.
+
+    ``pay`` is the employee's calculations.PayLine; amounts are printed as
+    calculated, nothing is recomputed here.
+    """
+    height = letter[1]
+
+    # Employee info
+    c.setFont("Helvetica", 12)
+    c.drawString(1 * inch, height - 2 * inch, f"Employee: {employee.name}")
+    c.drawString(1 * inch, height - 2.3 * inch, f"Employee ID: {employee.id}")
+
+    # Payment details
+    c.drawString(2 * inch, height - 3.3 * inch, f"Gross Salary: ${pay.gross_pay:,.2f}")
+    c.drawString(2 * inch, height - 4.3 * inch, f"{pay.tax_label}: ${pay.tax:,.2f}")
+    for i, (name, amount) in enumerate(pay.deductions, start=1):
+        c.drawString(2 * inch, height - (4.3 + 0.3 * i) * inch, f"{name}: ${amount:,.2f}")
+
+    # Total
+    bottom = 5 + 0.3 * len(pay.deductions)
+    c.setFont("Helvetica-Bold", 14)
+    c.drawString(1 * inch, height - bottom * inch, f"Net Pay: ${pay.net_pay:,.2f}")
+
+
+def generate_pay_stub_pdf(employee, pay, pdf_path, template=DEFAULT_STUB_TEMPLATE, period=None):
+    """Generate a single-employee PDF pay stub"""
+    # invariant drops the creation timestamp and random document ID, so the
+    # same stub always produces the same bytes and is stored only once
+    c = canvas.Canvas(pdf_path, pagesize=letter, invariant=True)
+    c.beginForm(STATIC_LAYER)
+    draw_static_layer(c, template, period or stub_period(template))
+    c.endForm()
+    c.doForm(STATIC_LAYER)
+    draw_employee_fields(c, employee, pay)
+    c.save()
+
+
+def _pdf_string(text):
+    data = text.encode("cp1252", errors="replace")
+    return b"(" + data.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+class _PageCanvas:
+    """The subset of the reportlab canvas API used by the stub drawing functions.
+
+    Drawing calls are turned straight into PDF content stream operators so a
+    page can be written out as soon as it is finished.
+    """
+
+    def __init__(self, font_names):
+        self._font_names = font_names
+        self._ops = []
+        self._font = None
+
+    def setFont(self, name, size):
+        self._font = b"/%s %g Tf" % (self._font_names[name], size)
+
+    def drawString(self, x, y, text):
+        self._ops.append(b"BT %s 1 0 0 1 %.2f %.2f Tm %s Tj ET" % (self._font, x, y, _pdf_string(text)))
+
+    def line(self, x1, y1, x2, y2):
+        self._ops.append(b"%.2f %.2f m %.2f %.2f l S" % (x1, y1, x2, y2))
+
+    def doForm(self, name):
+        self._ops.append(b"/%s Do" % name.encode())
+
+    def content(self):
+        return b"\n".join(self._ops)
+
+
+class PayStubDocument:
+    """Streams pay stub pages into one combined PDF as they are produced.
+
+    Every page is compressed and written to disk by ``add_stub``; only an
+    8-byte offset per object is kept, so memory stays flat regardless of the
+    number of employees. Object numbers are fixed up front (catalog, page tree,
+    fonts, the static layer, then a content/page pair per stub) so the page
+    tree can be written last without remembering the pages.
+
+    The template's static layer is written once as a form XObject that every
+    page references, so each page only carries the employee's own fields.
+    ``cache_static_layer=False`` draws the whole stub on every page instead.
+    """
+
+    FONTS = ("Helvetica", "Helvetica-Bold")
+    _CATALOG, _PAGES, _FIRST_FONT = 1, 2, 3
+
+    def __init__(self, pdf_path, template=DEFAULT_STUB_TEMPLATE, period=None, pagesize=letter,
+                 cache_static_layer=True):
+        self.pdf_path = pdf_path
+        self.page_count = 0
+        self.template = template
+        self.period = period or stub_period(template)
+        self._pagesize = pagesize
+        self._cache_static_layer = cache_static_layer
+        self._font_names = {name: b"F%d" % (i + 1) for i, name in enumerate(self.FONTS)}
+        self._static_layer_object = self._FIRST_FONT + len(self.FONTS)
+        self._first_page_object = self._static_layer_object + 1
+        self._offsets = array("Q", [0] * self._FIRST_FONT)
+        self._file = open(pdf_path, "wb")
+        self._file.write(b"%PDF-1.4\n%\x93\x8c\x8b\x9e\n")
+        for i, name in enumerate(self.FONTS):
+            self._write_object(
+                self._FIRST_FONT + i,
+                b"<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>" % name.encode()
+            )
+        font_resources = b"/Font << %s >>" % b" ".join(
+            b"/%s %d 0 R" % (self._font_names[name], self._FIRST_FONT + i)
+            for i, name in enumerate(self.FONTS)
+        )
+
+        static_canvas = _PageCanvas(self._font_names)
+        draw_static_layer(static_canvas, template, self.period)
+        stream = zlib.compress(static_canvas.content())
+        self._write_object(
+            self._static_layer_object,
+            b"<< /Type /XObject /Subtype /Form /BBox [0 0 %g %g] /Resources << %s >> "
+            b"/Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream"
+            % (pagesize[0], pagesize[1], font_resources, len(stream), stream)
+        )
+        self._page_resources = b"<< %s /XObject << /%s %d 0 R >> >>" % (
+            font_resources, STATIC_LAYER.encode(), self._static_layer_object
+        )
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self._file.close()
+
+    def _begin_object(self, number):
+        if number == len(self._offsets):
+            self._offsets.append(self._file.tell())
+        else:
+            self._offsets[number] = self._file.tell()
+        self._file.write(b"%d 0 obj\n" % number)
+
+    def _write_object(self, number, body):
+        self._begin_object(number)
+        self._file.write(b"%s\nendobj\n" % body)
+
+    def add_stub(self, employee, pay):
+        """Render one employee's page and write it out immediately"""
+        page_canvas = _PageCanvas(self._font_names)
+        if self._cache_static_layer:
+            page_canvas.doForm(STATIC_LAYER)
+        else:
+            draw_static_layer(page_canvas, self.template, self.period)
+        draw_employee_fields(page_canvas, employee, pay)
+        stream = zlib.compress(page_canvas.content())
+
+        content_number = self._first_page_object + 2 * self.page_count
+        self._write_object(
+            content_number,
+            b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(stream), stream)
+        )
+        self._write_object(
+            content_number + 1,
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %g %g] /Contents %d 0 R /Resources %s >>"
+            % (self._PAGES, self._pagesize[0], self._pagesize[1], content_number, self._page_resources)
+        )
+        self.page_count += 1
+
+    def close(self):
+        """Write the page tree, catalog and cross-reference table"""
+        self._begin_object(self._PAGES)
+        self._file.write(b"<< /Type /Pages /Kids [")
+        for i in range(self.page_count):
+            self._file.write(b"%d 0 R " % (self._first_page_object + 2 * i + 1))
+        self._file.write(b"] /Count %d >>\nendobj\n" % self.page_count)
+        self._write_object(self._CATALOG, b"<< /Type /Catalog /Pages %d 0 R >>" % self._PAGES)
+
+        size = len(self._offsets)
+        xref_offset = self._file.tell()
+        self._file.write(b"xref\n0 %d\n0000000000 65535 f \n" % size)
+        for number in range(1, size):
+            self._file.write(b"%010d 00000 n \n" % self._offsets[number])
+        self._file.write(
+            b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+            % (size, self._CATALOG, xref_offset)
+        )
+        self._file.close()
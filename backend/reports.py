@@ -0,0 +1,147 @@
+"""Materialized payroll summaries: totals per completed run and per pay period.
+
+When ``tasks.process_payroll`` completes a run it aggregates the run's line
+items once and, in the same transaction, inserts the run's summary and adds
+it to the office's period summary. ``GET /payroll/reports`` then reads only
+these rows, so its cost does not grow with the number of runs or employees.
+
+A run's pay period is its scheduled ``pay_period``, else the month it
+completed. ``python -m reports rebuild`` recomputes every summary from the
+line items, e.g. for runs completed before summaries existed.
+
+Usage: python -m reports rebuild
+       python -m reports show --office-id 1 [--start 2024-01-01] [--end 2024-12-31]
+"""
+import argparse
+import json
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from sqlalchemy import delete, func, select
+from sqlalchemy.dialects import postgresql, sqlite
+
+from batches import pay_period
+from models import PayrollLineItem, PayrollPeriodSummary, PayrollRun, PayrollRunSummary, PayrollStatus
+
+TOTAL_FIELDS = ("headcount", "gross_pay", "tax", "deductions", "net_pay")
+CENT = Decimal("0.01")
+
+
+def run_totals(db, payroll_run_id: int) -> dict:
+    """Headcount and pay totals of a run's line items"""
+    row = db.execute(
+        select(
+            func.count(PayrollLineItem.id),
+            func.coalesce(func.sum(PayrollLineItem.gross_pay), 0),
+            func.coalesce(func.sum(PayrollLineItem.tax), 0),
+            func.coalesce(func.sum(PayrollLineItem.deductions), 0),
+            func.coalesce(func.sum(PayrollLineItem.net_pay), 0),
+        ).where(PayrollLineItem.payroll_run_id == payroll_run_id)
+    ).one()
+    headcount, *amounts = row
+    # Sums of SQLite's floating point NUMERIC are rounded back to cents
+    return dict(zip(TOTAL_FIELDS, [headcount, *(Decimal(amount).quantize(CENT) for amount in amounts)]))
+
+
+def record_run_summary(db, payroll_run: PayrollRun, completed_at: datetime) -> PayrollRunSummary:
+    """Insert a completed run's summary and add it to its period's summary.
+
+    Not committed: call in the transaction that marks the run completed, so
+    a run is counted exactly once.
+    """
+    summary = PayrollRunSummary(
+        payroll_run_id=payroll_run.id,
+        family_office_id=payroll_run.family_office_id,
+        pay_period=payroll_run.pay_period or pay_period(completed_at),
+        completed_at=completed_at,
+        **run_totals(db, payroll_run.id),
+    )
+    db.add(summary)
+    db.flush()
+    _add_to_period(db, summary)
+    return summary
+
+
+def _add_to_period(db, summary: PayrollRunSummary):
+    totals = {field: getattr(summary, field) for field in TOTAL_FIELDS}
+    insert = (postgresql if db.get_bind().dialect.name == "postgresql" else sqlite).insert(PayrollPeriodSummary)
+    table = PayrollPeriodSummary.__table__
+    db.execute(
+        insert.values(
+            family_office_id=summary.family_office_id, pay_period=summary.pay_period, run_count=1,
+            updated_at=summary.completed_at, **totals
+        ).on_conflict_do_update(
+            index_elements=["family_office_id", "pay_period"],
+            set_={
+                "run_count": table.c.run_count + 1,
+                "updated_at": insert.excluded.updated_at,
+                **{field: table.c[field] + insert.excluded[field] for field in TOTAL_FIELDS},
+            },
+        )
+    )
+
+
+def rebuild_summaries(db) -> int:
+    """Recompute every summary from the completed runs' line items; returns the runs summarized"""
+    db.execute(delete(PayrollPeriodSummary))
+    db.execute(delete(PayrollRunSummary))
+    runs = db.query(PayrollRun).filter(PayrollRun.status == PayrollStatus.COMPLETED).order_by(PayrollRun.id).all()
+    for payroll_run in runs:
+        record_run_summary(db, payroll_run, payroll_run.completed_at or payroll_run.created_at)
+    db.commit()
+    return len(runs)
+
+
+def period_summary_query(office_id: int, start: Optional[date] = None, end: Optional[date] = None):
+    """An office's period summaries for the months from ``start`` to ``end``"""
+    query = select(PayrollPeriodSummary).where(PayrollPeriodSummary.family_office_id == office_id)
+    if start is not None:
+        query = query.where(PayrollPeriodSummary.pay_period >= pay_period(start))
+    if end is not None:
+        query = query.where(PayrollPeriodSummary.pay_period <= pay_period(end))
+    return query.order_by(PayrollPeriodSummary.pay_period)
+
+
+def run_summary_query(office_id: int, start: Optional[date] = None, end: Optional[date] = None,
+                      limit: Optional[int] = None):
+    """An office's run summaries completed from ``start`` to ``end`` (inclusive), newest first"""
+    query = select(PayrollRunSummary).where(PayrollRunSummary.family_office_id == office_id)
+    if start is not None:
+        query = query.where(PayrollRunSummary.completed_at >= datetime.combine(start, time.min))
+    if end is not None:
+        query = query.where(PayrollRunSummary.completed_at < datetime.combine(end + timedelta(days=1), time.min))
+    return query.order_by(PayrollRunSummary.completed_at.desc(), PayrollRunSummary.payroll_run_id.desc()).limit(limit)
+
+
+def _as_dict(summary):
+    return {column.name: getattr(summary, column.name) for column in summary.__table__.columns}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Materialized payroll summaries")
+    subcommands = parser.add_subparsers(dest="command", required=True)
+    subcommands.add_parser("rebuild", help="recompute every summary from the line items")
+    show = subcommands.add_parser("show", help="print an office's period and run summaries")
+    show.add_argument("--office-id", type=int, required=True)
+    show.add_argument("--start", type=date.fromisoformat)
+    show.add_argument("--end", type=date.fromisoformat)
+    args = parser.parse_args()
+
+    from database import SessionLocal
+    db = SessionLocal()
+    try:
+        if args.command == "rebuild":
+            print(f"Summarized {rebuild_summaries(db)} completed runs")
+        else:
+            periods = db.scalars(period_summary_query(args.office_id, args.start, args.end))
+            runs = db.scalars(run_summary_query(args.office_id, args.start, args.end))
+            print(json.dumps({
+                "periods": [_as_dict(row) for row in periods], "runs": [_as_dict(row) for row in runs]
+            }, indent=2, default=str))
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,41 @@
+"""Opt-in fast JSON encoding of API responses.
+
+With PAYROLL_FAST_JSON=true, employee lists and payroll runs are encoded
+with orjson straight from the database rows, without validating every row
+through its Pydantic response model first. The output is the same as the
+standard path: Numeric amounts become JSON numbers (floats, as in
+EmployeeResponse) and datetimes ISO 8601 strings.
+
+Usage: PAYROLL_FAST_JSON=true uvicorn main:app
+"""
+import os
+from decimal import Decimal
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+FAST_JSON = os.getenv("PAYROLL_FAST_JSON", "false").lower() in ("1", "true", "yes")
+
+# Timezone-aware datetimes end in "Z", like Pydantic's
+_ORJSON_OPTIONS = orjson.OPT_UTC_Z
+
+
+def _default(value):
+    # orjson encodes datetimes, enums and dataclasses itself, but not Decimal
+    if isinstance(value, Decimal):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content: Any) -> bytes:
+    """Encode ``content`` with orjson"""
+    return orjson.dumps(content, default=_default, option=_ORJSON_OPTIONS)
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson; Decimal values are encoded as floats"""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
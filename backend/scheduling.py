@@ -0,0 +1,193 @@
+"""Routing and per-tenant fair scheduling of payroll runs.
+
+Runs are routed to separate Celery queues by priority and size, so small
+runs are never stuck behind a giant one, and each family office may only
+have a limited number of runs processing at once. A worker that picks up a
+run for an office at its limit hands it back to the queue instead of
+waiting, so one office cannot occupy every worker.
+
+Every time a worker takes a run it increments the run's ``attempt`` and
+then heartbeats at each checkpoint, fenced on that attempt. A message
+redelivered after its worker was lost takes the run over at once; the
+reaper puts runs whose heartbeat stalled back on their queue. Either way,
+if the original worker was only slow, its next checkpoint finds the run
+taken over and stops.
+"""
+import os
+from datetime import datetime, timedelta
+from typing import Dict, List, NamedTuple
+
+from sqlalchemy import and_, func, or_, update
+
+from models import FamilyOffice, PayrollRun, PayrollStatus
+
+PRIORITY_QUEUE = "payroll.priority"
+SMALL_QUEUE = "payroll.small"
+LARGE_QUEUE = "payroll.large"
+PAYROLL_QUEUES = (PRIORITY_QUEUE, SMALL_QUEUE, LARGE_QUEUE)
+
+# Runs with at least this many employees go to the large queue
+LARGE_RUN_THRESHOLD = int(os.getenv("PAYROLL_LARGE_RUN_THRESHOLD", "1000"))
+
+# Runs processing at once per office, multiplied by the office's scheduling_weight
+TENANT_CONCURRENCY = int(os.getenv("PAYROLL_TENANT_CONCURRENCY", "2"))
+
+# Delay before a run deferred by its office's limit is tried again
+SLOT_RETRY_SECONDS = float(os.getenv("PAYROLL_SLOT_RETRY_SECONDS", "10"))
+
+# A processing run without a heartbeat for this long is considered stalled
+STALL_TIMEOUT = timedelta(seconds=int(os.getenv("PAYROLL_STALL_TIMEOUT_SECONDS", "600")))
+
+# How often the reaper looks for stalled runs
+REAPER_INTERVAL_SECONDS = float(os.getenv("PAYROLL_REAPER_INTERVAL_SECONDS", "60"))
+
+# Queue wait statistics cover runs started within this window
+QUEUE_STATS_WINDOW = timedelta(hours=int(os.getenv("PAYROLL_QUEUE_STATS_HOURS", "24")))
+
+
+# Message priority of each queue's runs, 0 (lowest) to 9
+QUEUE_PRIORITIES = {PRIORITY_QUEUE: 9, SMALL_QUEUE: 5, LARGE_QUEUE: 0}
+
+
+class RunRoute(NamedTuple):
+    queue: str
+    # Message priority within the queue, 0 (lowest) to 9
+    priority: int
+
+
+class RunSuperseded(Exception):
+    """The run was taken over by a newer attempt; this one must stop without writing"""
+
+
+def route_run(employee_count: int, priority: str = "normal") -> RunRoute:
+    """Pick the queue and message priority for a run"""
+    if priority == "high":
+        return route_for_queue(PRIORITY_QUEUE)
+    if employee_count >= LARGE_RUN_THRESHOLD:
+        return route_for_queue(LARGE_QUEUE)
+    return route_for_queue(SMALL_QUEUE)
+
+
+def route_for_queue(queue: str) -> RunRoute:
+    """The route of a run that was already routed to ``queue``"""
+    if queue not in QUEUE_PRIORITIES:
+        queue = SMALL_QUEUE
+    return RunRoute(queue, QUEUE_PRIORITIES[queue])
+
+
+def tenant_run_limit(office: FamilyOffice) -> int:
+    return max(1, TENANT_CONCURRENCY * (office.scheduling_weight or 1))
+
+
+def acquire_run_slot(db, payroll_run: PayrollRun, take_over: bool = False) -> bool:
+    """Move a run to PROCESSING if its office is below its concurrency limit.
+
+    The office row is locked while counting, so concurrent workers cannot
+    both take the last slot. Returns False (and changes nothing) when the
+    office is at its limit.
+
+    The attempt is bumped only if the run still has the attempt it was read
+    with and is still pending, or processing with a stalled heartbeat (with
+    ``take_over``, any processing run: its message was redelivered because
+    its worker was lost). When another worker took it first, RunSuperseded
+    is raised. A worker whose run was taken over is fenced out at its next
+    checkpoint.
+    """
+    office = db.query(FamilyOffice).filter(
+        FamilyOffice.id == payroll_run.family_office_id
+    ).with_for_update().one()
+    processing = db.query(func.count(PayrollRun.id)).filter(
+        PayrollRun.family_office_id == office.id,
+        PayrollRun.status == PayrollStatus.PROCESSING,
+        PayrollRun.id != payroll_run.id
+    ).scalar()
+    if processing >= tenant_run_limit(office):
+        db.rollback()
+        return False
+    now = datetime.utcnow()
+    seen_attempt = payroll_run.attempt
+    claimable = PayrollRun.status == PayrollStatus.PROCESSING
+    if not take_over:
+        claimable = and_(
+            claimable, or_(PayrollRun.heartbeat_at.is_(None), PayrollRun.heartbeat_at < now - STALL_TIMEOUT)
+        )
+    result = db.execute(
+        update(PayrollRun).where(
+            PayrollRun.id == payroll_run.id,
+            PayrollRun.attempt == seen_attempt,
+            or_(PayrollRun.status == PayrollStatus.PENDING, claimable)
+        ).values(
+            status=PayrollStatus.PROCESSING,
+            started_at=func.coalesce(PayrollRun.started_at, now),
+            heartbeat_at=now,
+            attempt=PayrollRun.attempt + 1
+        ).execution_options(synchronize_session=False)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise RunSuperseded(f"Payroll run {payroll_run.id} attempt {seen_attempt} was taken by another worker")
+    db.commit()
+    db.refresh(payroll_run)
+    return True
+
+
+def is_stalled(payroll_run: PayrollRun, now=None) -> bool:
+    heartbeat = payroll_run.heartbeat_at or payroll_run.started_at
+    return heartbeat is None or heartbeat < (now or datetime.utcnow()) - STALL_TIMEOUT
+
+
+def checkpoint(db, payroll_run_id: int, attempt: int, **values):
+    """Heartbeat (and update ``values``) only while ``attempt`` owns the run.
+
+    Call before committing a chunk of work: if the run was taken over, the
+    uncommitted work is rolled back and RunSuperseded is raised.
+    """
+    result = db.execute(
+        update(PayrollRun).where(
+            PayrollRun.id == payroll_run_id,
+            PayrollRun.attempt == attempt,
+            PayrollRun.status == PayrollStatus.PROCESSING
+        ).values(heartbeat_at=datetime.utcnow(), **values)
+    )
+    if result.rowcount != 1:
+        db.rollback()
+        raise RunSuperseded(f"Payroll run {payroll_run_id} attempt {attempt} was superseded")
+
+
+def stalled_runs(db, now=None) -> List[PayrollRun]:
+    cutoff = (now or datetime.utcnow()) - STALL_TIMEOUT
+    return db.query(PayrollRun).filter(
+        PayrollRun.status == PayrollStatus.PROCESSING,
+        PayrollRun.heartbeat_at < cutoff
+    ).all()
+
+
+def release_stalled_run(db, payroll_run: PayrollRun) -> bool:
+    """Put a stalled run back to PENDING unless another worker touched it meanwhile"""
+    result = db.execute(
+        update(PayrollRun).where(
+            PayrollRun.id == payroll_run.id,
+            PayrollRun.attempt == payroll_run.attempt,
+            PayrollRun.status == PayrollStatus.PROCESSING,
+            PayrollRun.heartbeat_at == payroll_run.heartbeat_at
+        ).values(status=PayrollStatus.PENDING)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def queue_wait_seconds(payroll_run: PayrollRun) -> float:
+    return (payroll_run.started_at - payroll_run.created_at).total_seconds()
+
+
+def summarize_waits(waits: List[float]) -> Dict[str, float]:
+    """Count, mean, p95 and max of queue wait times in seconds"""
+    if not waits:
+        return {"count": 0, "avg": 0.0, "p95": 0.0, "max": 0.0}
+    waits = sorted(waits)
+    return {
+        "count": len(waits),
+        "avg": round(sum(waits) / len(waits), 3),
+        "p95": round(waits[min(len(waits) - 1, int(0.95 * len(waits)))], 3),
+        "max": round(waits[-1], 3),
+    }
@@ -0,0 +1,215 @@
+"""Content-addressed storage for generated pay stub PDFs.
+
+Objects are keyed by the SHA-256 of their bytes, so identical documents are
+stored once no matter how many runs produce them. Two backends share one
+interface: ``LocalStorage`` (a directory, the default) and ``S3Storage``
+(any S3-compatible service, MinIO included), selected with
+PAYROLL_STORAGE_BACKEND.
+"""
+import hashlib
+import os
+import shutil
+import tempfile
+from functools import lru_cache
+from typing import BinaryIO, Optional, Tuple
+
+# Local backend root, also used for scratch space while a run renders
+STORAGE_ROOT = os.getenv("PAYROLL_STORAGE_ROOT", "/storage")
+
+# S3-compatible backend (PAYROLL_STORAGE_BACKEND=s3)
+S3_BUCKET = os.getenv("PAYROLL_S3_BUCKET", "payroll")
+S3_ENDPOINT_URL = os.getenv("PAYROLL_S3_ENDPOINT_URL")
+
+# Lifetime of pre-signed download URLs
+PRESIGNED_URL_SECONDS = int(os.getenv("PAYROLL_PRESIGNED_URL_SECONDS", "300"))
+
+_HASH_CHUNK = 1024 * 1024
+
+CONTENT_TYPES = {".pdf": "application/pdf", ".zip": "application/zip"}
+
+
+def file_sha256(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def content_key(digest: str, suffix: str = ".pdf") -> str:
+    """Object key for a SHA-256 hex digest, fanned out by its first byte"""
+    return f"sha256/{digest[:2]}/{digest}{suffix}"
+
+
+def key_digest(key: str) -> str:
+    return os.path.splitext(os.path.basename(key))[0]
+
+
+def etag(key: str) -> str:
+    """Strong ETag of an object; the content hash never changes for a key"""
+    return f'"{key_digest(key)}"'
+
+
+class LocalStorage:
+    """Objects stored as files under a root directory"""
+
+    presigns = False
+
+    def __init__(self, root: str = STORAGE_ROOT):
+        self.root = root
+
+    def local_path(self, key: str) -> str:
+        return os.path.join(self.root, *key.split("/"))
+
+    def exists(self, key: str) -> bool:
+        return os.path.exists(self.local_path(key))
+
+    def size(self, key: str) -> int:
+        return os.path.getsize(self.local_path(key))
+
+    def open(self, key: str) -> BinaryIO:
+        return open(self.local_path(key), "rb")
+
+    def put_file(self, source_path: str, key: str) -> bool:
+        """Move ``source_path`` into place; returns False if the object already existed"""
+        dest = self.local_path(key)
+        if os.path.exists(dest):
+            os.remove(source_path)
+            return False
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        # Stage next to the destination so the final rename is atomic
+        fd, staging = tempfile.mkstemp(dir=os.path.dirname(dest), suffix=".tmp")
+        os.close(fd)
+        shutil.move(source_path, staging)
+        os.replace(staging, dest)
+        return True
+
+    def delete(self, key: str):
+        try:
+            os.remove(self.local_path(key))
+        except FileNotFoundError:
+            pass
+
+    def presigned_url(self, key: str, filename: Optional[str] = None,
+                      expires: int = PRESIGNED_URL_SECONDS) -> Optional[str]:
+        return None
+
+
+class S3Storage:
+    """Objects stored in an S3-compatible bucket; downloads use pre-signed URLs"""
+
+    presigns = True
+
+    def __init__(self, bucket: str = S3_BUCKET, client=None, endpoint_url: Optional[str] = S3_ENDPOINT_URL):
+        if client is None:
+            # Only deployments using this backend need boto3 installed
+            import boto3
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.bucket = bucket
+        self.client = client
+
+    def local_path(self, key: str) -> Optional[str]:
+        return None
+
+    def _head(self, key: str):
+        from botocore.exceptions import ClientError
+        try:
+            return self.client.head_object(Bucket=self.bucket, Key=key)
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                return None
+            raise
+
+    def exists(self, key: str) -> bool:
+        return self._head(key) is not None
+
+    def size(self, key: str) -> int:
+        return self._head(key)["ContentLength"]
+
+    def open(self, key: str) -> BinaryIO:
+        """The object's body, streamed from the bucket as it is read"""
+        return self.client.get_object(Bucket=self.bucket, Key=key)["Body"]
+
+    def put_file(self, source_path: str, key: str) -> bool:
+        """Upload ``source_path`` unless the object already exists, then remove it"""
+        try:
+            if self.exists(key):
+                return False
+            content_type = CONTENT_TYPES.get(os.path.splitext(key)[1], "application/octet-stream")
+            self.client.upload_file(source_path, self.bucket, key, ExtraArgs={"ContentType": content_type})
+            return True
+        finally:
+            os.remove(source_path)
+
+    def delete(self, key: str):
+        self.client.delete_object(Bucket=self.bucket, Key=key)
+
+    def presigned_url(self, key: str, filename: Optional[str] = None,
+                      expires: int = PRESIGNED_URL_SECONDS) -> Optional[str]:
+        params = {"Bucket": self.bucket, "Key": key}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+
+@lru_cache(maxsize=1)
+def get_storage():
+    """The configured storage backend, shared by the process"""
+    backend = os.getenv("PAYROLL_STORAGE_BACKEND", "local")
+    if backend == "s3":
+        return S3Storage()
+    if backend == "local":
+        return LocalStorage()
+    raise ValueError(f"Unknown PAYROLL_STORAGE_BACKEND {backend!r}")
+
+
+def store_file(storage, path: str, suffix: str = ".pdf") -> str:
+    """Store a finished file under its content hash and return the key.
+
+    The source file is consumed; if identical content is already stored the
+    existing object is kept.
+    """
+    key = content_key(file_sha256(path), suffix)
+    storage.put_file(path, key)
+    return key
+
+
+def scratch_dir():
+    """Temporary directory for rendering, on the storage volume when it is local"""
+    root = STORAGE_ROOT if os.path.isdir(STORAGE_ROOT) else None
+    return tempfile.TemporaryDirectory(prefix="render-", dir=root)
+
+
+class RangeNotSatisfiable(ValueError):
+    pass
+
+
+def parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a Range header into an inclusive (start, end) pair.
+
+    Returns None when the whole object should be sent: no header, a unit
+    other than bytes, or several ranges (which a server may ignore). Raises
+    RangeNotSatisfiable when the range lies outside the object.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    start, _, end = header[len("bytes="):].strip().partition("-")
+    try:
+        first = int(start) if start else None
+        last = int(end) if end else None
+    except ValueError:
+        return None
+    if first is None and last is None:
+        return None
+    if size == 0:
+        raise RangeNotSatisfiable(header)
+    if first is None:
+        # Suffix range: the last ``last`` bytes
+        if not last:
+            raise RangeNotSatisfiable(header)
+        return max(0, size - last), size - 1
+    if last is None:
+        last = size - 1
+    if first >= size or last < first:
+        raise RangeNotSatisfiable(header)
+    return first, min(last, size - 1)
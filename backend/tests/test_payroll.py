@@ -1,11 +1,50 @@
+import asyncio
+import io
+import os
+import json
+import subprocess
+import sys
+import zipfile
 import pytest
-from datetime import datetime
-from sqlalchemy import create_engine
+import pytest_asyncio
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+import httpx
+from celery.contrib.testing.worker import start_worker
+from celery.exceptions import Retry
+from kombu import Connection
+from prometheus_client import REGISTRY
+from alembic import command
+from alembic.config import Config
+from sqlalchemy import create_engine, event, exc, insert, select, text
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from models import Base, FamilyOffice, Employee, PayrollRun, PayrollStatus
-from tasks import calculate_net_pay
-from auth import create_access_token, authenticate_user
+import tasks
+import main
+from events import ProgressPublisher
+from database import get_async_db, engine_options, pool_status, InstrumentedQueuePool
+from models import (
+    Base, FamilyOffice, Employee, PayrollRun, PayrollStatus, PayrollLineItem, PayrollPeriodSummary, PayrollRunSummary
+)
+from tasks import calculate_net_pay, render_pay_stubs, process_payroll, StubEmployee
+import pay_stubs
+import storage
+import scheduling
+from scheduling import route_run
+from storage import LocalStorage, S3Storage, parse_byte_range, RangeNotSatisfiable
+from pay_stubs import PayStubDocument, StubTemplate, get_stub_template
+from calculations import calculate_pay_batch, TaxTable, TaxBracket, Deduction, DEFAULT_TAX_TABLE
+import auth
+import batches
+import bundles
+import bulk_io
+import metrics
+import reports
+import responses as responses_module
+from auth import create_access_token, authenticate_user, decode_token, TokenCache, TokenData
 
 
 # Test database setup
@@ -19,6 +58,72 @@ def test_db():
     db.close()
 
 
+class FakeRedis:
+    """Records publish() calls instead of talking to Redis"""
+    
+    def __init__(self):
+        self.published = []
+    
+    def publish(self, channel, message):
+        self.published.append((channel, json.loads(message)))
+
+
+@pytest.fixture
+def payroll_worker(test_db, tmp_path, monkeypatch):
+    """Run process_payroll in-process against the test database"""
+    fake_redis = FakeRedis()
+    monkeypatch.setattr(tasks, "SessionLocal", sessionmaker(bind=test_db.get_bind()))
+    monkeypatch.setattr(storage, "STORAGE_ROOT", str(tmp_path))
+    monkeypatch.setattr(tasks, "get_storage", lambda: LocalStorage(str(tmp_path)))
+    monkeypatch.setattr(tasks, "ProgressPublisher", lambda run_id: ProgressPublisher(run_id, client=fake_redis))
+    monkeypatch.setattr(process_payroll, "update_state", lambda **kwargs: None)
+    return SimpleNamespace(storage=tmp_path, published=fake_redis.published)
+
+
+@pytest_asyncio.fixture
+async def api(monkeypatch):
+    """Async API client backed by an in-memory aiosqlite database"""
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    TestAsyncSession = async_sessionmaker(engine, expire_on_commit=False)
+    
+    async def override_get_async_db():
+        async with TestAsyncSession() as db:
+            yield db
+    
+    queued = []
+    monkeypatch.setattr(main, "enqueue_payroll_run", lambda run_id, route: queued.append(run_id))
+    main.app.dependency_overrides[get_async_db] = override_get_async_db
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        client.db = TestAsyncSession
+        client.queued = queued
+        yield client
+    main.app.dependency_overrides.clear()
+    await engine.dispose()
+
+
+def auth_headers(family_office_id):
+    token = create_access_token({"email": "test@demo.com", "family_office_id": family_office_id})
+    return {"Authorization": f"Bearer {token}"}
+
+
+async def seed_office(api, name, salaries):
+    """Create an office with one employee per salary, returns (office_id, employee_ids)"""
+    async with api.db() as db:
+        office = FamilyOffice(name=name)
+        db.add(office)
+        await db.flush()
+        employees = [
+            Employee(family_office_id=office.id, name=f"{name} Employee {i}", salary=salary)
+            for i, salary in enumerate(salaries, start=1)
+        ]
+        db.add_all(employees)
+        await db.commit()
+        return office.id, [employee.id for employee in employees]
+
+
 def test_calculate_net_pay():
     """Test that net pay is calculated correctly (80% of gross)"""
     assert calculate_net_pay(100000) == 80000.0
@@ -142,4 +247,1570 @@ def test_employee_salary_validation(test_db):
     assert len(stored_employees) == 3
     assert float(stored_employees[0].salary) == 30000.0
     assert float(stored_employees[1].salary) == 75000.50
-    assert float(stored_employees[2].salary) == 150000.0
\ No newline at end of file
+    assert float(stored_employees[2].salary) == 150000.0
+
+def test_render_pay_stubs_keeps_order(tmp_path):
+    """Test that chunked rendering stores every stub and returns the keys in input order"""
+    pay = calculate_pay_batch([Decimal("50000")]).line(0)
+    jobs = [(StubEmployee(i, f"Employee {i}", Decimal(50000 + i)), pay) for i in range(1, 8)]
+    local = LocalStorage(str(tmp_path))
+    progress = []
+    keys = render_pay_stubs(
+        jobs, local, chunk_size=3, subtasks=False, on_progress=lambda done, total: progress.append((done, total))
+    )
+    
+    assert len(set(keys)) == 7
+    assert keys == render_pay_stubs(jobs[::-1], local, chunk_size=3, subtasks=False)[::-1]
+    assert all(open(local.local_path(key), "rb").read(5) == b"%PDF-" for key in keys)
+    assert progress == [(3, 7), (6, 7), (7, 7)]
+
+
+def test_render_benchmark_jobs_render(tmp_path, monkeypatch):
+    """Smoke test that the render benchmark's subtask messages render"""
+    from benchmarks.bench_render import chunk_messages, make_jobs
+    
+    monkeypatch.setattr(tasks, "get_storage", lambda: LocalStorage(str(tmp_path)))
+    keys = [key for message in chunk_messages(make_jobs(3), 2) for key in tasks.render_stub_chunk.run(*message)]
+    
+    assert len(keys) == 3
+    assert all(open(LocalStorage(str(tmp_path)).local_path(key), "rb").read(5) == b"%PDF-" for key in keys)
+
+
+def test_run_renders_stub_chunks_as_subtasks_in_a_worker(tmp_path, monkeypatch):
+    """Test that a run processed by a Celery worker fans its stubs out to render subtasks"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'worker.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    with Session() as db:
+        office = FamilyOffice(name="Test Office")
+        db.add(office)
+        db.flush()
+        db.add_all([Employee(family_office_id=office.id, name=f"Employee {i}", salary=40000 + i) for i in range(5)])
+        payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+        db.add(payroll_run)
+        db.commit()
+        run_id = payroll_run.id
+    local = LocalStorage(str(tmp_path / "storage"))
+    monkeypatch.setattr(tasks, "SessionLocal", Session)
+    monkeypatch.setattr(tasks, "get_storage", lambda: local)
+    monkeypatch.setattr(tasks, "ProgressPublisher", lambda run_id: ProgressPublisher(run_id, client=FakeRedis()))
+    monkeypatch.setattr(tasks, "WRITE_INDIVIDUAL_STUBS", True)
+    monkeypatch.setattr(tasks, "RENDER_CHUNK_SIZE", 2)
+    rendered = []
+    render_chunk = tasks._render_stub_chunk
+    monkeypatch.setattr(
+        tasks, "_render_stub_chunk", lambda *args: rendered.append(len(args[1])) or render_chunk(*args)
+    )
+    for key, value in {"broker_url": "memory://", "result_backend": "cache+memory://"}.items():
+        monkeypatch.setitem(tasks.celery_app.conf, key, value)
+    # Backends are created from the configuration on first use
+    monkeypatch.setattr(tasks.celery_app, "_backend_cache", None)
+    monkeypatch.delattr(tasks.celery_app._local, "backend", raising=False)
+    
+    # The run's thread waits on its chunks while another renders them
+    with start_worker(tasks.celery_app, pool="threads", concurrency=2, perform_ping_check=False):
+        result = process_payroll.apply_async((run_id,)).get(timeout=60)
+    
+    assert result["status"] == "completed"
+    assert rendered == [2, 2, 1]
+    with Session() as db:
+        items = db.query(PayrollLineItem).filter_by(payroll_run_id=run_id).order_by(PayrollLineItem.employee_id).all()
+    assert len(items) == 5 and all(local.exists(item.stub_key) for item in items)
+
+
+def test_process_payroll_completes_run(test_db, payroll_worker):
+    """Test that a payroll run renders every stub and is marked completed"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob Ray", salary=40000),
+    ])
+    payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+    test_db.add(payroll_run)
+    test_db.commit()
+    
+    result = process_payroll.run(payroll_run.id)
+    
+    test_db.refresh(payroll_run)
+    assert result["employees_processed"] == 2
+    assert payroll_run.status == PayrollStatus.COMPLETED
+    assert payroll_run.completed_at is not None
+    # Only the combined document is stored unless individual stubs are enabled
+    pdf_path = LocalStorage(str(payroll_worker.storage)).local_path(payroll_run.pdf_key)
+    assert payroll_run.pdf_key.startswith("sha256/")
+    assert [path for path in payroll_worker.storage.rglob("*") if path.is_file()] == [payroll_worker.storage / pdf_path]
+    assert b"/Count 2 >>" in open(pdf_path, "rb").read()
+    
+    # Status changes and progress were published to the run's channel
+    events = [event for channel, event in payroll_worker.published]
+    assert {channel for channel, event in payroll_worker.published} == {f"payroll_run:{payroll_run.id}:events"}
+    assert events[0]["status"] == "processing" and events[0]["queue_wait_seconds"] >= 0
+    assert events[-2]["progress"] == 100
+    assert events[-1]["status"] == "completed"
+
+
+def test_process_payroll_persists_requested_line_items(test_db, payroll_worker):
+    """Test that only the requested employees are processed and stored"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    employees = [
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob Ray", salary=40000.50),
+        Employee(family_office_id=office.id, name="Cy Doe", salary=30000),
+    ]
+    test_db.add_all(employees)
+    test_db.commit()
+    payroll_run = PayrollRun(
+        family_office_id=office.id,
+        status=PayrollStatus.PENDING,
+        employee_ids=[employees[1].id, employees[2].id]
+    )
+    test_db.add(payroll_run)
+    test_db.commit()
+    
+    result = process_payroll.run(payroll_run.id)
+    
+    line_items = test_db.query(PayrollLineItem).filter(
+        PayrollLineItem.payroll_run_id == payroll_run.id
+    ).order_by(PayrollLineItem.employee_id).all()
+    assert result["employees_processed"] == 2
+    assert [item.employee_name for item in line_items] == ["Bob Ray", "Cy Doe"]
+    assert line_items[0].gross_pay == Decimal("40000.50")
+    assert line_items[0].net_pay == Decimal("32000.40")
+    assert line_items[0].tax == Decimal("8000.10")
+
+
+def test_pay_stub_document_streams_pages(tmp_path):
+    """Test that the combined document holds one page per stub with a valid xref"""
+    pdf_path = tmp_path / "combined.pdf"
+    pay = calculate_pay_batch([Decimal("1000.00")]).line(0)
+    with PayStubDocument(str(pdf_path)) as document:
+        for i in range(1, 4):
+            document.add_stub(StubEmployee(i, f"Employee ({i})", Decimal("1000.00")), pay)
+    
+    data = pdf_path.read_bytes()
+    assert document.page_count == 3
+    assert data.startswith(b"%PDF-1.4")
+    assert data.rstrip().endswith(b"%%EOF")
+    assert b"/Count 3 >>" in data
+    
+    # The startxref offset must point at the cross-reference table
+    xref_offset = int(data.rsplit(b"startxref", 1)[1].split()[0])
+    assert data[xref_offset:xref_offset + 4] == b"xref"
+
+
+def test_stub_templates_per_office(tmp_path, monkeypatch):
+    """Test that offices get their own template and its static layer is written once"""
+    templates_path = tmp_path / "templates.json"
+    templates_path.write_text(json.dumps({
+        "1": {"version": "acme-v1", "subtitle": "Acme Family Office", "footer": "Acme payroll"},
+    }))
+    monkeypatch.setenv("PAYROLL_STUB_TEMPLATES", str(templates_path))
+    pay_stubs._configured_templates.cache_clear()
+    try:
+        template = get_stub_template(1)
+        assert template.version == "acme-v1"
+        assert get_stub_template(2) == StubTemplate()
+    finally:
+        pay_stubs._configured_templates.cache_clear()
+    
+    pdf_path = tmp_path / "combined.pdf"
+    pay = calculate_pay_batch([Decimal("1000.00")]).line(0)
+    with PayStubDocument(str(pdf_path), template, period="March 2024", cache_static_layer=True) as document:
+        for i in range(1, 4):
+            document.add_stub(StubEmployee(i, f"Employee {i}", Decimal("1000.00")), pay)
+    
+    data = pdf_path.read_bytes()
+    assert data.count(b"/Subtype /Form") == 1
+    assert data.count(b"/StubStatic 5 0 R") == 3
+
+
+def test_calculate_pay_batch_matches_scalar():
+    """Test that the default batch calculation agrees with calculate_net_pay"""
+    salaries = [Decimal("100000"), Decimal("50000"), Decimal("75000.50"), Decimal("0")]
+    batch = calculate_pay_batch(salaries, DEFAULT_TAX_TABLE)
+    
+    assert [line.net_pay for line in batch.lines()] == [
+        Decimal(str(calculate_net_pay(s))).quantize(Decimal("0.01")) for s in salaries
+    ]
+    assert batch.line(2).tax == Decimal("15000.10")
+
+
+def test_calculate_pay_batch_brackets_and_deductions():
+    """Test progressive brackets and deductions with exact-cent rounding"""
+    table = TaxTable(
+        version="test-v1",
+        tax_label="Income Tax",
+        brackets=[
+            TaxBracket(threshold=Decimal("0"), rate=Decimal("0.10")),
+            TaxBracket(threshold=Decimal("10000"), rate=Decimal("0.25")),
+        ],
+        deductions=[Deduction(name="Pension", rate=Decimal("0.035"))],
+    )
+    batch = calculate_pay_batch([Decimal("5000.05"), Decimal("20000.10")], table)
+    
+    low, high = batch.lines()
+    # 10% of 5000.05 = 500.005, rounded half up
+    assert low.tax == Decimal("500.01")
+    # 10% of 10000 + 25% of 10000.10 = 3500.025, rounded half up
+    assert high.tax == Decimal("3500.03")
+    assert high.deductions == (("Pension", Decimal("700.00")),)
+    assert high.net_pay == Decimal("20000.10") - Decimal("3500.03") - Decimal("700.00")
+
+
+@pytest.mark.asyncio
+async def test_api_payroll_flow_is_tenant_scoped(api):
+    """Test the async endpoints end to end, including tenant isolation"""
+    smith_id, smith_employees = await seed_office(api, "Smith", [75000, 65000])
+    jones_id, jones_employees = await seed_office(api, "Jones", [60000])
+    
+    response = await api.get("/employees", headers=auth_headers(smith_id))
+    assert response.status_code == 200
+    assert [e["id"] for e in response.json()] == smith_employees
+    
+    # Another office's employees are rejected
+    response = await api.post(
+        "/payroll/run", json={"employee_ids": jones_employees}, headers=auth_headers(smith_id)
+    )
+    assert response.status_code == 400
+    
+    response = await api.post(
+        "/payroll/run", json={"employee_ids": smith_employees}, headers=auth_headers(smith_id)
+    )
+    assert response.status_code == 200
+    run_id = response.json()["id"]
+    assert response.json()["status"] == "pending"
+    assert api.queued == [run_id]
+    
+    response = await api.get(f"/payroll/{run_id}", headers=auth_headers(smith_id))
+    assert response.status_code == 200
+    response = await api.get(f"/payroll/{run_id}", headers=auth_headers(jones_id))
+    assert response.status_code == 404
+    response = await api.get(f"/payroll/{run_id}/pdf", headers=auth_headers(smith_id))
+    assert response.status_code == 404
+
+
+def test_engine_options_from_environment(monkeypatch):
+    """Test that pool and timeout settings are read from the environment"""
+    monkeypatch.setenv("DB_POOL_SIZE", "20")
+    monkeypatch.setenv("DB_STATEMENT_TIMEOUT_MS", "5000")
+    options = engine_options("postgresql://user:pass@db/payroll")
+    assert options["poolclass"] is InstrumentedQueuePool
+    assert options["pool_size"] == 20
+    assert options["pool_pre_ping"] is True
+    assert options["connect_args"] == {"options": "-c statement_timeout=5000"}
+    
+    # PgBouncer mode: no client-side pool and no prepared statement cache
+    monkeypatch.setenv("DB_DISABLE_POOL", "true")
+    options = engine_options("postgresql+asyncpg://user:pass@db/payroll")
+    assert options["poolclass"].__name__ == "NullPool"
+    assert options["connect_args"]["statement_cache_size"] == 0
+    assert options["connect_args"]["server_settings"] == {"statement_timeout": "5000"}
+    
+    assert engine_options("sqlite:///:memory:") == {}
+
+
+def test_pool_checkout_waits_are_counted(tmp_path):
+    """Test that checkouts on an exhausted pool are recorded as waits"""
+    engine = create_engine(
+        f"sqlite:///{tmp_path / 'pool.db'}",
+        poolclass=InstrumentedQueuePool, pool_size=1, max_overflow=0, pool_timeout=0.05
+    )
+    waits_before = metric_value("db_pool_checkout_waits_total", pool="sync")
+    checkouts_before = metric_value("db_pool_checkout_duration_seconds_count", pool="sync")
+    held = engine.connect()
+    assert metric_value("db_pool_checked_out_connections", pool="sync") == 1
+    with pytest.raises(exc.TimeoutError):
+        engine.connect()
+    held.close()
+    
+    status = pool_status(engine)
+    assert status["checkouts"] == 2
+    assert status["waits"] == 1
+    assert status["max_checkout_ms"] >= 50
+    # Published for the workers' exporter too
+    assert metric_value("db_pool_checkout_waits_total", pool="sync") == waits_before + 1
+    assert metric_value("db_pool_checkout_duration_seconds_count", pool="sync") == checkouts_before + 2
+    assert metric_value("db_pool_checked_out_connections", pool="sync") == 0
+    engine.dispose()
+
+
+@pytest.mark.asyncio
+async def test_db_health_reports_both_pools(api):
+    """Test that /health/db covers the async pool and the sync pool imports use"""
+    response = await api.get("/health/db")
+    assert response.status_code == 200
+    assert set(response.json()) == {"async", "sync"}
+    assert response.json()["sync"]["pool"] == type(main.engine.pool).__name__
+
+
+PLAN_TEST_EMPLOYEES = int(os.getenv("PAYROLL_PLAN_TEST_EMPLOYEES", "1000000"))
+
+
+@pytest.fixture(scope="module")
+def migrated_large_db(tmp_path_factory):
+    """Alembic-migrated SQLite database seeded with PLAN_TEST_EMPLOYEES employees"""
+    url = f"sqlite:///{tmp_path_factory.mktemp('plan') / 'payroll.db'}"
+    config = Config(os.path.join(os.path.dirname(__file__), "..", "alembic.ini"))
+    config.set_main_option("script_location", os.path.join(os.path.dirname(__file__), "..", "migrations"))
+    config.set_main_option("sqlalchemy.url", url)
+    command.upgrade(config, "head")
+    
+    engine = create_engine(url)
+    offices = 100
+    with engine.begin() as conn:
+        # Raw DB-API executemany streams the generated rows without materializing them
+        cursor = conn.connection.cursor()
+        cursor.executemany(
+            "INSERT INTO family_offices (id, name) VALUES (?, ?)",
+            ((i, f"Office {i}") for i in range(1, offices + 1))
+        )
+        cursor.executemany(
+            "INSERT INTO employees (family_office_id, name, salary) VALUES (?, ?, ?)",
+            ((i % offices + 1, f"Employee {i}", 50000) for i in range(PLAN_TEST_EMPLOYEES))
+        )
+        cursor.executemany(
+            "INSERT INTO payroll_runs (family_office_id, status) VALUES (?, ?)",
+            ((i % offices + 1, "COMPLETED") for i in range(10000))
+        )
+        cursor.execute("ANALYZE")
+    yield engine
+    engine.dispose()
+
+
+def query_plan(engine, statement):
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as conn:
+        rows = conn.execute(text(f"EXPLAIN QUERY PLAN {compiled}")).all()
+    return " | ".join(row[-1] for row in rows)
+
+
+def test_tenant_queries_use_composite_indexes(migrated_large_db):
+    """Test that the hot tenant-scoped queries are served by the composite indexes"""
+    plan = query_plan(migrated_large_db, select(Employee).where(
+        Employee.family_office_id == 7
+    ).order_by(Employee.id))
+    assert "USING INDEX ix_employees_family_office_id_id" in plan
+    assert "TEMP B-TREE" not in plan
+    
+    plan = query_plan(migrated_large_db, select(PayrollRun).where(
+        PayrollRun.family_office_id == 7,
+        PayrollRun.status == PayrollStatus.COMPLETED
+    ).order_by(PayrollRun.id.desc()))
+    assert "USING INDEX ix_payroll_runs_family_office_id_status_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+@pytest.mark.asyncio
+async def test_employees_keyset_pages_and_streams(api):
+    """Test cursor pagination, column selection and the streaming modes"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000.5, 70000, 80000, 90000])
+    headers = auth_headers(office_id)
+    
+    response = await api.get("/employees", params={"limit": 2, "fields": "name"}, headers=headers)
+    assert response.json() == [{"name": "Smith Employee 1"}, {"name": "Smith Employee 2"}]
+    cursor = response.headers["X-Next-Cursor"]
+    assert cursor == str(employee_ids[1])
+    
+    seen = []
+    while cursor:
+        response = await api.get("/employees", params={"limit": 2, "after_id": cursor}, headers=headers)
+        seen += [row["id"] for row in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+    assert seen == employee_ids[2:]
+    
+    response = await api.get("/employees", params={"format": "ndjson", "fields": "id,salary"}, headers=headers)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert lines[1] == {"id": employee_ids[1], "salary": 60000.5}
+    assert len(lines) == 5
+    
+    response = await api.get(
+        "/employees", params={"stream": "true", "after_id": employee_ids[2]}, headers=headers
+    )
+    assert [row["id"] for row in response.json()] == employee_ids[3:]
+    
+    response = await api.get("/employees", params={"fields": "ssn"}, headers=headers)
+    assert response.status_code == 400
+    
+    # The documented items may have any subset of the fields
+    schema = (await api.get("/openapi.json")).json()
+    item_ref = schema["paths"]["/employees"]["get"]["responses"]["200"]["content"]["application/json"]["schema"]
+    item = schema["components"]["schemas"][item_ref["items"]["$ref"].rsplit("/", 1)[1]]
+    assert set(item["properties"]) == {"id", "name", "salary"}
+    assert not item.get("required")
+
+
+def test_progress_publisher_throttles_events():
+    """Test that progress is published per step/interval, not per employee"""
+    fake_redis = FakeRedis()
+    now = [0.0]
+    publisher = ProgressPublisher(1, client=fake_redis, min_interval=1.0, min_step=10, clock=lambda: now[0])
+    
+    sent = []
+    for done in range(1, 1001):
+        now[0] += 0.01
+        if publisher.progress(done, 1000):
+            sent.append(done)
+    
+    # 10 seconds of work with a 1s interval: about one event per second, and the final 100%
+    assert len(sent) <= 12
+    assert sent[-1] == 1000
+    assert fake_redis.published[-1][1]["progress"] == 100
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = list(messages)
+        self.channels = []
+        self.closed = False
+    
+    async def subscribe(self, channel):
+        self.channels.append(channel)
+    
+    async def get_message(self, ignore_subscribe_messages=False, timeout=None):
+        return {"data": json.dumps(self.messages.pop(0))} if self.messages else None
+    
+    async def unsubscribe(self):
+        pass
+    
+    async def aclose(self):
+        self.closed = True
+
+
+@pytest.mark.asyncio
+async def test_payroll_events_stream_until_completed(api, monkeypatch):
+    """Test that the SSE endpoint relays channel events and ends on completion"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000])
+    response = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=auth_headers(office_id))
+    run_id = response.json()["id"]
+    
+    pubsub = FakePubSub([
+        {"status": "processing", "current": 1, "total": 1, "progress": 100},
+        {"status": "completed", "completed_at": "2026-10-18T12:00:00"},
+    ])
+    monkeypatch.setattr(main, "get_async_redis", lambda: type("R", (), {"pubsub": lambda self: pubsub})())
+    
+    # EventSource clients authenticate with the access_token query parameter
+    token = auth_headers(office_id)["Authorization"].split()[1]
+    response = await api.get(f"/payroll/{run_id}/events", params={"access_token": token})
+    
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [event["status"] for event in events] == ["pending", "processing", "completed"]
+    assert pubsub.channels == [f"payroll_run:{run_id}:events"]
+    assert pubsub.closed
+    
+    response = await api.get(f"/payroll/{run_id}/events", headers=auth_headers(office_id + 1))
+    assert response.status_code == 404
+
+
+def test_token_cache_skips_repeat_verification(monkeypatch):
+    """Test that a cached token is not decoded again and revocation still applies"""
+    monkeypatch.setattr(auth, "token_cache", TokenCache(maxsize=10, ttl=300))
+    decodes = []
+    real_decode = auth.jwt.decode
+    monkeypatch.setattr(auth.jwt, "decode", lambda *args, **kwargs: decodes.append(1) or real_decode(*args, **kwargs))
+    token = create_access_token({"email": "cache@demo.com", "family_office_id": 1})
+    
+    assert decode_token(token) == decode_token(token) == TokenData(email="cache@demo.com", family_office_id=1)
+    assert len(decodes) == 1
+    assert auth.token_cache.hits == 1
+    
+    # Custom revocation hooks run on cache hits too
+    monkeypatch.setattr(auth, "revocation_checks", [lambda digest, data: data.email == "cache@demo.com"])
+    with pytest.raises(auth.HTTPException):
+        decode_token(token)
+
+
+def test_token_cache_respects_exp_and_size():
+    """Test that entries expire with the token and the cache stays bounded"""
+    now = [1000.0]
+    cache = TokenCache(maxsize=2, ttl=300, clock=lambda: now[0])
+    data = TokenData(email="a@demo.com", family_office_id=1)
+    
+    cache.put("short", data, exp=1010)
+    assert cache.get("short") == data
+    now[0] = 1010
+    assert cache.get("short") is None
+    
+    cache.put("a", data, exp=None)
+    cache.put("b", data, exp=None)
+    cache.get("a")
+    cache.put("c", data, exp=None)
+    # "b" was least recently used
+    assert cache.get("b") is None
+    assert cache.get("a") == data and cache.get("c") == data
+
+
+def test_individual_stubs_are_deduplicated_by_content(test_db, payroll_worker, monkeypatch):
+    """Test that identical stubs from repeated runs are stored once"""
+    monkeypatch.setattr(tasks, "WRITE_INDIVIDUAL_STUBS", True)
+    monkeypatch.setattr(tasks, "stub_period", lambda template: "March 2024")
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob Ray", salary=40000),
+    ])
+    runs = [PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING) for _ in range(2)]
+    test_db.add_all(runs)
+    test_db.commit()
+    
+    for run in runs:
+        process_payroll.run(run.id)
+        test_db.refresh(run)
+    
+    stub_keys = [
+        [item.stub_key for item in test_db.query(PayrollLineItem).filter_by(payroll_run_id=run.id)]
+        for run in runs
+    ]
+    assert runs[0].pdf_key == runs[1].pdf_key
+    assert stub_keys[0] == stub_keys[1] and len(set(stub_keys[0])) == 2
+    # One combined document and two individual stubs, however many runs
+    assert len([path for path in payroll_worker.storage.rglob("*.pdf")]) == 3
+
+
+def test_parse_byte_range():
+    """Test single, open-ended, suffix and unsatisfiable byte ranges"""
+    assert parse_byte_range(None, 100) is None
+    assert parse_byte_range("bytes=0-9", 100) == (0, 9)
+    assert parse_byte_range("bytes=90-", 100) == (90, 99)
+    assert parse_byte_range("bytes=-10", 100) == (90, 99)
+    assert parse_byte_range("bytes=95-200", 100) == (95, 99)
+    assert parse_byte_range("bytes=0-1,5-6", 100) is None
+    with pytest.raises(RangeNotSatisfiable):
+        parse_byte_range("bytes=100-", 100)
+
+
+@pytest.mark.asyncio
+async def test_pdf_download_etag_range_and_redirect(api, tmp_path, monkeypatch):
+    """Test conditional and ranged local downloads and pre-signed redirects"""
+    office_id, _ = await seed_office(api, "Smith", [])
+    local = LocalStorage(str(tmp_path))
+    source = tmp_path / "upload.pdf"
+    source.write_bytes(b"%PDF-" + bytes(range(256)) * 4)
+    key = storage.store_file(local, str(source))
+    async with api.db() as db:
+        run = PayrollRun(family_office_id=office_id, status=PayrollStatus.COMPLETED, pdf_key=key)
+        db.add(run)
+        await db.commit()
+        run_id = run.id
+    monkeypatch.setattr(main, "get_storage", lambda: local)
+    url = f"/payroll/{run_id}/pdf"
+    
+    response = await api.get(url, headers=auth_headers(office_id))
+    assert response.status_code == 200
+    assert response.content == open(local.local_path(key), "rb").read()
+    tag = response.headers["etag"]
+    assert tag == storage.etag(key)
+    
+    response = await api.get(url, headers={**auth_headers(office_id), "If-None-Match": tag})
+    assert response.status_code == 304
+    
+    response = await api.get(url, headers={**auth_headers(office_id), "Range": "bytes=0-4"})
+    assert response.status_code == 206
+    assert response.content == b"%PDF-"
+    assert response.headers["content-range"] == "bytes 0-4/1029"
+    
+    response = await api.get(url, headers={**auth_headers(office_id), "Range": "bytes=5000-"})
+    assert response.status_code == 416
+    
+    class FakeS3:
+        def generate_presigned_url(self, operation, Params, ExpiresIn):
+            return f"https://s3.test/{Params['Bucket']}/{Params['Key']}?expires={ExpiresIn}"
+    
+    monkeypatch.setattr(main, "get_storage", lambda: S3Storage("payroll", client=FakeS3()))
+    response = await api.get(url, params={"access_token": auth_headers(office_id)["Authorization"][7:]})
+    assert response.status_code == 307
+    assert response.headers["location"].startswith(f"https://s3.test/payroll/{key}?")
+
+
+def test_incremental_run_reuses_unchanged_employees(test_db, payroll_worker, monkeypatch):
+    """Test that an incremental run only rebuilds employees whose inputs changed"""
+    monkeypatch.setattr(tasks, "WRITE_INDIVIDUAL_STUBS", True)
+    monkeypatch.setattr(tasks, "stub_period", lambda template: "March 2024")
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    ann = Employee(family_office_id=office.id, name="Ann Lee", salary=60000)
+    bob = Employee(family_office_id=office.id, name="Bob Ray", salary=40000)
+    test_db.add_all([ann, bob])
+    test_db.commit()
+    
+    def run(incremental):
+        payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, incremental=incremental)
+        test_db.add(payroll_run)
+        test_db.commit()
+        process_payroll.run(payroll_run.id)
+        test_db.refresh(payroll_run)
+        items = test_db.query(PayrollLineItem).filter_by(payroll_run_id=payroll_run.id)
+        return payroll_run, {item.employee_id: item for item in items}
+    
+    first, first_items = run(incremental=False)
+    assert (first.reused_count, first.rebuilt_count) == (0, 2)
+    
+    # Nothing changed: every result and the combined PDF are reused
+    unchanged, unchanged_items = run(incremental=True)
+    assert (unchanged.reused_count, unchanged.rebuilt_count) == (2, 0)
+    assert unchanged.pdf_key == first.pdf_key
+    assert unchanged_items[ann.id].net_pay == first_items[ann.id].net_pay
+    
+    bob.salary = 50000
+    test_db.commit()
+    changed, changed_items = run(incremental=True)
+    assert (changed.reused_count, changed.rebuilt_count) == (1, 1)
+    assert changed.pdf_key != first.pdf_key
+    assert changed_items[ann.id].stub_key == first_items[ann.id].stub_key
+    assert changed_items[bob.id].stub_key != first_items[bob.id].stub_key
+    assert changed_items[bob.id].net_pay == Decimal("40000.00")
+
+
+@pytest.mark.asyncio
+async def test_payroll_submission_is_idempotent(api, monkeypatch):
+    """Test Idempotency-Key replays and coalescing of identical active runs"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000])
+    headers = {**auth_headers(office_id), "Idempotency-Key": "run-1"}
+    
+    first = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)
+    retry = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)
+    assert retry.json()["id"] == first.json()["id"]
+    assert retry.headers["idempotent-replayed"] == "true"
+    
+    # The same employees in another order, without a key, while still pending
+    duplicate = await api.post(
+        "/payroll/run", json={"employee_ids": employee_ids[::-1]}, headers=auth_headers(office_id)
+    )
+    assert duplicate.json()["id"] == first.json()["id"]
+    assert api.queued == [first.json()["id"]]
+    
+    response = await api.post("/payroll/run", json={"employee_ids": employee_ids[:1]}, headers=headers)
+    assert response.status_code == 422
+    
+    # A concurrent insert that wins the race is returned instead of an error
+    find_existing_run = main.find_existing_run
+    calls = []
+    
+    async def lose_race(*args):
+        calls.append(args)
+        return None if len(calls) == 1 else await find_existing_run(*args)
+    
+    monkeypatch.setattr(main, "find_existing_run", lose_race)
+    raced = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=auth_headers(office_id))
+    assert raced.json()["id"] == first.json()["id"]
+    assert len(calls) == 2
+    
+    # Once the run has finished an identical request starts a new run
+    async with api.db() as db:
+        run = await db.get(PayrollRun, first.json()["id"])
+        run.status, run.active_fingerprint = PayrollStatus.COMPLETED, None
+        await db.commit()
+    response = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=auth_headers(office_id))
+    assert response.json()["id"] != first.json()["id"]
+    assert len(api.queued) == 2
+
+
+@pytest.mark.asyncio
+async def test_retry_requeues_a_failed_run_once(api):
+    """Test that a retried run is queued once and coalesces identical requests again"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000])
+    headers = auth_headers(office_id)
+    first = (await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)).json()
+    
+    async def fail(run_id):
+        async with api.db() as db:
+            run = await db.get(PayrollRun, run_id)
+            run.status, run.active_fingerprint = PayrollStatus.FAILED, None
+            await db.commit()
+    
+    await fail(first["id"])
+    retries = await asyncio.gather(*(api.post(f"/payroll/{first['id']}/retry", headers=headers) for _ in range(2)))
+    assert sorted(retry.status_code for retry in retries) == [200, 409]
+    assert api.queued == [first["id"], first["id"]]
+    
+    # The pending run is active again, so an identical request returns it
+    duplicate = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)
+    assert duplicate.json()["id"] == first["id"]
+    assert (await api.post(f"/payroll/{first['id']}/retry", headers=headers)).status_code == 409
+    
+    # An identical run submitted after the failure is returned rather than queueing both
+    await fail(first["id"])
+    second = (await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)).json()
+    assert second["id"] != first["id"]
+    retry = await api.post(f"/payroll/{first['id']}/retry", headers=headers)
+    assert retry.status_code == 200
+    assert retry.json()["id"] == second["id"]
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert api.queued == [first["id"], first["id"], second["id"]]
+    async with api.db() as db:
+        assert (await db.get(PayrollRun, first["id"])).status == PayrollStatus.FAILED
+    
+    response = await api.post(f"/payroll/{first['id']}/retry", headers=auth_headers(office_id + 1))
+    assert response.status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_payroll_run_accepts_more_ids_than_bind_parameters(api, test_db):
+    """Test that a run over more employees than the drivers' bind parameter limit is validated and loaded"""
+    employee_count = 33000
+    async with api.db() as db:
+        office, other = FamilyOffice(name="Large"), FamilyOffice(name="Other")
+        db.add_all([office, other])
+        await db.flush()
+        await db.execute(insert(Employee), [
+            {"family_office_id": office.id, "name": f"Employee {i}", "salary": 50000} for i in range(employee_count)
+        ])
+        outsider = Employee(family_office_id=other.id, name="Outsider", salary=50000)
+        db.add(outsider)
+        await db.commit()
+        employee_ids = list(await db.scalars(
+            select(Employee.id).where(Employee.family_office_id == office.id).order_by(Employee.id)
+        ))
+        office_id, outsider_id = office.id, outsider.id
+        bind = db.bind.sync_engine
+    # SQLite builds differ in their limit, so count the ID check's parameters instead
+    parameter_counts = []
+    
+    def count_parameters(conn, cursor, statement, parameters, context, executemany):
+        if "FROM employees" in statement:
+            parameter_counts.append(len(parameters))
+    
+    event.listen(bind, "before_cursor_execute", count_parameters)
+    try:
+        response = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=auth_headers(office_id))
+    finally:
+        event.remove(bind, "before_cursor_execute", count_parameters)
+    assert response.status_code == 200
+    assert api.queued == [response.json()["id"]]
+    assert parameter_counts == [2]
+    response = await api.post(
+        "/payroll/run", json={"employee_ids": employee_ids + [outsider_id]}, headers=auth_headers(office_id)
+    )
+    assert response.status_code == 400
+    
+    # The worker selects the requested employees with one parameter too
+    office = FamilyOffice(name="Large")
+    test_db.add(office)
+    test_db.flush()
+    test_db.execute(insert(Employee), [
+        {"family_office_id": office.id, "name": f"Employee {i}", "salary": 50000} for i in range(employee_count)
+    ])
+    worker_ids = list(test_db.scalars(select(Employee.id).where(Employee.family_office_id == office.id)))
+    payroll_run = PayrollRun(family_office_id=office.id, employee_ids=worker_ids[1:])
+    parameter_counts.clear()
+    event.listen(test_db.get_bind(), "before_cursor_execute", count_parameters)
+    assert tasks.count_run_employees(test_db, payroll_run) == employee_count - 1
+    assert parameter_counts == [2]
+
+
+def test_runs_are_routed_by_size_and_priority():
+    """Test queue routing through an in-memory broker"""
+    with Connection("memory://") as connection:
+        tasks.enqueue_payroll_run(1, route_run(10), connection=connection)
+        tasks.enqueue_payroll_run(2, route_run(scheduling.LARGE_RUN_THRESHOLD), connection=connection)
+        tasks.enqueue_payroll_run(3, route_run(scheduling.LARGE_RUN_THRESHOLD, "high"), connection=connection)
+        
+        routed = {}
+        for queue in scheduling.PAYROLL_QUEUES:
+            with connection.SimpleQueue(queue) as simple_queue:
+                message = simple_queue.get(timeout=1)
+                message.ack()
+                routed[queue] = (message.headers["argsrepr"], message.properties["priority"])
+    
+    assert routed == {
+        "payroll.small": ("(1,)", 5),
+        "payroll.large": ("(2,)", 0),
+        "payroll.priority": ("(3,)", 9),
+    }
+
+
+def test_tenant_concurrency_limit_defers_runs(test_db, payroll_worker, monkeypatch):
+    """Test that an office at its limit has new runs handed back to the queue"""
+    monkeypatch.setattr(scheduling, "TENANT_CONCURRENCY", 1)
+    busy = FamilyOffice(name="Busy Office")
+    weighted = FamilyOffice(name="Weighted Office", scheduling_weight=2)
+    test_db.add_all([busy, weighted])
+    test_db.commit()
+    runs = {}
+    for office in (busy, weighted):
+        test_db.add(Employee(family_office_id=office.id, name="Ann Lee", salary=60000))
+        test_db.add(PayrollRun(family_office_id=office.id, status=PayrollStatus.PROCESSING))
+        runs[office.name] = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+        test_db.add(runs[office.name])
+    test_db.commit()
+    
+    with pytest.raises(Retry):
+        process_payroll.run(runs["Busy Office"].id)
+    test_db.refresh(runs["Busy Office"])
+    assert runs["Busy Office"].status == PayrollStatus.PENDING
+    
+    # A weight of 2 allows a second concurrent run
+    process_payroll.run(runs["Weighted Office"].id)
+    test_db.refresh(runs["Weighted Office"])
+    assert runs["Weighted Office"].status == PayrollStatus.COMPLETED
+    assert runs["Weighted Office"].started_at >= runs["Weighted Office"].created_at
+
+
+@pytest.mark.asyncio
+async def test_payroll_queue_stats(api):
+    """Test per-office queue counts and wait times"""
+    office_id, _ = await seed_office(api, "Smith", [])
+    now = datetime.utcnow()
+    async with api.db() as db:
+        db.add_all([
+            PayrollRun(family_office_id=office_id, status=PayrollStatus.PENDING, queue="payroll.small"),
+            PayrollRun(family_office_id=office_id, status=PayrollStatus.COMPLETED, queue="payroll.small",
+                       created_at=now - timedelta(seconds=30), started_at=now - timedelta(seconds=20)),
+            PayrollRun(family_office_id=office_id, status=PayrollStatus.PROCESSING, queue="payroll.large",
+                       created_at=now - timedelta(seconds=90), started_at=now - timedelta(seconds=30)),
+        ])
+        await db.commit()
+    
+    response = await api.get("/payroll/queue-stats", headers=auth_headers(office_id))
+    assert response.status_code == 200
+    stats = response.json()
+    assert (stats["pending"], stats["processing"]) == (1, 1)
+    assert stats["queue_wait_seconds"]["payroll.small"] == {"count": 1, "avg": 10.0, "p95": 10.0, "max": 10.0}
+    assert stats["queue_wait_seconds"]["payroll.large"]["max"] == 60.0
+
+
+def test_failed_run_resumes_from_checkpoint(test_db, payroll_worker, monkeypatch):
+    """Test that a retried run only processes employees without a checkpoint"""
+    monkeypatch.setattr(tasks, "CHECKPOINT_SIZE", 1)
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob Ray", salary=40000),
+    ])
+    payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+    test_db.add(payroll_run)
+    test_db.commit()
+    
+    line_item_values = tasks.line_item_values
+    
+    def crash_on_bob(payroll_run_id, employee, *args):
+        if employee.name == "Bob Ray":
+            raise RuntimeError("worker crashed")
+        return line_item_values(payroll_run_id, employee, *args)
+    
+    monkeypatch.setattr(tasks, "line_item_values", crash_on_bob)
+    with pytest.raises(RuntimeError):
+        process_payroll.run(payroll_run.id)
+    test_db.refresh(payroll_run)
+    assert payroll_run.status == PayrollStatus.FAILED
+    assert test_db.query(PayrollLineItem).filter_by(payroll_run_id=payroll_run.id).count() == 1
+    
+    monkeypatch.setattr(tasks, "line_item_values", line_item_values)
+    calculated = []
+    calculate_pay_batch = tasks.calculate_pay_batch
+    
+    def record_calculation(salaries, table):
+        calculated.append(salaries)
+        return calculate_pay_batch(salaries, table)
+    
+    monkeypatch.setattr(tasks, "calculate_pay_batch", record_calculation)
+    payroll_run.status = PayrollStatus.PENDING
+    test_db.commit()
+    result = process_payroll.run(payroll_run.id)
+    
+    test_db.refresh(payroll_run)
+    assert payroll_run.status == PayrollStatus.COMPLETED
+    assert payroll_run.attempt == 2
+    assert result["resumed"] == 1
+    assert calculated == [[Decimal("40000.00")]]
+    assert b"/Count 2 >>" in open(
+        LocalStorage(str(payroll_worker.storage)).local_path(payroll_run.pdf_key), "rb"
+    ).read()
+
+
+def test_run_streams_employees_in_batches(test_db, payroll_worker, monkeypatch):
+    """Test that a run reads employees a batch at a time and builds the PDF from stored line items"""
+    monkeypatch.setattr(tasks, "CHECKPOINT_SIZE", 2)
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name=f"Employee {i}", salary=40000 + i * 1000) for i in range(5)
+    ])
+    test_db.add(Employee(family_office_id=office.id, name="Not Requested", salary=90000))
+    test_db.commit()
+    employee_ids = [employee.id for employee in test_db.query(Employee).order_by(Employee.id)][:5]
+    payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, employee_ids=employee_ids)
+    test_db.add(payroll_run)
+    test_db.commit()
+    
+    batches = []
+    employee_batches = tasks.employee_batches
+    
+    def record_batches(*args):
+        for batch in employee_batches(*args):
+            batches.append([employee.id for employee in batch])
+            yield batch
+    
+    monkeypatch.setattr(tasks, "employee_batches", record_batches)
+    result = process_payroll.run(payroll_run.id)
+    
+    assert result["employees_processed"] == 5
+    assert batches == [employee_ids[0:2], employee_ids[2:4], employee_ids[4:5]]
+    assert all(isinstance(employee, tasks.StubEmployee) for employee in next(employee_batches(test_db, payroll_run, 2)))
+    items = test_db.query(PayrollLineItem).filter_by(payroll_run_id=payroll_run.id).order_by(PayrollLineItem.employee_id)
+    assert [item.employee_id for item in items] == employee_ids
+    test_db.refresh(payroll_run)
+    assert b"/Count 5 >>" in open(
+        LocalStorage(str(payroll_worker.storage)).local_path(payroll_run.pdf_key), "rb"
+    ).read()
+
+
+def test_redelivered_message_takes_over_processing_run(test_db, payroll_worker):
+    """Test that a message redelivered after its worker was lost resumes the run without waiting for the reaper"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add(Employee(family_office_id=office.id, name="Ann Lee", salary=50000))
+    payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PROCESSING, attempt=1,
+                             started_at=datetime.utcnow(), heartbeat_at=datetime.utcnow())
+    test_db.add(payroll_run)
+    test_db.commit()
+    
+    # A duplicate message leaves a run another worker is heartbeating alone
+    assert process_payroll.run(payroll_run.id)["skipped"]
+    
+    process_payroll.push_request(delivery_info={"redelivered": True})
+    try:
+        result = process_payroll.run(payroll_run.id)
+    finally:
+        process_payroll.pop_request()
+    
+    assert result["status"] == "completed"
+    test_db.refresh(payroll_run)
+    assert (payroll_run.status, payroll_run.attempt) == (PayrollStatus.COMPLETED, 2)
+    # The lost worker's attempt is fenced out
+    with pytest.raises(scheduling.RunSuperseded):
+        scheduling.checkpoint(test_db, payroll_run.id, 1)
+
+
+def test_failure_before_claiming_keeps_a_run_claimed_elsewhere(test_db, payroll_worker, monkeypatch):
+    """Test that a worker failing before it took the run does not mark a run another worker claimed as failed"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    claimed = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+    unclaimed = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+    test_db.add_all([claimed, unclaimed])
+    test_db.commit()
+    Session = sessionmaker(bind=test_db.get_bind())
+    
+    def claimed_elsewhere_then_fail(db, payroll_run, take_over=False):
+        if payroll_run.id == claimed.id:
+            with Session() as other:
+                scheduling.acquire_run_slot(other, other.get(PayrollRun, payroll_run.id))
+        raise RuntimeError("database went away")
+    
+    monkeypatch.setattr(tasks, "acquire_run_slot", claimed_elsewhere_then_fail)
+    for payroll_run in (claimed, unclaimed):
+        with pytest.raises(RuntimeError):
+            process_payroll.run(payroll_run.id)
+    
+    test_db.expire_all()
+    assert (claimed.status, claimed.attempt) == (PayrollStatus.PROCESSING, 1)
+    assert unclaimed.status == PayrollStatus.FAILED
+
+
+def test_reaper_requeues_stalled_runs_and_fences_old_attempt(test_db, payroll_worker, monkeypatch):
+    """Test that a stalled run is requeued and its old worker can no longer write"""
+    requeued = []
+    monkeypatch.setattr(tasks, "enqueue_payroll_run", lambda run_id, route: requeued.append((run_id, route.queue)))
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    stale = datetime.utcnow() - scheduling.STALL_TIMEOUT - timedelta(seconds=1)
+    stalled = PayrollRun(family_office_id=office.id, status=PayrollStatus.PROCESSING, queue="payroll.large",
+                         attempt=1, heartbeat_at=stale)
+    alive = PayrollRun(family_office_id=office.id, status=PayrollStatus.PROCESSING, attempt=1,
+                       heartbeat_at=datetime.utcnow())
+    test_db.add_all([stalled, alive])
+    test_db.commit()
+    
+    assert tasks.reap_stalled_runs.run() == [stalled.id]
+    assert requeued == [(stalled.id, "payroll.large")]
+    test_db.refresh(stalled)
+    assert stalled.status == PayrollStatus.PENDING
+    
+    # The requeued attempt takes over; the original worker is fenced out
+    assert scheduling.acquire_run_slot(test_db, stalled)
+    assert stalled.attempt == 2
+    with pytest.raises(scheduling.RunSuperseded):
+        scheduling.checkpoint(test_db, stalled.id, 1)
+    scheduling.checkpoint(test_db, stalled.id, 2)
+
+
+def test_acquire_run_slot_lets_one_of_two_workers_take_a_run(tmp_path):
+    """Test that two workers that both read a pending run cannot both take it"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'slots.db'}")
+    Base.metadata.create_all(engine)
+    Session = sessionmaker(autoflush=False, bind=engine)
+    with Session() as setup:
+        office = FamilyOffice(name="Test Office")
+        setup.add(office)
+        setup.commit()
+        payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+        setup.add(payroll_run)
+        setup.commit()
+        run_id = payroll_run.id
+
+    first, second = Session(), Session()
+    try:
+        # Both workers read the run before either takes it
+        first_run = first.get(PayrollRun, run_id)
+        second_run = second.get(PayrollRun, run_id)
+        assert first_run.attempt == second_run.attempt == 0
+
+        assert scheduling.acquire_run_slot(first, first_run)
+        with pytest.raises(scheduling.RunSuperseded):
+            scheduling.acquire_run_slot(second, second_run)
+    finally:
+        first.close()
+        second.close()
+
+    with Session() as check:
+        payroll_run = check.get(PayrollRun, run_id)
+        assert (payroll_run.status, payroll_run.attempt) == (PayrollStatus.PROCESSING, 1)
+    assert first_run.attempt == 1
+
+
+def test_bulk_import_upserts_and_reports_errors(test_db):
+    """Test batched upserts on external_id, per-row errors and the export round trip"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    engine = test_db.get_bind()
+    csv_file = io.BytesIO(
+        b"external_id,name,salary\n"
+        b"E1,Ann Lee,60000\n"
+        b"E2,Bob Ray,40000.50\n"
+        b",No Id,1000\n"
+        b"E3,Cy Doe,lots\n"
+        b"E4,Di Fox,10.001\n"
+        b"E5,Ed Go,55000\n"
+        b"E1,Ann Lee-Smith,61000\n"
+    )
+    report = bulk_io.import_employees(engine, office.id, bulk_io.iter_csv_rows(csv_file), batch_size=2)
+    assert (report.rows, report.inserted, report.updated, report.error_count) == (7, 3, 1, 3)
+    assert [error["row"] for error in report.errors] == [3, 4, 5]
+    
+    report = bulk_io.import_employees(
+        engine, office.id, [{"external_id": "E2", "name": "Bob Ray", "salary": "45000"}]
+    )
+    assert (report.inserted, report.updated) == (0, 1)
+    
+    out = io.BytesIO()
+    bulk_io.export_employees(engine, office.id, out, "csv")
+    lines = out.getvalue().decode().splitlines()
+    assert lines[0] == "external_id,name,salary,id"
+    assert [line.rsplit(",", 1)[0] for line in lines[1:]] == [
+        "E1,Ann Lee-Smith,61000.00", "E2,Bob Ray,45000.00", "E5,Ed Go,55000.00"
+    ]
+    
+    # The export can be imported again as is
+    report = bulk_io.import_employees(engine, office.id, bulk_io.iter_csv_rows(io.BytesIO(out.getvalue())))
+    assert (report.inserted, report.updated, report.error_count) == (0, 3, 0)
+
+
+@pytest.mark.asyncio
+async def test_employee_export_streams_csv(api):
+    """Test the streaming export endpoint and import header validation"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000])
+    
+    response = await api.get("/employees/export", headers=auth_headers(office_id))
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = response.text.splitlines()
+    assert rows[0] == "external_id,name,salary,id"
+    assert [row.rsplit(",", 1)[1] for row in rows[1:]] == [str(i) for i in employee_ids]
+    
+    response = await api.post(
+        "/employees/import", files={"file": ("staff.csv", b"id,name\n1,Ann\n", "text/csv")},
+        headers=auth_headers(office_id)
+    )
+    assert response.status_code == 400
+    assert "external_id" in response.json()["detail"]
+
+
+@pytest.mark.asyncio
+async def test_employee_import_rejects_malformed_csv(api):
+    """Test that a CSV the reader cannot parse is a 400 naming the row, not a 500"""
+    office_id, _ = await seed_office(api, "Smith", [50000])
+    for data, detail in [
+        # Longer than the csv module's field size limit
+        (b"external_id,name,salary\nE1,Ann,1\nE2," + b"x" * 200000 + b",2\n", "Row 2: field larger"),
+        # Not UTF-8; decoded a buffer at a time, so without a row
+        (b"external_id,name,salary\nE1,B\xffb,2\n", "Cannot read the CSV header"),
+        (b"external_id,name,salary\n" + b"E1,Ann,1\n" * 2000 + b"E2,B\xffb,2\n", "File is not UTF-8"),
+    ]:
+        response = await api.post(
+            "/employees/import", files={"file": ("staff.csv", data, "text/csv")},
+            headers=auth_headers(office_id)
+        )
+        assert response.status_code == 400
+        assert response.json()["detail"].startswith(detail)
+
+
+def metric_value(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0
+
+
+@pytest.mark.asyncio
+async def test_metrics_endpoint_reports_requests_and_queries(api, monkeypatch):
+    """Test request latency by route template and database query timings"""
+    monkeypatch.setattr(main, "read_queue_depth", lambda: None)
+    office_id, employee_ids = await seed_office(api, "Smith", [50000])
+    labels = {"method": "GET", "route": "/payroll/{run_id}", "status": "404"}
+    requests_before = metric_value("http_request_duration_seconds_count", **labels)
+    selects_before = metric_value("db_query_duration_seconds_count", operation="SELECT")
+    
+    await api.get("/payroll/12345", headers=auth_headers(office_id))
+    response = await api.get("/metrics")
+    
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain")
+    assert 'http_request_duration_seconds_count{method="GET",route="/payroll/{run_id}",status="404"}' in response.text
+    assert metric_value("http_request_duration_seconds_count", **labels) == requests_before + 1
+    assert metric_value("db_query_duration_seconds_count", operation="SELECT") > selects_before
+
+
+def test_process_payroll_records_stage_timings(test_db, payroll_worker):
+    """Test that each run observes its load, calculate, render and write time"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add(Employee(family_office_id=office.id, name="Ann Lee", salary=60000))
+    payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, queue="payroll.small")
+    test_db.add(payroll_run)
+    test_db.commit()
+    stages = ("load", "calculate", "render", "write")
+    before = {stage: metric_value("payroll_stage_duration_seconds_count", stage=stage) for stage in stages}
+    waits_before = metric_value("payroll_queue_wait_seconds_count", queue="payroll.small")
+    
+    process_payroll.run(payroll_run.id)
+    
+    for stage in stages:
+        assert metric_value("payroll_stage_duration_seconds_count", stage=stage) == before[stage] + 1
+    assert metric_value("payroll_queue_wait_seconds_count", queue="payroll.small") == waits_before + 1
+
+
+def test_queue_wait_is_labelled_with_the_routed_queue(test_db, payroll_worker):
+    """Test that queue waits are labelled per queue, runs with an unknown queue counting as small"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add(Employee(family_office_id=office.id, name="Ann Lee", salary=60000))
+    runs = [
+        PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, queue=queue)
+        for queue in ("payroll.priority", "payroll.large", "celery", None)
+    ]
+    test_db.add_all(runs)
+    test_db.commit()
+    before = {queue: metric_value("payroll_queue_wait_seconds_count", queue=queue) for queue in scheduling.PAYROLL_QUEUES}
+    
+    for payroll_run in runs:
+        process_payroll.run(payroll_run.id)
+    
+    assert {
+        queue: metric_value("payroll_queue_wait_seconds_count", queue=queue) - before[queue]
+        for queue in scheduling.PAYROLL_QUEUES
+    } == {"payroll.priority": 1, "payroll.large": 1, "payroll.small": 2}
+    assert REGISTRY.get_sample_value("payroll_queue_wait_seconds_count", {"queue": "celery"}) is None
+
+
+def test_queue_depth_is_read_from_the_broker():
+    """Test payroll_queue_depth through an in-memory broker"""
+    with Connection("memory://") as connection:
+        tasks.enqueue_payroll_run(1, route_run(10), connection=connection)
+        tasks.enqueue_payroll_run(2, route_run(10), connection=connection)
+        metrics.update_queue_depth(connection, scheduling.PAYROLL_QUEUES + ("missing",))
+        assert metric_value("payroll_queue_depth", queue="payroll.small") == 2
+        assert REGISTRY.get_sample_value("payroll_queue_depth", {"queue": "missing"}) is None
+        with connection.SimpleQueue("payroll.small") as simple_queue:
+            for _ in range(2):
+                simple_queue.get(timeout=1).ack()
+
+
+def test_api_startup_defers_worker_modules_and_schema(tmp_path):
+    """Test that importing and starting the API loads no worker stack and touches no schema"""
+    code = (
+        "import asyncio, sys, main\n"
+        "asyncio.run(main.app.router.startup())\n"
+        "print(sorted(m for m in ('celery', 'reportlab', 'numpy', 'tasks', 'init_db') if m in sys.modules))\n"
+    )
+    database_path = tmp_path / "startup.db"
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{database_path}", PAYROLL_BOOTSTRAP_DB="false")
+    env.pop("ASYNC_DATABASE_URL", None)
+    result = subprocess.run(
+        [sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        env=env, capture_output=True, text=True, check=True
+    )
+    
+    assert result.stdout.strip().splitlines()[-1] == "[]"
+    assert not database_path.exists() or database_path.stat().st_size == 0
+
+
+def test_scheduled_batch_creates_runs_for_due_offices_once(test_db):
+    """Test pay day selection, short months, one run per period and grouping"""
+    offices = [
+        FamilyOffice(name="Mid Month", payroll_day=15),
+        FamilyOffice(name="Month End", payroll_day=31),
+        FamilyOffice(name="Manual Only"),
+    ]
+    test_db.add_all(offices)
+    test_db.commit()
+    test_db.add_all(
+        [Employee(family_office_id=offices[0].id, name=f"Mid {i}", salary=50000) for i in range(3)]
+        + [Employee(family_office_id=offices[1].id, name="End 1", salary=60000)]
+    )
+    test_db.commit()
+    
+    # The 31st falls on February 28th
+    assert batches.due_offices(test_db, date(2026, 2, 14)) == []
+    due = batches.due_offices(test_db, date(2026, 2, 27))
+    assert due == [(offices[0].id, 3)]
+    batch, runs = batches.create_batch(test_db, due, date(2026, 2, 27))
+    assert (batch.pay_period, batch.office_count, batch.employee_count) == ("2026-02", 1, 3)
+    assert [(run.family_office_id, run.pay_period, run.batch_id) for run in runs] == [
+        (offices[0].id, "2026-02", batch.id)
+    ]
+    
+    # Later in the month only the office that is newly due gets a run
+    due = batches.due_offices(test_db, date(2026, 2, 28))
+    assert due == [(offices[1].id, 1)]
+    # A second scheduler racing for the same period creates nothing
+    assert batches.create_batch(test_db, [batches.DueOffice(offices[0].id, 3)], date(2026, 2, 28)) is None
+    
+    runs = [SimpleNamespace(id=i, family_office_id=i) for i in range(1, 6)]
+    groups = batches.group_runs(runs, {1: 3, 2: 3, 3: 9, 4: 1, 5: 1}, max_employees=6, max_offices=2)
+    assert groups == [([1, 2], 6), ([3], 9), ([4, 5], 2)]
+
+
+def test_payroll_group_processes_offices_from_one_scan(test_db, payroll_worker, monkeypatch):
+    """Test that a group task completes every run of its batch and reports timings"""
+    monkeypatch.setattr(tasks.process_payroll_group, "update_state", lambda **kwargs: None)
+    offices = [FamilyOffice(name=f"Office {i}", payroll_day=1) for i in range(3)]
+    test_db.add_all(offices)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name=f"Employee {i}", salary=40000 + i * 1000)
+        for office in offices[:2] for i in range(2)
+    ])
+    test_db.commit()
+    today = date(2026, 3, 1)
+    batch, runs = batches.create_batch(test_db, batches.due_offices(test_db, today), today)
+    # Offices are read a batch at a time rather than loaded whole
+    monkeypatch.setattr(tasks, "CHECKPOINT_SIZE", 1)
+    assert [(office_id, list(office_batches)) for office_id, office_batches in batches.office_employees(
+        test_db.get_bind(), [office.id for office in offices], 1
+    )] == [
+        (office.id, [[(office.id, employee.id, employee.name, employee.salary)] for employee in office.employees])
+        for office in offices
+    ]
+    scans, batch_sizes = [], []
+    office_employees = batches.office_employees
+    
+    def record_scan(bind, office_ids, batch_size):
+        scans.append(office_ids)
+        for office_id, office_batches in office_employees(bind, office_ids, batch_size):
+            yield office_id, (batch_sizes.append(len(batch)) or batch for batch in office_batches)
+    
+    monkeypatch.setattr(tasks, "office_employees", record_scan)
+    
+    result = tasks.process_payroll_group.run(batch.id, [run.id for run in runs])
+    
+    assert scans == [[office.id for office in offices]]
+    assert batch_sizes == [1, 1, 1, 1]
+    assert set(result["office_seconds"]) == {office.id for office in offices}
+    test_db.expire_all()
+    assert [run.status for run in runs] == [PayrollStatus.COMPLETED] * 3
+    assert [run.rebuilt_count for run in runs] == [2, 2, 0]
+    report = batches.batch_report(test_db, batch.id)
+    assert report["wall_seconds"] is not None
+    assert [office["employees"] for office in report["offices"]] == [2, 2, 0]
+    assert all(office["seconds"] is not None for office in report["offices"])
+
+
+@pytest.mark.asyncio
+async def test_fast_json_path_matches_standard_responses(api, monkeypatch):
+    """Test that the orjson path encodes salaries, datetimes and headers like the Pydantic path"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000.5, 70000.25])
+    headers = {**auth_headers(office_id), "Idempotency-Key": "run-1"}
+    
+    async def responses():
+        listed = await api.get("/employees", headers=headers)
+        streamed = await api.get("/employees", params={"format": "ndjson"}, headers=headers)
+        submitted = await api.post("/payroll/run", json={"employee_ids": employee_ids}, headers=headers)
+        status = await api.get(f"/payroll/{submitted.json()['id']}", headers=headers)
+        return listed, streamed, submitted, status
+    
+    standard = await responses()
+    monkeypatch.setattr(main, "FAST_JSON", True)
+    fast = await responses()
+    
+    for before, after in zip(standard, fast):
+        assert after.status_code == before.status_code == 200
+        assert [json.loads(line) for line in after.text.splitlines()] == \
+            [json.loads(line) for line in before.text.splitlines()]
+    assert fast[0].json()[1]["salary"] == 60000.5
+    assert fast[2].headers["idempotent-replayed"] == "true"
+    assert fast[3].json()["created_at"] == standard[3].json()["created_at"]
+    
+    completed_at = datetime(2024, 3, 1, 12, 30, 15, 250000)
+    assert json.loads(responses_module.dumps({"salary": Decimal("60000.50"), "at": completed_at})) == {
+        "salary": 60000.5, "at": "2024-03-01T12:30:15.250000"
+    }
+
+
+def test_completed_runs_update_payroll_summaries(test_db, payroll_worker):
+    """Test that each completed run is added once to its run and period summaries"""
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob Ray", salary=40000.50),
+    ])
+    runs = [
+        PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING),
+        PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING),
+        PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, pay_period="2020-01"),
+    ]
+    test_db.add_all(runs)
+    test_db.commit()
+    for payroll_run in runs:
+        process_payroll.run(payroll_run.id)
+    process_payroll.run(runs[0].id)
+    
+    summary = test_db.get(PayrollRunSummary, runs[0].id)
+    assert summary.headcount == 2
+    assert summary.gross_pay == Decimal("100000.50")
+    assert summary.gross_pay - summary.tax - summary.deductions == summary.net_pay
+    
+    periods = {period.pay_period: period for period in test_db.query(PayrollPeriodSummary)}
+    current = periods[datetime.utcnow().strftime("%Y-%m")]
+    assert (current.run_count, current.headcount, current.gross_pay) == (2, 4, Decimal("200001.00"))
+    assert (periods["2020-01"].run_count, periods["2020-01"].net_pay) == (1, summary.net_pay)
+    
+    before = [(row.pay_period, row.run_count, row.headcount, row.net_pay) for row in periods.values()]
+    assert reports.rebuild_summaries(test_db) == 3
+    rebuilt = test_db.query(PayrollPeriodSummary).all()
+    assert sorted((row.pay_period, row.run_count, row.headcount, row.net_pay) for row in rebuilt) == sorted(before)
+
+
+@pytest.mark.asyncio
+async def test_payroll_reports_filter_summaries_by_date(api):
+    """Test that /payroll/reports serves an office's period and run summaries in a date range"""
+    office_id, _ = await seed_office(api, "Smith", [50000])
+    other_office_id, _ = await seed_office(api, "Jones", [50000])
+    async with api.db() as db:
+        for number, (office, period) in enumerate(
+            [(office_id, "2024-01"), (office_id, "2024-02"), (office_id, "2024-03"), (other_office_id, "2024-02")],
+            start=1
+        ):
+            payroll_run = PayrollRun(family_office_id=office, status=PayrollStatus.COMPLETED)
+            db.add(payroll_run)
+            await db.flush()
+            totals = dict(headcount=number, gross_pay=1000 * number, tax=200 * number, deductions=0,
+                          net_pay=800 * number)
+            db.add(PayrollRunSummary(
+                payroll_run_id=payroll_run.id, family_office_id=office, pay_period=period,
+                completed_at=datetime.strptime(period + "-28", "%Y-%m-%d"), **totals
+            ))
+            db.add(PayrollPeriodSummary(
+                family_office_id=office, pay_period=period, run_count=1, updated_at=datetime.utcnow(), **totals
+            ))
+        await db.commit()
+    
+    response = await api.get(
+        "/payroll/reports", params={"start": "2024-02-01", "end": "2024-03-31"}, headers=auth_headers(office_id)
+    )
+    assert response.status_code == 200
+    report = response.json()
+    assert [(period["pay_period"], period["net_pay"]) for period in report["periods"]] == [
+        ("2024-02", 1600.0), ("2024-03", 2400.0)
+    ]
+    assert report["runs"] == []
+    
+    response = await api.get(
+        "/payroll/reports", params={"start": "2024-02-15", "runs": "true", "limit": 1}, headers=auth_headers(office_id)
+    )
+    assert [run["pay_period"] for run in response.json()["runs"]] == ["2024-03"]
+    
+    response = await api.get(
+        "/payroll/reports", params={"start": "2024-03-01", "end": "2024-02-01"}, headers=auth_headers(office_id)
+    )
+    assert response.status_code == 400
+
+
+def test_archival_bundles_old_runs_and_keeps_shared_stubs(test_db, payroll_worker, monkeypatch):
+    """Test that archived runs are bundled and only PDFs no unarchived run uses are deleted"""
+    monkeypatch.setattr(tasks, "WRITE_INDIVIDUAL_STUBS", True)
+    monkeypatch.setattr(tasks, "stub_period", lambda template: "March 2024")
+    local = LocalStorage(str(payroll_worker.storage))
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    ann = Employee(family_office_id=office.id, name="Ann Lee", salary=60000)
+    bob = Employee(family_office_id=office.id, name="Bob Ray", salary=40000)
+    test_db.add_all([ann, bob])
+    test_db.commit()
+    
+    # Ann's stub is shared by every run, Bob's changes each time
+    runs = []
+    for salary in (40000, 50000, 55000):
+        bob.salary = salary
+        payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING, incremental=True)
+        test_db.add(payroll_run)
+        test_db.commit()
+        process_payroll.run(payroll_run.id)
+        runs.append(payroll_run)
+    stubs = {
+        (item.payroll_run_id, item.employee_id): item.stub_key for item in test_db.query(PayrollLineItem)
+    }
+    ann_stub = stubs[(runs[0].id, ann.id)]
+    assert stubs[(runs[2].id, ann.id)] == ann_stub
+    ann_stub_bytes = open(local.local_path(ann_stub), "rb").read()
+    
+    now = datetime.utcnow() + timedelta(days=100)
+    report = bundles.archive_old_runs(test_db, local, older_than_days=90, now=now)
+    
+    # The latest run is kept for incremental runs to build on
+    assert report.runs == 2
+    assert report.objects_deleted == 4
+    assert report.reclaimed_bytes == report.bytes_deleted - report.bundle_bytes
+    assert local.exists(ann_stub) and local.exists(runs[2].pdf_key)
+    for payroll_run in runs[:2]:
+        test_db.refresh(payroll_run)
+        assert payroll_run.archived_at is not None
+        assert not local.exists(payroll_run.pdf_key)
+        assert not local.exists(stubs[(payroll_run.id, bob.id)])
+        with zipfile.ZipFile(local.local_path(payroll_run.bundle_key)) as bundle:
+            assert bundle.namelist() == [
+                "all_pay_stubs.pdf", f"{ann.id}_Ann_Lee_paystub.pdf", f"{bob.id}_Bob_Ray_paystub.pdf"
+            ]
+            assert bundle.read(f"{ann.id}_Ann_Lee_paystub.pdf") == ann_stub_bytes
+            assert bundle.getinfo("all_pay_stubs.pdf").compress_type == zipfile.ZIP_DEFLATED
+    
+    assert bundles.archive_old_runs(test_db, local, older_than_days=90, now=now).runs == 0
+
+
+def test_bundles_render_stubs_runs_did_not_store(test_db, payroll_worker, monkeypatch):
+    """Test that with individual stubs off (the default) a bundle still has every employee's stub"""
+    assert not tasks.WRITE_INDIVIDUAL_STUBS
+    local = LocalStorage(str(payroll_worker.storage))
+    office = FamilyOffice(name="Test Office")
+    test_db.add(office)
+    test_db.commit()
+    test_db.add_all([
+        Employee(family_office_id=office.id, name="Ann Lee", salary=60000),
+        Employee(family_office_id=office.id, name="Bob / Ray", salary=40000),
+    ])
+    test_db.commit()
+    runs = []
+    for _ in range(2):
+        payroll_run = PayrollRun(family_office_id=office.id, status=PayrollStatus.PENDING)
+        test_db.add(payroll_run)
+        test_db.commit()
+        process_payroll.run(payroll_run.id)
+        runs.append(payroll_run)
+    
+    rendered = []
+    generate = pay_stubs.generate_pay_stub_pdf
+    monkeypatch.setattr(pay_stubs, "generate_pay_stub_pdf", lambda employee, pay, *args: (
+        rendered.append((employee.id, employee.name, pay.net_pay)), generate(employee, pay, *args)
+    ))
+    assert bundles.archive_old_runs(test_db, local, older_than_days=90, now=datetime.utcnow() + timedelta(days=100)).runs == 1
+    test_db.refresh(runs[0])
+    items = test_db.query(PayrollLineItem).filter_by(payroll_run_id=runs[0].id).order_by(PayrollLineItem.employee_id)
+    with zipfile.ZipFile(local.local_path(runs[0].bundle_key)) as bundle:
+        assert bundle.namelist() == ["all_pay_stubs.pdf"] + [
+            f"{item.employee_id}_{item.employee_name.replace(' ', '_').replace('/', '_')}_paystub.pdf"
+            for item in items
+        ]
+        for item in items:
+            assert bundle.read(bundles.stub_entry_name(item.employee_id, item.employee_name)).startswith(b"%PDF-")
+    assert rendered == [(item.employee_id, item.employee_name, item.net_pay) for item in items]
+
+
+@pytest.mark.asyncio
+async def test_bundle_download_streams_zip_of_stubs(api, tmp_path, monkeypatch):
+    """Test that a run's stubs are streamed as a ZIP, and an archived run's stored bundle is served"""
+    office_id, employee_ids = await seed_office(api, "Smith", [50000, 60000])
+    local = LocalStorage(str(tmp_path))
+    monkeypatch.setattr(main, "get_storage", lambda: local)
+    rendered = []
+    generate = pay_stubs.generate_pay_stub_pdf
+    monkeypatch.setattr(pay_stubs, "generate_pay_stub_pdf", lambda employee, pay, *args: (
+        rendered.append((employee.name, pay.net_pay)), generate(employee, pay, *args)
+    ))
+    contents = {}
+    
+    def put(name, data):
+        source = tmp_path / name
+        source.write_bytes(data)
+        key = storage.store_file(local, str(source), suffix=os.path.splitext(name)[1])
+        contents[key] = data
+        return key
+    
+    pdf_key = put("all.pdf", b"%PDF-all" * 20000)
+    stub_keys = [put(f"{employee_id}.pdf", b"%PDF-" + bytes([employee_id]) * 1000) for employee_id in employee_ids]
+    async with api.db() as db:
+        run = PayrollRun(family_office_id=office_id, status=PayrollStatus.COMPLETED, pdf_key=pdf_key)
+        db.add(run)
+        await db.flush()
+        db.add_all([
+            PayrollLineItem(
+                payroll_run_id=run.id, employee_id=employee_id, employee_name=f"Smith Employee {number}",
+                gross_pay=1, tax=0, net_pay=1, stub_key=stub_key
+            )
+            for number, (employee_id, stub_key) in enumerate(zip(employee_ids, stub_keys), start=1)
+        ])
+        await db.commit()
+        run_id = run.id
+    
+    async with api.db() as db:
+        db.add(PayrollLineItem(
+            payroll_run_id=run_id, employee_id=employee_ids[1] + 1, employee_name="Smith Employee 3",
+            gross_pay=Decimal("50000.00"), tax=Decimal("10000.00"), net_pay=Decimal("40000.00"),
+            deduction_lines=[["401(k)", "0.00"]]
+        ))
+        await db.commit()
+    
+    response = await api.get(f"/payroll/{run_id}/bundle", headers=auth_headers(office_id))
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "application/zip"
+    with zipfile.ZipFile(io.BytesIO(response.content)) as bundle:
+        assert bundle.namelist() == [
+            "all_pay_stubs.pdf",
+            f"{employee_ids[0]}_Smith_Employee_1_paystub.pdf",
+            f"{employee_ids[1]}_Smith_Employee_2_paystub.pdf",
+            f"{employee_ids[1] + 1}_Smith_Employee_3_paystub.pdf",
+        ]
+        assert bundle.read("all_pay_stubs.pdf") == contents[pdf_key]
+        assert bundle.read(f"{employee_ids[1]}_Smith_Employee_2_paystub.pdf") == contents[stub_keys[1]]
+        # Its stub was not stored, so it is rendered from the line item
+        assert bundle.read(f"{employee_ids[1] + 1}_Smith_Employee_3_paystub.pdf").startswith(b"%PDF-")
+    assert rendered == [("Smith Employee 3", Decimal("40000.00"))]
+    assert len(response.content) < len(contents[pdf_key])
+    
+    bundle_key = put("bundle.zip", response.content)
+    async with api.db() as db:
+        run = await db.get(PayrollRun, run_id)
+        run.bundle_key, run.archived_at = bundle_key, datetime.utcnow()
+        await db.commit()
+    response = await api.get(f"/payroll/{run_id}/bundle", headers=auth_headers(office_id))
+    assert response.content == contents[bundle_key]
+    assert response.headers["etag"] == storage.etag(bundle_key)
+    response = await api.get(f"/payroll/{run_id}/pdf", headers=auth_headers(office_id))
+    assert response.status_code == 410
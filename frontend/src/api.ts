@@ -47,6 +47,19 @@ export interface PayrollRun {
   status: 'pending' | 'processing' | 'completed' | 'failed';
   created_at: string;
   completed_at: string | null;
+  incremental: boolean;
+  reused_count: number | null;
+  rebuilt_count: number | null;
+}
+
+export interface PayrollEvent {
+  status: PayrollRun['status'];
+  current?: number;
+  total?: number;
+  progress?: number;
+  completed_at?: string;
+  reused_count?: number;
+  rebuilt_count?: number;
 }
 
 export const authApi = {
@@ -62,14 +75,21 @@ export const authApi = {
 
 export const employeeApi = {
   getAll: async (): Promise<Employee[]> => {
-    const response = await api.get('/employees');
-    return response.data;
+    // Follow the keyset cursor until the last page
+    const employees: Employee[] = [];
+    let cursor: string | undefined;
+    do {
+      const response = await api.get('/employees', { params: { after_id: cursor } });
+      employees.push(...response.data);
+      cursor = response.headers['x-next-cursor'];
+    } while (cursor);
+    return employees;
   },
 };
 
 export const payrollApi = {
-  runPayroll: async (employeeIds: number[]): Promise<PayrollRun> => {
-    const response = await api.post('/payroll/run', { employee_ids: employeeIds });
+  runPayroll: async (employeeIds: number[], incremental = false): Promise<PayrollRun> => {
+    const response = await api.post('/payroll/run', { employee_ids: employeeIds, incremental });
     return response.data;
   },
   
@@ -81,6 +101,12 @@ export const payrollApi = {
   downloadPdf: (runId: number): string => {
     return `/api/payroll/${runId}/pdf`;
   },
+
+  // EventSource cannot send headers, so the token goes in the query string
+  eventsUrl: (runId: number): string => {
+    const token = localStorage.getItem('token');
+    return `/api/payroll/${runId}/events?access_token=${token}`;
+  },
 };
 
 export default api;
\ No newline at end of file
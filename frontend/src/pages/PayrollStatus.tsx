@@ -1,6 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
-import { payrollApi, PayrollRun } from '../api';
+import { payrollApi, PayrollRun, PayrollEvent } from '../api';
 
 function PayrollStatus() {
   const { runId } = useParams<{ runId: string }>();
@@ -8,18 +8,34 @@ function PayrollStatus() {
   const [payrollRun, setPayrollRun] = useState<PayrollRun | null>(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [progress, setProgress] = useState<number | null>(null);
 
   useEffect(() => {
     if (!runId) return;
+    let events: EventSource | null = null;
     
-    const checkStatus = async () => {
+    const loadStatus = async () => {
       try {
         const data = await payrollApi.getStatus(parseInt(runId));
         setPayrollRun(data);
         
-        // Keep polling if still processing
+        // Follow pushed progress events instead of polling while the run is active
         if (data.status === 'pending' || data.status === 'processing') {
-          setTimeout(checkStatus, 2000); // Poll every 2 seconds
+          events = new EventSource(payrollApi.eventsUrl(parseInt(runId)));
+          events.onmessage = (message) => {
+            const event: PayrollEvent = JSON.parse(message.data);
+            if (event.progress !== undefined) {
+              setProgress(event.progress);
+            }
+            setPayrollRun(run => run && {
+              ...run,
+              status: event.status,
+              completed_at: event.completed_at ?? run.completed_at,
+            });
+            if (event.status === 'completed' || event.status === 'failed') {
+              events?.close();
+            }
+          };
         }
       } catch (err) {
         setError('Failed to load payroll status');
@@ -28,7 +44,8 @@ function PayrollStatus() {
       }
     };
 
-    checkStatus();
+    loadStatus();
+    return () => events?.close();
   }, [runId]);
 
   const handleDownload = () => {
@@ -37,8 +54,9 @@ function PayrollStatus() {
     const token = localStorage.getItem('token');
     const downloadUrl = payrollApi.downloadPdf(parseInt(runId));
     
-    // Create a temporary link with auth header
-    window.open(`${downloadUrl}?token=${token}`, '_blank');
+    // A new window cannot send the auth header, so the token goes in the
+    // query string; the API may redirect to a pre-signed storage URL
+    window.open(`${downloadUrl}?access_token=${token}`, '_blank');
   };
 
   const getStatusColor = (status: string) => {
@@ -54,7 +72,7 @@ function PayrollStatus() {
     if (!payrollRun) return 0;
     switch (payrollRun.status) {
       case 'completed': return 100;
-      case 'processing': return 50;
+      case 'processing': return progress ?? 50;
       case 'failed': return 0;
       default: return 10;
     }